@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# ANIMATION CATALOG EXPORT
+#
+# cozmo_unleashed.py times every animation trigger it plays and notes how far the battery voltage sags while
+# it runs (see ANIMATION CATALOG in its configurable variables), per robot in the calibration file. This prints that
+# catalog as csv (or json) so it can be looked at in a spreadsheet - which animations run long, which ones
+# pull the battery down the most.
+#
+# usage: python3 anim_catalog.py [--calibration cozmo_calibration.json] [--serial serial] [--sort duration|voltage|plays|name] [--json]
+#
+import sys, csv, json, argparse
+import cozmo_unleashed as cu
+
+
+def catalog_rows(calibration, serial=None):
+	rows = []
+	for robotserial, entry in sorted(calibration.items()):
+		if serial is not None and robotserial != serial:
+			continue
+		for name, anim in entry.get('animations', {}).items():
+			rows.append({
+				'serial': robotserial,
+				'trigger': name,
+				'category': cu.robot_anim_category(name),
+				'plays': anim['plays'],
+				'duration': anim['duration'],
+				'voltage': anim['voltage'],
+				# volts per second of animation, what the budget check weighs up against the time left
+				'voltage_per_s': round(anim['voltage'] / anim['duration'], 5) if anim['duration'] > 0 else None,
+			})
+	return rows
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='export the animation catalog from the cozmo_unleashed calibration file')
+	parser.add_argument('--calibration', default=cu.calibrationfile)
+	parser.add_argument('--serial', help='only this robot')
+	parser.add_argument('--sort', default='duration', choices=('duration', 'voltage', 'plays', 'name'))
+	parser.add_argument('--json', action='store_true', help='print json instead of csv')
+	args = parser.parse_args()
+	with open(args.calibration) as f:
+		rows = catalog_rows(json.load(f), args.serial)
+	if args.sort == 'name':
+		rows.sort(key=lambda r: (r['serial'], r['trigger']))
+	elif args.sort == 'voltage':
+		# biggest drop first
+		rows.sort(key=lambda r: r['voltage'])
+	else:
+		rows.sort(key=lambda r: r[args.sort], reverse=True)
+	if args.json:
+		print(json.dumps(rows, indent=1))
+	else:
+		writer = csv.DictWriter(sys.stdout, fieldnames=['serial', 'trigger', 'category', 'plays', 'duration', 'voltage', 'voltage_per_s'])
+		writer.writeheader()
+		writer.writerows(rows)
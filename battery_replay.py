@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+#
+# BATTERY TRACE REPLAY
+#
+# Set batterytracefile in cozmo_unleashed.py to record a voltage trace while Cozmo runs, then feed the
+# trace back through the battery estimator with this script to see when Cozmo would have gone looking
+# for his charger, compared to the old "three raw readings below lowbatvoltage" trigger guard.
+# Handy for tuning batteryfiltertau / batteryratetau / batterydocklead without waiting for a real discharge.
+#
+# usage: python3 battery_replay.py [--lowbatvoltage 3.7] [--docklead 180] [--json] trace.csv [trace.csv ...]
+#
+import sys, csv, json, argparse
+import cozmo_unleashed as cu
+
+
+def replay(path):
+	# one result per stretch off the charger
+	cycles = []
+	cycle = None
+	cu.robot_battery_reset()
+	with open(path) as f:
+		for row in csv.DictReader(f):
+			t = float(row['time'])
+			v = float(row['voltage'])
+			oncharger = row['on_charger'] == '1'
+			cu.robot_battery_update(t, v, oncharger)
+			if oncharger:
+				cycle = None
+				continue
+			if cycle is None:
+				cycle = {'start': t, 'end': t, 'start_voltage': v, 'min_voltage': v, 'raw_breaches': 0, 'raw_trigger': None, 'estimator_trigger': None, 'estimator_voltage': None}
+				cycles.append(cycle)
+			cycle['end'] = t
+			cycle['min_voltage'] = min(cycle['min_voltage'], v)
+			if v <= cu.lowbatvoltage:
+				cycle['raw_breaches'] += 1
+				if cycle['raw_breaches'] > 2 and cycle['raw_trigger'] is None:
+					cycle['raw_trigger'] = round(t - cycle['start'], 1)
+			if cycle['estimator_trigger'] is None and cu.robot_battery_low():
+				cycle['estimator_trigger'] = round(t - cycle['start'], 1)
+				cycle['estimator_voltage'] = round(cu.batteryestimate['voltage'], 3)
+	for cycle in cycles:
+		cycle['duration'] = round(cycle.pop('end') - cycle.pop('start'), 1)
+	return cycles
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='replay recorded battery traces through the battery estimator')
+	parser.add_argument('traces', nargs='+')
+	parser.add_argument('--lowbatvoltage', type=float, default=cu.lowbatvoltage)
+	parser.add_argument('--docklead', type=float, default=cu.batterydocklead)
+	parser.add_argument('--filtertau', type=float, default=cu.batteryfiltertau)
+	parser.add_argument('--ratetau', type=float, default=cu.batteryratetau)
+	parser.add_argument('--json', action='store_true')
+	args = parser.parse_args()
+	cu.lowbatvoltage = args.lowbatvoltage
+	cu.batterydocklead = args.docklead
+	cu.batteryfiltertau = args.filtertau
+	cu.batteryratetau = args.ratetau
+	results = {path: replay(path) for path in args.traces}
+	if args.json:
+		print(json.dumps(results, indent=2))
+		sys.exit(0)
+	for path, cycles in results.items():
+		print(path)
+		for i, c in enumerate(cycles):
+			print('  cycle %d: %ss off charger, %.3fV -> min %.3fV, raw guard at %ss (%d breaches), estimator at %ss (%sV filtered)' % (i + 1, c['duration'], c['start_voltage'], c['min_voltage'], c['raw_trigger'], c['raw_breaches'], c['estimator_trigger'], c['estimator_voltage']))
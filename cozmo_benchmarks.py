@@ -0,0 +1,1028 @@
+#!/usr/bin/env python3
+#
+# BENCHMARKS FOR COZMO_UNLEASHED
+#
+# run with: python3 cozmo_benchmarks.py [name ...]
+# with no names every benchmark is run. These don't need a robot, they drive the functions in
+# cozmo_unleashed.py directly with a stand-in robot, or the whole program against cozmo_sim.py, and print
+# the results as JSON.
+#
+import sys, os, io, re, time, random, json, math, datetime, asyncio, collections, multiprocessing, threading, subprocess, tempfile, queue
+import cozmo
+import cozmo_unleashed as cu
+import cozmo_sim as sim
+
+
+class BenchRobot:
+	# just enough of cozmo.robot.Robot for the functions under test
+	def __init__(self):
+		self.battery_voltage = 4.0
+		self.is_on_charger = False
+		self.sent = 0
+
+	def set_backpack_lights(self, light1, light2, light3, light4, light5):
+		self.sent += 1
+
+	def set_backpack_lights_off(self):
+		self.sent += 1
+
+
+#
+# BACKPACK BATTERY INDICATOR
+# the elif chain robot_backbackbatteryindicator() used before the lookup table, kept here to compare against
+#
+LEGACY_INDICATOR = """
+def legacy_backbackbatteryindicator():
+	global robot,highbatvoltage,lowbatvoltage,maxbatvoltage,lightstate,batlightcounter
+	batmultiplier = ((highbatvoltage - lowbatvoltage)/3)+0.1
+	chargebatmultiplier = ((maxbatvoltage - lowbatvoltage)/3)+0.1
+	critbatmultiplier = ((lowbatvoltage - 3.5)/3)
+	robotvoltage=(robot.battery_voltage)
+	if not lightstate:
+		lightstate = 0
+	oldlightstate = lightstate
+	if robotvoltage > (highbatvoltage-batmultiplier) and statecontext.state==4:
+		# bottom two lights on, third light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=1 and lightstate !=2:
+			lightstate = 1
+			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1)
+			light2=cozmo.lights.Light(on_color=color1)
+			light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage > (highbatvoltage-(batmultiplier*1.5)) and robotvoltage <= (highbatvoltage-batmultiplier) and statecontext.state==4:
+		#bottom one light on, second light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=2 and lightstate !=3:
+			lightstate = 2
+			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1)
+			light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage > (highbatvoltage-(batmultiplier*2.5)) and robotvoltage <= (highbatvoltage-(batmultiplier*1.5)) and statecontext.state==4:
+		# # bottom one light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=3:
+			lightstate = 3
+			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			light2=cozmo.lights.Light(on_color=color2)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage >= lowbatvoltage and statecontext.state==4:
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=4:
+			lightstate = 4
+			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
+			light2=cozmo.lights.Light(on_color=color2)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	#robot_set_backpacklights(65535)  # 65535 is blue
+	elif robotvoltage >= (maxbatvoltage-(chargebatmultiplier/2.5)) and robotvoltage <= (maxbatvoltage-(chargebatmultiplier/3.5)) and statecontext.state==1:
+		# # bottom one light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=7 and lightstate !=6 and lightstate !=5:
+			lightstate = 7
+			color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			light2=cozmo.lights.Light(on_color=color2)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage >= (maxbatvoltage-(chargebatmultiplier/1.0)) and robotvoltage <= (maxbatvoltage-chargebatmultiplier/2.5) and statecontext.state==1:
+		#bottom one light on, second light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=6 and lightstate !=5:
+			lightstate = 6
+			color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1)
+			light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage >= maxbatvoltage and statecontext.state==1:
+		# bottom two lights on, third light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=5:
+			lightstate = 5
+			color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1)
+			light2=cozmo.lights.Light(on_color=color1)
+			light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	# elif robotvoltage >= maxbatvoltage and cozmostate==1:
+		# batlightcounter +=1
+		# if batlightcounter > 5 and lightstate !=8:
+			# lightstate = 8
+			# color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
+			# color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			# light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
+			# light2=cozmo.lights.Light(on_color=color2)
+			# light3=cozmo.lights.Light(on_color=color2)
+			# robot.set_backpack_lights(None, light3, light2, light1, None)
+			# batlightcounter = 0
+		# pass
+	#robot_set_backpacklights(4278190335)  # 4278190335 is red
+
+	elif robotvoltage >= (lowbatvoltage+(critbatmultiplier*1.5)) and robotvoltage <= (lowbatvoltage+critbatmultiplier) and statecontext.state==5:
+		#bottom one light on, second light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=10  and lightstate !=9:
+			lightstate = 10
+			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1)
+			light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage >= (lowbatvoltage+(critbatmultiplier*2.5)) and robotvoltage <= (lowbatvoltage+(critbatmultiplier*1.5)) and statecontext.state==5:
+		# # bottom one light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=11  and lightstate !=10:
+			lightstate = 11
+			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			light2=cozmo.lights.Light(on_color=color2)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage >= (lowbatvoltage+critbatmultiplier) and statecontext.state==5:
+		# bottom two lights on, third light blinking
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=9:
+			lightstate = 9
+			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1)
+			light2=cozmo.lights.Light(on_color=color1)
+			light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	elif robotvoltage >= lowbatvoltage and statecontext.state==5:
+		batlightcounter +=1
+		if batlightcounter > 5 and lightstate !=12:
+			lightstate = 12
+			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
+			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
+			light2=cozmo.lights.Light(on_color=color2)
+			light3=cozmo.lights.Light(on_color=color2)
+			robot.set_backpack_lights(None, light3, light2, light1, None)
+			batlightcounter = 0
+		pass
+	if lightstate==0 or lightstate==99:
+		lightstate=99
+		if robot.is_on_charger:
+			robot_set_backpacklights(65535)  # 16711935 is green
+		else:
+			if robot.battery_voltage > lowbatvoltage:
+				robot_set_backpacklights(16711935)  # 65535 is blue
+			else :
+				robot_set_backpacklights(4278190335)  # 4278190335 is red
+"""
+
+def bench_batterylight(samples=20000):
+	exec(LEGACY_INDICATOR, cu.__dict__)
+	rng = random.Random(1)
+	# a discharge in freeplay, a charge on the dock and the slide into the search state, with some noise on top
+	trace = []
+	for state, start, end in ((4, 4.2, 3.6), (1, 3.6, 4.9), (5, 3.75, 3.5)):
+		for i in range(samples):
+			trace.append((state, start + (end - start) * i / samples + rng.gauss(0, 0.01)))
+	results = {}
+	for name in ('legacy', 'table'):
+		func = cu.legacy_backbackbatteryindicator if name == 'legacy' else cu.robot_backbackbatteryindicator
+		cu.robot = BenchRobot()
+		cu.commandcache.clear()
+		cu.commandpending.clear()
+		cu.lightstate = 0
+		cu.batlightcounter = 0
+		cu.batterylight_key = None
+		states = []
+		start = time.perf_counter()
+		for state, voltage in trace:
+			cu.statecontext.state = state
+			cu.robot.battery_voltage = voltage
+			cu.robot.is_on_charger = state == 1
+			func()
+			states.append(cu.lightstate)
+		elapsed = time.perf_counter() - start
+		results[name] = {'us_per_call': round(elapsed / len(trace) * 1e6, 3), 'messages_sent': cu.robot.sent, 'lightstates': states}
+	same = results['legacy'].pop('lightstates') == results['table'].pop('lightstates')
+	results['identical_lightstates'] = same
+	results['speedup'] = round(results['legacy']['us_per_call'] / results['table']['us_per_call'], 2)
+	return results
+
+
+#
+# CHARGER SEARCH
+# a flat table with the charger somewhere on it; both strategies run the same loop as robot_drive_random_pattern
+# (go to a pose, look ahead, then a 15 second look around in place) and only differ in how the pose is picked
+#
+class SearchTable:
+	def __init__(self, seed, width=1200, depth=800):
+		self.rng = random.Random(seed)
+		self.width = width
+		self.depth = depth
+		self.x = self.rng.uniform(100, width - 100)
+		self.y = self.rng.uniform(100, depth - 100)
+		self.heading = self.rng.uniform(-180, 180)
+		while True:
+			self.cx = self.rng.uniform(50, width - 50)
+			self.cy = self.rng.uniform(50, depth - 50)
+			if math.hypot(self.cx - self.x, self.cy - self.y) > cu.searchviewrange:
+				break
+		self.t = 0.0
+
+	def sees_charger(self, fov):
+		dx = self.cx - self.x
+		dy = self.cy - self.y
+		if math.hypot(dx, dy) > cu.searchviewrange:
+			return False
+		return fov >= 360 or abs((math.degrees(math.atan2(dy, dx)) - self.heading + 180) % 360 - 180) <= fov / 2
+
+	def turn_to(self, heading):
+		self.t += abs((heading - self.heading + 180) % 360 - 180) / 90.0
+		self.heading = heading
+
+	def go_to(self, tx, ty, th):
+		# turn, drive straight, turn - stop at the table edge like the cliff sensor would and back off
+		distance = math.hypot(tx - self.x, ty - self.y)
+		if distance > 1:
+			self.turn_to(math.degrees(math.atan2(ty - self.y, tx - self.x)))
+		step = 0.0
+		while step < distance:
+			nx = self.x + math.cos(math.radians(self.heading)) * min(10, distance - step)
+			ny = self.y + math.sin(math.radians(self.heading)) * min(10, distance - step)
+			if not (0 < nx < self.width and 0 < ny < self.depth):
+				self.t += 3.0
+				cu.search_mark_cliff(self.x, self.y, self.heading)
+				self.x -= math.cos(math.radians(self.heading)) * 100
+				self.y -= math.sin(math.radians(self.heading)) * 100
+				self.x = min(max(self.x, 1), self.width - 1)
+				self.y = min(max(self.y, 1), self.depth - 1)
+				return
+			step += 10
+			self.t += 10 / 40.0
+			self.x = nx
+			self.y = ny
+		self.turn_to(th)
+
+def search_trial(seed, planner, warm, cap):
+	table = SearchTable(seed)
+	cu.search_reset(1)
+	cu.chargerlastseen = None
+	if warm:
+		# docking just failed somewhere near the charger
+		cu.chargerlastseen = (1, table.cx + table.rng.gauss(0, 100), table.cy + table.rng.gauss(0, 100))
+	while table.t < cap:
+		if planner:
+			cu.search_mark_seen(table.x, table.y, table.heading, cu.searchfov)
+			tx, ty, th = cu.search_plan(table.x, table.y, table.heading)
+		else:
+			# the old random pose: 150mm forward or back, 150mm left or right, turned 40 degrees either way
+			rx = table.rng.choice((150, -150))
+			ry = table.rng.choice((150, -150))
+			h = math.radians(table.heading)
+			tx = table.x + rx * math.cos(h) - ry * math.sin(h)
+			ty = table.y + rx * math.sin(h) + ry * math.cos(h)
+			th = table.heading + table.rng.choice((-40, 40))
+		table.go_to(tx, ty, th)
+		if table.sees_charger(cu.searchfov):
+			return table.t + 0.5
+		cu.search_mark_seen(table.x, table.y, table.heading, cu.searchfov)
+		if table.sees_charger(360):
+			return table.t + 7.5
+		table.t += 15
+		cu.search_mark_seen(table.x, table.y, table.heading, 360)
+	return None
+
+def bench_search(trials=300, cap=900):
+	results = {}
+	for warm in (False, True):
+		for planner in (False, True):
+			times = [search_trial(seed, planner, warm, cap) for seed in range(trials)]
+			found = sorted(t for t in times if t is not None)
+			capped = sorted(t if t is not None else cap for t in times)
+			name = ('planner' if planner else 'random') + ('_warm' if warm else '_cold')
+			results[name] = {
+				'found_rate': round(len(found) / trials, 3),
+				'mean_s': round(sum(capped) / trials, 1),
+				'p95_s': round(capped[int(0.95 * (trials - 1))], 1),
+			}
+	return results
+
+
+#
+# RANDOM ANIMATION PICK
+# what robot_check_randomreaction() did before the trigger index: shuffle a copy of every trigger, take the first
+# and swap it for SparkSuccess if it's blacklisted
+#
+def legacy_anim_pick(triggers):
+	all_animation_triggers = list(triggers)
+	random.shuffle(all_animation_triggers)
+	trigger = all_animation_triggers[0]
+	if any(word in trigger.name for word in cu.animblacklist):
+		trigger = cozmo.anim.Triggers.SparkSuccess
+	return trigger
+
+def bench_animpick(samples=50000):
+	triggers = cozmo.anim.Triggers.trigger_list
+	cu.robot_anim_index_build(triggers)
+	results = {}
+	for name in ('legacy', 'index'):
+		random.seed(1)
+		counts = collections.Counter()
+		start = time.perf_counter()
+		for _ in range(samples):
+			trigger = legacy_anim_pick(triggers) if name == 'legacy' else cu.robot_anim_pick()
+			counts[trigger.name] += 1
+		elapsed = time.perf_counter() - start
+		top, topcount = counts.most_common(1)[0]
+		results[name] = {'us_per_pick': round(elapsed / samples * 1e6, 3), 'distinct': len(counts), 'top': top, 'top_share': round(topcount / samples, 3)}
+	# how far the index's picks land from the weights it was built with
+	index = cu.animindex
+	total = sum(index['weights'])
+	results['index']['max_share_error'] = round(max(abs(counts[t.name] / samples - w / total) for t, w in zip(index['triggers'], index['weights'])), 4)
+	results['speedup'] = round(results['legacy']['us_per_pick'] / results['index']['us_per_pick'], 2)
+	return results
+
+
+#
+# ANIMATION RESET
+# putting the head and lift back after an animation, in simulated seconds: the sequence robot_reaction_chance()
+# used before robot_reset_pose() (head, then the lift motor, which it didn't wait for), the same in series but
+# waiting for the lift to get there, and robot_reset_pose(). Every variant follows the same animations
+#
+def legacy_reset(robot):
+	robot.wait_for_all_actions_completed()
+	robot.set_head_angle(cozmo.util.degrees(0)).wait_for_completed()
+	robot.wait_for_all_actions_completed()
+	robot.move_lift(-3)
+	robot.wait_for_all_actions_completed()
+
+def serial_reset(robot):
+	robot.set_head_angle(cozmo.util.degrees(0)).wait_for_completed()
+	robot.set_lift_height(0).wait_for_completed()
+
+def bench_animreset(samples=200):
+	clock = cu.VirtualClock(0.0, sim.simtick)
+	cu.clock = clock
+	cu.loglevel = 3
+	cu.statecontext = cu.StateContext()
+	world = sim.SimWorld(1, {'robot': (600, 400, 0), 'battery': 0.9, 'cubes': []}, clock)
+	world.programthread = threading.current_thread()
+	robot = cu.robot = world.robot
+	cu.robot_anim_index_build(cozmo.anim.Triggers.trigger_list)
+	random.seed(1)
+	picks = [cu.robot_anim_pick() for _ in range(samples)]
+	results = {}
+	for name, reset in (('legacy', legacy_reset), ('serial', serial_reset), ('parallel', lambda robot: cu.robot_reset_pose())):
+		times = []
+		for trigger in picks:
+			robot.play_anim_trigger(trigger).wait_for_completed()
+			start = clock.time()
+			reset(robot)
+			times.append(clock.time() - start)
+		results[name] = {
+			'mean_s': round(sum(times) / samples, 3),
+			'max_s': round(max(times), 3),
+			'skipped': sum(1 for t in times if t < 1e-9),
+			'head_left_deg': round(abs(world.head), 1),
+		}
+	clock.remove_ticker(world.tick)
+	results['saving_vs_legacy_s'] = round(results['legacy']['mean_s'] - results['parallel']['mean_s'], 3)
+	results['saving_vs_serial_s'] = round(results['serial']['mean_s'] - results['parallel']['mean_s'], 3)
+	return results
+
+
+#
+# DOCKING
+# the whole program against cozmo_sim.py on a virtual clock, from the moment the battery runs low until Cozmo is
+# back on his charger. Every trial is a seeded scenario in a group:
+#   distance   - starting somewhere in front of the charger, 150 to 650 mm away
+#   angle      - 350 mm away but at any bearing, including behind the charger
+#   obstacles  - a box or two between Cozmo and the charger, blocking the way and the view
+#   delocalize - like distance, but Cozmo loses track of where he is once he starts driving to the charger
+#   battery    - anywhere on the table with a fuller battery, so freeplay has moved him around before he goes looking
+# Each trial gets a process of its own, the script keeps its state in module globals
+#
+dockgroups = ('distance', 'angle', 'obstacles', 'delocalize', 'battery')
+dockcharger = (450, 400, 0)
+
+def docking_scenario(group, seed):
+	rng = random.Random('%s-%d' % (group, seed))
+	scenario = {'charger': dockcharger, 'battery': 0.335, 'cubes': [(1000, 150), (1050, 650), (250, 700)], 'obstacles': []}
+	while True:
+		if group == 'angle':
+			distance, bearing = 350, rng.uniform(-180, 180)
+		elif group == 'battery':
+			distance, bearing = rng.uniform(150, 650), rng.uniform(-180, 180)
+			scenario['battery'] = rng.uniform(0.36, 0.5)
+		else:
+			distance, bearing = rng.uniform(150, 650), rng.uniform(-30, 30)
+		# bearing and distance are measured from the charger's front, where the docking routine lines up
+		x, y, _ = sim.compose(dockcharger, (sim.dockpoint + distance * math.cos(math.radians(bearing)), distance * math.sin(math.radians(bearing)), 0))
+		if 100 < x < 1100 and 100 < y < 700 and math.hypot(x - dockcharger[0], y - dockcharger[1]) > 150:
+			break
+	scenario['robot'] = (x, y, rng.uniform(-180, 180))
+	if group == 'obstacles':
+		front = sim.compose(dockcharger, (sim.dockpoint, 0, 0))
+		for _ in range(rng.choice((1, 2))):
+			# somewhere on the way, across the line between Cozmo and the charger
+			f = rng.uniform(0.35, 0.65)
+			cx = front[0] + (x - front[0]) * f + rng.gauss(0, 40)
+			cy = front[1] + (y - front[1]) * f + rng.gauss(0, 40)
+			w, h = (30, 60) if abs(x - front[0]) > abs(y - front[1]) else (60, 30)
+			if math.hypot(cx - x, cy - y) > 120:
+				scenario['obstacles'].append((cx - w, cy - h, cx + w, cy + h))
+	return scenario
+
+def docking_trial(args):
+	group, seed, cap, limit = args
+	scenario = docking_scenario(group, seed)
+	clock = cu.VirtualClock(0.0, sim.simtick)
+	cu.clock = clock
+	cu.calibrationfile = None
+	cu.loglevel = 3
+	random.seed(seed)
+	world = sim.SimWorld(seed, scenario, clock)
+	trial = {'delocalized': False}
+	def watch():
+		# ends the trial once docked or once the search runs over cap, and delocalizes on the way in
+		search = cu.docksearch
+		if group == 'delocalize' and not trial['delocalized'] and search and search['found'] is not None and any(a.pathing for a in world.actions):
+			world.delocalize()
+			trial['delocalized'] = True
+		if cu.dockstats['docked'] or (search and clock.time() - search['start'] > cap) or world.t >= limit:
+			world.finished = True
+	clock.add_ticker(watch)
+	sim.run_program(cu.cozmo_unleashed, world)
+	cu.unmonitor(world.robot)
+	stats = cu.dockstats
+	return {
+		'group': group,
+		'seed': seed,
+		'searched': stats['searches'] > 0,
+		'found': stats['found'] > 0,
+		'docked': stats['docked'] > 0,
+		'time_to_find': round(stats['find_time'], 1) if stats['found'] else None,
+		'time_to_dock': round(stats['dock_time'], 1) if stats['docked'] else None,
+		'attempts': stats['attempts'],
+		'first_attempt': stats['first_attempt'] > 0,
+		'fallback': stats['fallbacks'] > 0,
+	}
+
+def docking_summary(trials):
+	searched = [t for t in trials if t['searched']]
+	n = max(len(searched), 1)
+	# some trials end up on the charger without ever backing in (driving over it on the way), these don't say
+	# anything about the docking routine itself
+	attempted = [t for t in searched if t['attempts'] > 0]
+	def spread(values):
+		values = sorted(values)
+		if not values:
+			return None
+		return {'mean_s': round(sum(values) / len(values), 1), 'p95_s': round(values[int(0.95 * (len(values) - 1))], 1)}
+	return {
+		'trials': len(trials),
+		'searched': len(searched),
+		'found_rate': round(sum(t['found'] for t in searched) / n, 3),
+		'dock_rate': round(sum(t['docked'] for t in searched) / n, 3),
+		'first_attempt_rate': round(sum(t['first_attempt'] for t in searched) / n, 3),
+		'attempted': len(attempted),
+		'attempted_first_attempt_rate': round(sum(t['first_attempt'] for t in attempted) / max(len(attempted), 1), 3),
+		'fallback_rate': round(sum(t['fallback'] for t in searched) / n, 3),
+		'attempts_mean': round(sum(t['attempts'] for t in searched) / n, 2),
+		'time_to_find': spread([t['time_to_find'] for t in searched if t['found']]),
+		'time_to_dock': spread([t['time_to_dock'] for t in searched if t['docked']]),
+	}
+
+def bench_docking(trials=8, cap=900, limit=2400):
+	# cap - seconds of searching before a trial counts as not docked; limit - seconds of simulated time in all
+	jobs = [(group, seed, cap, limit) for group in dockgroups for seed in range(trials)]
+	with multiprocessing.Pool(maxtasksperchild=1) as pool:
+		results = pool.map(docking_trial, jobs, chunksize=1)
+	summary = {group: docking_summary([r for r in results if r['group'] == group]) for group in dockgroups}
+	summary['all'] = docking_summary(results)
+	return summary
+
+
+#
+# FLEET
+# n simulated robots as n cozmo_sim.py processes against one cozmo_supervisor.py process running all n. Both run
+# on the real clock sped up, so CPU time is what the robots cost per wall second, simulation included
+#
+def fleet_run(commands):
+	# start them together, then take each process's cpu time and peak memory as it exits
+	procs = [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for command in commands]
+	usage = [os.wait4(p.pid, 0)[2] for p in procs]
+	for p in procs:
+		p.returncode = 0
+	return {
+		'processes': len(procs),
+		'cpu_s': round(sum(u.ru_utime + u.ru_stime for u in usage), 2),
+		'rss_mb': round(sum(u.ru_maxrss for u in usage) / 1024, 1),
+	}
+
+def bench_fleet(robots=(1, 4), duration=3600, speed=30):
+	here = os.path.dirname(os.path.abspath(__file__))
+	results = {}
+	with tempfile.TemporaryDirectory() as logdir:
+		for n in robots:
+			common = ['--duration', str(duration), '--speed', str(speed)]
+			separate = fleet_run([[sys.executable, os.path.join(here, 'cozmo_sim.py'), '--seed', str(i), '--log', os.path.join(logdir, 'sim%d.log' % i)] + common for i in range(n)])
+			supervisor = fleet_run([[sys.executable, os.path.join(here, 'cozmo_supervisor.py'), '--sim', str(n), '--logdir', logdir] + common])
+			for run in (separate, supervisor):
+				run['cpu_s_per_robot'] = round(run['cpu_s'] / n, 2)
+				run['rss_mb_per_robot'] = round(run['rss_mb'] / n, 1)
+			results['%d robots' % n] = {'separate processes': separate, 'supervisor': supervisor}
+	return results
+
+
+#
+# DOCKED
+# an afternoon on the charger waiting for the evening play window, with the resource profiles and without them
+# (everything stays on, as it was before). The sim says how long each resource was on while docked and how much
+# the control loop did; what a camera frame costs this computer is measured separately, by passing a frame through
+# the SDK's own receive path: unpacking the chunks, turning Cozmo's minimized JPEG into a real one and decoding it
+#
+camerafps = 15 # frames per second the Cozmo app streams while the image stream is on
+
+def camera_frame(seed=1):
+	# a stand-in for a frame off the charger: a gradient, some blocks and sensor noise, encoded like Cozmo does it
+	# (320x240 grey, quality 50, standard tables - the minimized format is the entropy coded part without the
+	# 0xff stuffing, after one byte saying it's grey)
+	import numpy as np
+	from PIL import Image, ImageDraw, ImageFilter
+	rng = random.Random(seed)
+	width, height = 320, 240
+	image = Image.new('L', (width, height))
+	draw = ImageDraw.Draw(image)
+	for y in range(height):
+		draw.line([(0, y), (width, y)], fill=60 + y * 120 // height)
+	for _ in range(12):
+		x, y = rng.randrange(width), rng.randrange(height)
+		draw.rectangle([x, y, x + rng.randrange(10, 80), y + rng.randrange(10, 60)], fill=rng.randrange(256))
+	image = image.filter(ImageFilter.GaussianBlur(1.2))
+	noise = np.random.RandomState(seed).normal(0, 4, (height, width))
+	image = Image.fromarray(np.clip(np.asarray(image, dtype=float) + noise, 0, 255).astype(np.uint8))
+	out = io.BytesIO()
+	image.save(out, 'JPEG', quality=50)
+	jpeg = out.getvalue()
+	start = jpeg.index(b'\xff\xda')
+	start += 2 + int.from_bytes(jpeg[start + 2:start + 4], 'big')
+	return b'\x00' + jpeg[start:jpeg.rindex(b'\xff\xd9')].replace(b'\xff\x00', b'\xff')
+
+class BenchLink:
+	def send_msg(self, msg):
+		pass
+
+class BenchCameraRobot:
+	conn = BenchLink()
+
+def camera_frame_cost(frames=200):
+	from cozmo._clad import _clad_to_game_cozmo as clad
+	mini = camera_frame()
+	size = clad.ImageConstants.IMAGE_CHUNK_SIZE
+	chunks = [mini[i:i + size] for i in range(0, len(mini), size)]
+	# what arrives over the link, so unpacking the messages is part of the cost
+	packed = [clad.ImageChunk(imageId=1, imageEncoding=clad.ImageEncoding.JPEGMinimizedGray, resolution=clad.ImageResolution.QVGA, imageChunkCount=len(chunks), chunkId=i, data=list(chunk)).pack() for i, chunk in enumerate(chunks)]
+	loop = asyncio.new_event_loop()
+	camera = cozmo.camera.Camera(BenchCameraRobot(), loop=loop)
+	start = time.process_time()
+	for _ in range(frames):
+		for data in packed:
+			camera._recv_msg_image_chunk(None, msg=clad.ImageChunk.unpack(data))
+		# and the new image event
+		loop.run_until_complete(asyncio.sleep(0))
+	elapsed = time.process_time() - start
+	loop.close()
+	return {'size': camera._latest_image.size, 'chunks': len(packed), 'bytes': sum(len(data) for data in packed), 'cpu_ms': round(elapsed / frames * 1000, 2)}
+
+def docked_run(args):
+	profiles, duration = args
+	# a Monday afternoon, hours before the weekday play window opens
+	clock = cu.VirtualClock(datetime.datetime(2017, 10, 16, 13, 0).timestamp(), sim.simtick)
+	cu.clock = clock
+	cu.calibrationfile = None
+	cu.loglevel = 3
+	cu.use_scheduler = 1
+	cu.schedulefile = None
+	if not profiles:
+		cu.resourceprofiles = {}
+	counts = collections.Counter()
+	def counting(name, function):
+		def counted(*a, **kw):
+			counts[name] += 1
+			return function(*a, **kw)
+		return counted
+	cu.robot_wait_for_state_change = counting('passes', cu.robot_wait_for_state_change)
+	cu.robot_log = counting('status_lines', cu.robot_log)
+	random.seed(1)
+	world = sim.SimWorld(1, {'robot': 'charger', 'battery': 0.5}, clock)
+	start = time.process_time()
+	sim.run_program(cu.cozmo_unleashed, world, duration)
+	cpu = time.process_time() - start
+	cu.unmonitor(world.robot)
+	stats = world.summary()
+	return {
+		'docked_s': stats['time_on_charger'],
+		'on_while_docked_s': stats['docked_on'],
+		'waits': counts['passes'],
+		'status_lines': counts['status_lines'],
+		'cpu_s_with_sim': round(cpu, 2),
+	}
+
+def bench_docked(duration=4 * 3600):
+	with multiprocessing.Pool(maxtasksperchild=1) as pool:
+		runs = pool.map(docked_run, [(False, duration), (True, duration)], chunksize=1)
+	frame = camera_frame_cost()
+	results = {'frame': frame}
+	for name, run in zip(('everything on', 'profiles'), runs):
+		hours = run['docked_s'] / 3600
+		frames = run['on_while_docked_s']['camera'] * camerafps
+		run['per_docked_hour'] = {
+			'camera_cpu_s': round(frames * frame['cpu_ms'] / 1000 / hours, 1),
+			'camera_mb': round(frames * frame['bytes'] / 1e6 / hours, 1),
+			'waits': round(run['waits'] / hours),
+			'status_lines': round(run['status_lines'] / hours),
+		}
+		results[name] = run
+	return results
+
+
+#
+# CAMERA ANNOTATOR
+# camera_info before the overlay cache laid the text out and drew it five times (four for the outline) on every
+# frame. That's kept here to compare against, with the state and battery lines added the same way as well. The
+# SDK's ImageText.render measures the text with ImageDraw.textsize, which newer Pillows don't have, so it's spelled
+# out here with textbbox instead
+#
+def legacy_camera_info(image, scale, world=None, lines=2):
+	from PIL import ImageDraw
+	d = ImageDraw.Draw(image)
+	camera = world.robot.camera
+	text_to_display = 'Exposure: %s ms\n' % camera.exposure_ms
+	text_to_display += 'Gain: %.3f\n' % camera.gain
+	if lines > 2:
+		text_to_display += 'State: %s\n' % cu.statecontext.name()
+		text_to_display += 'Battery: %.2f V\n' % world.robot.battery_voltage
+	# ImageText(text_to_display, position=TOP_LEFT, line_spacing=2, color="white", outline_color="black", full_outline=True).render(d, [3, 0, ...])
+	d.multiline_textbbox((0, 0), text_to_display, spacing=2)
+	x, y = 3, 0
+	for position in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+		d.text(position, text_to_display, fill='black', align='left', spacing=2)
+	d.text((x, y), text_to_display, fill='white', align='left', spacing=2)
+
+class BenchCamera:
+	def __init__(self):
+		self.exposure_ms = 33
+		self.gain = 1.0
+
+class BenchWorld:
+	def __init__(self):
+		self.robot = BenchRobot()
+		self.robot.camera = BenchCamera()
+
+def bench_annotator(frames=3000, size=(640, 480)):
+	# a viewer's worth of frames: auto exposure settling now and then, the battery reading jittering every frame
+	from PIL import Image
+	rng = random.Random(1)
+	trace = []
+	exposure, gain, voltage = 33, 1.0, 3.95
+	for i in range(frames):
+		if rng.random() < 0.02:
+			exposure = rng.choice((10, 16, 22, 33, 50, 66))
+			gain = round(rng.uniform(0.5, 3.5), 3)
+		voltage -= 0.00005
+		trace.append((exposure, gain, voltage + rng.gauss(0, 0.01), 4 if i < frames // 2 else 5))
+	base = Image.new('RGB', size, (90, 90, 90))
+	world = BenchWorld()
+	variants = {
+		'legacy': lambda image: legacy_camera_info(image, 1, world=world),
+		'legacy_4_lines': lambda image: legacy_camera_info(image, 1, world=world, lines=4),
+		'overlay_4_lines': lambda image: cu.camera_info.__wrapped__(image, 1, world=world),
+	}
+	results = {}
+	for name, annotate in variants.items():
+		cu.overlaylines.clear()
+		cu.overlaykey = None
+		times = []
+		for exposure, gain, voltage, state in trace:
+			world.robot.camera.exposure_ms = exposure
+			world.robot.camera.gain = gain
+			world.robot.battery_voltage = voltage
+			cu.statecontext.state = state
+			image = base.copy()
+			start = time.perf_counter()
+			annotate(image)
+			times.append(time.perf_counter() - start)
+		times.sort()
+		results[name] = {
+			'mean_us': round(sum(times) / len(times) * 1e6, 1),
+			'p95_us': round(times[int(0.95 * (len(times) - 1))] * 1e6, 1),
+		}
+	results['overlay_lines_cached'] = len(cu.overlaylines)
+	results['speedup_4_lines'] = round(results['legacy_4_lines']['mean_us'] / results['overlay_4_lines']['mean_us'], 1)
+	return results
+
+
+class BenchCameraImage:
+	def __init__(self, raw_image):
+		self.raw_image = raw_image
+
+def perception_frames(frames):
+	# a block wandering across a still scene, then a stretch with a finger over the lens, then still again. RGB like
+	# the SDK hands them over, so the conversion is part of the handler's cost
+	import numpy as np
+	from PIL import Image
+	rng = np.random.RandomState(1)
+	scene = np.tile(np.linspace(70, 190, 320, dtype=np.float32), (240, 1))
+	out = []
+	for i in range(frames):
+		if i < frames * 2 // 5:
+			frame = scene.copy()
+			x = 20 + (i * 9) % 240
+			frame[60:180, x:x + 60] = 30
+		elif i < frames * 3 // 5:
+			frame = np.full((240, 320), 12, dtype=np.float32)
+		else:
+			frame = scene.copy()
+		frame += rng.normal(0, 1.5, frame.shape)
+		out.append(Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8)).convert('RGB'))
+	return out
+
+def perception_feed(images, fps):
+	# through monitor_EvtNewCameraImage to a fresh worker, paced like the stream or as fast as it will go
+	cu.q = queue.Queue()
+	with cu.perceptionlock:
+		cu.perceptionstats.update({'frames': 0, 'dropped': 0, 'results': 0, 'latency_total': 0.0, 'latency_max': 0.0, 'last': None, 'motion': False, 'camera_covered': False})
+	cu.robot_perception_start()
+	# one frame through first so the worker's start up isn't counted
+	cu.monitor_EvtNewCameraImage(None, image=BenchCameraImage(images[-1]))
+	while cu.robot_perception_stats()['results'] < 1:
+		time.sleep(0.01)
+	with cu.perceptionlock:
+		cu.perceptionstats.update({'frames': 0, 'results': 0, 'latency_total': 0.0, 'latency_max': 0.0})
+	times = []
+	start = time.perf_counter()
+	for i, image in enumerate(images):
+		if fps:
+			time.sleep(max(0, start + i / fps - time.perf_counter()))
+		# CPU time of this thread, on a single core the worker would otherwise be counted whenever it runs meanwhile
+		before = time.thread_time()
+		cu.monitor_EvtNewCameraImage(None, image=BenchCameraImage(image))
+		times.append(time.thread_time() - before)
+	stats = cu.robot_perception_stats()
+	while stats['results'] < stats['frames'] - stats['dropped']:
+		time.sleep(0.01)
+		stats = cu.robot_perception_stats()
+	elapsed = time.perf_counter() - start
+	cu.robot_perception_stop()
+	edges = []
+	while not cu.q.empty():
+		edges.append('%s=%s' % cu.q.get())
+	return {
+		'handler_us': round(sum(times) / len(times) * 1e6, 1),
+		'frames_per_s': round(len(images) / elapsed, 1),
+		'dropped': stats['dropped'],
+		'latency_ms': round(stats['latency_total'] / max(stats['results'], 1), 2),
+		'latency_max_ms': round(stats['latency_max'], 2),
+		'edges': edges,
+	}
+
+def perception_inline(images, fps):
+	# the same analysis run in the handler on the event loop, which is what the worker takes off it
+	import numpy as np
+	import cozmo_perception
+	previous = None
+	total = 0
+	start = time.perf_counter()
+	for i, image in enumerate(images):
+		if fps:
+			time.sleep(max(0, start + i / fps - time.perf_counter()))
+		before = time.thread_time()
+		_, _, _, _, previous = cozmo_perception.analyse(np.asarray(image.convert('L')), previous)
+		total += time.thread_time() - before
+	return round(total / len(images) * 1e6, 1)
+
+def bench_perception(frames=600):
+	images = perception_frames(frames)
+	return {
+		'inline_stream_us': perception_inline(images, camerafps),
+		'inline_unpaced_us': perception_inline(images, 0),
+		'stream': perception_feed(images, camerafps),
+		'unpaced': perception_feed(images, 0),
+	}
+
+
+def bench_recorder(frames=1200, slots=300):
+	# a search and docking run's worth of frames through the camera handler with the recorder on: recorded in the
+	# searching and docking states, passed over in the others. Then the recording read back
+	import tracemalloc
+	import numpy as np
+	import cozmo_recorder
+	from cozmo.util import Pose, degrees
+	images = perception_frames(frames // 4)
+	states = [(4, 5, 98, 6)[i * 4 // frames] for i in range(frames)]
+	path = os.path.join(tempfile.mkdtemp(), 'frames.ring')
+	robot = BenchRobot()
+	cu.robot = robot
+	cu.clock = cu.VirtualClock(0.0, 1 / camerafps)
+	cu.perception = None
+	cu.recordfile, cu.recordslots, cu.recordscale = path, slots, 2
+	cu.robot_recorder_start()
+	times = collections.defaultdict(list)
+	for i, state in enumerate(states):
+		robot.pose = Pose(i * 0.5, 100 - i * 0.1, 0, angle_z=degrees(i % 360))
+		cu.statecontext.state = state
+		cu.clock.t = i / camerafps
+		before = time.thread_time()
+		cu.monitor_EvtNewCameraImage(None, image=BenchCameraImage(images[i % len(images)]))
+		times[state in cu.recordstates].append(time.thread_time() - before)
+	# what one write allocates, once the recorder is warmed up
+	pixels = np.asarray(images[0].convert('L'))
+	tracemalloc.start()
+	snapshot = tracemalloc.take_snapshot()
+	for i in range(200):
+		cu.recorder.write(pixels, 1.0, 5, 1.0, 2.0, 3.0, 4.0)
+	allocated = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename') if stat.size_diff > 0)
+	tracemalloc.stop()
+	written = cu.recorder.written - 200
+	cu.robot_recorder_stop()
+	size = os.path.getsize(path)
+	start = time.perf_counter()
+	replay = cozmo_recorder.FrameReplay(path)
+	opened = time.perf_counter() - start
+	recorded = [replay.image(frame) for frame in replay]
+	replay.close()
+	os.unlink(path)
+	return {
+		'handler_recording_us': round(sum(times[True]) / len(times[True]) * 1e6, 1),
+		'handler_not_recording_us': round(sum(times[False]) / len(times[False]) * 1e6, 1),
+		'frames_written': written,
+		'file_bytes': size,
+		'tracemalloc_bytes_per_write': round(allocated / 200, 1),
+		'replay_frames': len(recorded),
+		'replay_open_ms': round(opened * 1000, 2),
+		'replay_size': recorded[-1].size,
+	}
+
+
+#
+# OBJECT NAMES
+# print_object() as it was before the names were kept, and the three calls monitor_EvtObjectAppeared made with it
+#
+def legacy_print_object(obj, robot):
+	if isinstance(obj,cozmo.objects.LightCube):
+		cube_id = next(k for k,v in robot.world.light_cubes.items() if v==obj)
+		msg = 'LightCube-' + str(cube_id)
+	else:
+		r = re.search('<(\w*)', obj.__repr__())
+		msg = r.group(1)
+	return msg
+
+def legacy_object_appeared(obj, robot):
+	msg = legacy_print_object(obj, robot) + ' '
+	if legacy_print_object(obj, robot) == "Charger":
+		pass
+	return msg, legacy_print_object(obj, robot) == "Charger"
+
+def cached_object_appeared(obj, robot):
+	msg = cu.print_object(obj) + ' '
+	return msg, cu.robot_object_is_charger(obj)
+
+def bench_objectnames(events=30000):
+	# a stream of sightings of the charger, the charger marker and the cubes, at the rate EvtObjectObserved
+	# would bring them if it wasn't excluded
+	world = sim.SimWorld(1, 'cycle', cu.VirtualClock(0.0, sim.simtick))
+	cu.robot = world.robot
+	cu.robot_object_forget()
+	objects = [world.chargerobj, world.markerobj] + list(world.light_cubes.values())
+	rng = random.Random(1)
+	stream = [rng.choice(objects) for _ in range(events)]
+	results = {'names_match': all(legacy_object_appeared(obj, world.robot) == cached_object_appeared(obj, world.robot) for obj in objects)}
+	for name, appeared in (('legacy', legacy_object_appeared), ('cached', cached_object_appeared)):
+		per = collections.defaultdict(list)
+		for obj in stream:
+			start = time.perf_counter()
+			appeared(obj, world.robot)
+			per[type(obj).__name__].append(time.perf_counter() - start)
+		total = [t for times in per.values() for t in times]
+		results[name] = {'mean_us': round(sum(total) / len(total) * 1e6, 2)}
+		results[name].update({kind: round(sum(times) / len(times) * 1e6, 2) for kind, times in sorted(per.items())})
+	results['entries'] = len(cu.objectnames)
+	results['speedup'] = round(results['legacy']['mean_us'] / results['cached']['mean_us'], 1)
+	return results
+
+
+#
+# TRANSITIONS
+# time from a status change (off the charger, picked up, battery low, ...) to the state loop entering the new state,
+# as robot_record_transition_latency() measures it, on the simulator. 'edge' is the loop as it is, woken by the
+# status edges; 'poll' is the same loop sleeping out every wait the way the fixed 0.5 s sleeps used to. The
+# simulator ticks every 50 ms, which is the resolution of the numbers. Some transitions include the program's own
+# maneuvers: entering freeplay is timed from the charger contacts opening, so it includes driving off the charger
+# and the reaction to it, and a cliff backs off for 3 s in the cliff handler before picked up (9) is entered.
+# 'reactive' leaves freeplay out
+#
+transitionruns = (('cycle', 4 * 3600), ('pickup', 1800), ('low', 3600))
+
+def poll_wait(timeout):
+	# robot_wait_for_state_change() without the early wake
+	if not cu.statechange.is_set():
+		cu.statechange_time = None
+	cu.clock.sleep(timeout)
+	cu.statechange.clear()
+	return False
+
+def transitions_run(args):
+	mode, scenario, seed, duration = args
+	clock = cu.VirtualClock(datetime.datetime(2017, 10, 14, 9, 0).timestamp(), sim.simtick)
+	cu.clock = clock
+	cu.calibrationfile = None
+	cu.loglevel = 3
+	random.seed(seed)
+	world = sim.SimWorld(seed, scenario, clock)
+	latencies = []
+	record = cu.robot_record_transition_latency
+	def recorded(state):
+		count = cu.transitionlatency['count']
+		record(state)
+		if cu.transitionlatency['count'] > count:
+			latencies.append((state, cu.transitionlatency['last']))
+	cu.robot_record_transition_latency = recorded
+	if mode == 'poll':
+		cu.robot_wait_for_state_change = poll_wait
+	sim.run_program(cu.cozmo_unleashed, world, duration)
+	cu.unmonitor(world.robot)
+	return mode, latencies
+
+def bench_transitions(seeds=4):
+	jobs = [(mode, scenario, seed, duration) for mode in ('poll', 'edge') for scenario, duration in transitionruns for seed in range(seeds)]
+	with multiprocessing.Pool(maxtasksperchild=1) as pool:
+		runs = pool.map(transitions_run, jobs, chunksize=1)
+	def spread(values):
+		values = sorted(values)
+		return {
+			'transitions': len(values),
+			'p50_ms': round(values[len(values) // 2], 1),
+			'p95_ms': round(values[int(0.95 * (len(values) - 1))], 1),
+			'max_ms': round(values[-1], 1),
+		}
+	results = {}
+	for mode in ('poll', 'edge'):
+		entered = [entry for name, latencies in runs if name == mode for entry in latencies]
+		results[mode] = {'reactive': spread([latency for state, latency in entered if state != 4])}
+		for state in sorted({state for state, latency in entered}):
+			results[mode][cu.statecontext.name(state)] = spread([latency for entered_state, latency in entered if entered_state == state])
+	return results
+
+
+benchmarks = {
+	'batterylight' : bench_batterylight,
+	'search'       : bench_search,
+	'animpick'     : bench_animpick,
+	'animreset'    : bench_animreset,
+	'docking'      : bench_docking,
+	'fleet'        : bench_fleet,
+	'docked'       : bench_docked,
+	'annotator'    : bench_annotator,
+	'perception'   : bench_perception,
+	'recorder'     : bench_recorder,
+	'objectnames'  : bench_objectnames,
+	'transitions'  : bench_transitions,
+}
+
+if __name__ == '__main__':
+	names = sys.argv[1:] or list(benchmarks)
+	for name in names:
+		print(name, json.dumps(benchmarks[name](), indent=2))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# PERCEPTION WORKER
+#
+# cozmo_unleashed.py hands its camera frames to a process of its own for analysis, so the number crunching never
+# runs on the SDK's event loop or holds up the state machine. The frames go through a ring of slots in shared
+# memory: the script copies a grayscale frame into a free slot and sends the worker only the slot number, the
+# worker reads the frame where it is and sends back a handful of numbers. A slot is free again once its result is
+# back; when every slot is still being worked on a new frame is dropped rather than queued up behind the others.
+#
+# per frame the worker works out
+# histogram  - how many pixels fall in each of 16 brightness bins
+# brightness - the mean, 0-255
+# motion     - the share of a coarse grid that changed noticeably since the previous frame, 0-1
+# occlusion  - the share of that grid that's dark and flat, which is what a finger or a wall right in front of the
+#              lens looks like, 0-1
+#
+import os
+import numpy as np
+
+bins = 16
+step = 4        # grid spacing in pixels for the motion and occlusion scores
+changelevel = 12 # a grid point changing more than this counts as motion, sensor noise stays well under it
+darklevel = 40  # a grid point darker than this counts as dark
+flatlevel = 3   # and as flat if its neighbour to the left is within this much
+niceness = 10   # the worker gives way to the script, which matters on a single core Pi
+
+
+class FrameRing:
+	# slots grayscale frames of up to width x height, in one block of shared memory. Made before the worker starts
+	# and handed to it, so both processes see the same memory
+	def __init__(self, context, slots, width=320, height=240):
+		self.slots = slots
+		self.slotsize = width * height
+		self.frames = context.RawArray('B', slots * self.slotsize)
+
+	def fits(self, width, height):
+		return width * height <= self.slotsize
+
+	def view(self, slot, width, height):
+		# the frame in the slot as a numpy array, without copying it
+		return np.frombuffer(self.frames, dtype=np.uint8, count=width * height, offset=slot * self.slotsize).reshape(height, width)
+
+
+def analyse(frame, previous=None):
+	# returns (histogram, brightness, motion, occlusion, grid), pass grid back in as previous with the next frame
+	histogram = np.bincount((frame >> 4).ravel(), minlength=bins)
+	grid = frame[::step, ::step].astype(np.int16)
+	if previous is not None and previous.shape == grid.shape:
+		motion = float((np.abs(grid - previous) > changelevel).mean())
+	else:
+		motion = 0.0
+	flat = np.zeros(grid.shape, dtype=bool)
+	flat[:, 1:] = np.abs(np.diff(grid, axis=1)) < flatlevel
+	occlusion = float(((grid < darklevel) & flat).mean())
+	return histogram, float(frame.mean()), motion, occlusion, grid
+
+def worker(ring, todo, done):
+	# todo brings (slot, frame id, width, height, time sent), done takes the results back; None stops it
+	if hasattr(os, 'nice'):
+		os.nice(niceness)
+	previous = None
+	while True:
+		job = todo.get()
+		if job is None:
+			break
+		slot, frameid, width, height, sent = job
+		histogram, brightness, motion, occlusion, previous = analyse(ring.view(slot, width, height), previous)
+		done.put((slot, frameid, sent, histogram.tolist(), round(brightness, 1), round(motion, 4), round(occlusion, 4)))
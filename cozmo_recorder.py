@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+#
+# CAMERA FRAME RECORDER
+#
+# Set use_recorder in cozmo_unleashed.py to keep the last recordslots camera frames in a ring file while Cozmo is
+# in one of recordstates (looking for the charger, docking, looking around by default), so when docking goes wrong
+# there's a record of what he saw. Every frame is kept at a fraction of the camera's resolution, in grey, with the
+# time, the state and his pose. The file has a fixed size and is memory mapped: a frame is copied straight from the
+# camera image into its slot, nothing is allocated for it and nothing grows. The file survives the script, the
+# oldest frames get written over first.
+#
+# Run this script on a recording to list it, export the frames as PNGs or run them through the perception analysis.
+#
+# usage: python3 cozmo_recorder.py [--states 5 6 ...] [--export dir] [--perception] [--json] cozmo_frames.ring
+#
+# file layout: a 64 byte header, then slots of a 64 byte record (sequence number, time, state, pose) followed by
+# the pixels. Sequence numbers start at 1 and a slot being written has 0, so the order survives the script being
+# killed halfway through a frame.
+#
+import sys, os, json, mmap, struct, argparse, collections
+import numpy as np
+
+magic = b'COZFRAME'
+version = 1
+header = struct.Struct('<8sIIIII')     # magic, version, slots, width, height, scale
+record = struct.Struct('<Qdiffff')     # sequence, time, state, x, y, z, angle_z in degrees
+headersize = 64
+recordsize = 64
+
+Frame = collections.namedtuple('Frame', 'seq time state x y z angle pixels')
+
+
+class FrameRecorder:
+	def __init__(self, path, slots, width=160, height=120, scale=2):
+		self.path = path
+		self.slots = slots
+		self.width = width
+		self.height = height
+		self.scale = scale
+		self.slotsize = recordsize + width * height
+		size = headersize + slots * self.slotsize
+		# carry on with a recording of the same shape, start afresh with anything else
+		reuse = os.path.exists(path) and os.path.getsize(path) == size and FrameReplay.geometry(path) == (slots, width, height, scale)
+		self.file = open(path, 'r+b' if reuse else 'w+b')
+		self.file.truncate(size)
+		self.map = mmap.mmap(self.file.fileno(), size)
+		header.pack_into(self.map, 0, magic, version, slots, width, height, scale)
+		block = np.frombuffer(self.map, dtype=np.uint8, offset=headersize).reshape(slots, self.slotsize)
+		# a view per slot, made once
+		self.frames = [block[slot, recordsize:].reshape(height, width) for slot in range(slots)]
+		self.seq = max([record.unpack_from(self.map, headersize + slot * self.slotsize)[0] for slot in range(slots)]) if reuse else 0
+		self.written = 0
+
+	def fits(self, width, height):
+		return width >= self.width * self.scale and height >= self.height * self.scale
+
+	def write(self, frame, time, state, x=0.0, y=0.0, z=0.0, angle=0.0):
+		# frame is a grey numpy array at the camera's resolution, every scale'th pixel of it is kept
+		self.seq += 1
+		slot = (self.seq - 1) % self.slots
+		offset = headersize + slot * self.slotsize
+		record.pack_into(self.map, offset, 0, time, state, x, y, z, angle)
+		np.copyto(self.frames[slot], frame[:self.height * self.scale:self.scale, :self.width * self.scale:self.scale])
+		record.pack_into(self.map, offset, self.seq, time, state, x, y, z, angle)
+		self.written += 1
+
+	def close(self):
+		if self.map is None:
+			return
+		# the numpy views hold on to the map's buffer, they have to go before it can close
+		self.frames = None
+		self.map.flush()
+		self.map.close()
+		self.map = None
+		self.file.close()
+
+
+class FrameReplay:
+	# the frames in a recording, oldest first
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		name, fileversion, self.slots, self.width, self.height, self.scale = header.unpack_from(self.map, 0)
+		if name != magic or fileversion != version:
+			raise ValueError('%s is not a frame recording' % path)
+		self.slotsize = recordsize + self.width * self.height
+		block = np.frombuffer(self.map, dtype=np.uint8, offset=headersize).reshape(self.slots, self.slotsize)
+		self.frames = []
+		for slot in range(self.slots):
+			seq, time, state, x, y, z, angle = record.unpack_from(self.map, headersize + slot * self.slotsize)
+			if seq:
+				self.frames.append(Frame(seq, time, state, x, y, z, angle, block[slot, recordsize:].reshape(self.height, self.width)))
+		self.frames.sort(key=lambda frame: frame.seq)
+
+	@staticmethod
+	def geometry(path):
+		with open(path, 'rb') as f:
+			name, fileversion, slots, width, height, scale = header.unpack(f.read(header.size))
+		return (slots, width, height, scale) if name == magic and fileversion == version else None
+
+	def __len__(self):
+		return len(self.frames)
+
+	def __iter__(self):
+		return iter(self.frames)
+
+	def image(self, frame):
+		# back at the camera's resolution and in RGB, the way the SDK hands over camera images
+		from PIL import Image
+		image = Image.fromarray(frame.pixels)
+		return image.resize((self.width * self.scale, self.height * self.scale)).convert('RGB')
+
+	def feed(self, handler, states=None):
+		# replays the recording into an EvtNewCameraImage handler, e.g. cozmo_unleashed.monitor_EvtNewCameraImage
+		for frame in self.frames:
+			if states is None or frame.state in states:
+				handler(None, image=ReplayImage(self.image(frame), frame))
+
+	def close(self):
+		self.frames = None
+		self.map.close()
+
+
+class ReplayImage:
+	# stands in for the SDK's cozmo.world.CameraImage
+	def __init__(self, raw_image, frame):
+		self.raw_image = raw_image
+		self.image_number = frame.seq
+		self.image_recv_time = frame.time
+		self.frame = frame
+
+
+def summary(replay, states=None, perception=False):
+	rows = []
+	previous = None
+	if perception:
+		import cozmo_perception
+	for frame in replay:
+		if states is not None and frame.state not in states:
+			continue
+		row = {'seq': frame.seq, 'time': round(frame.time, 2), 'state': frame.state, 'pose': [round(frame.x, 1), round(frame.y, 1), round(frame.z, 1), round(frame.angle, 1)]}
+		if perception:
+			_, brightness, motion, occlusion, previous = cozmo_perception.analyse(frame.pixels, previous)
+			row.update({'brightness': round(brightness, 1), 'motion': round(motion, 4), 'covered': round(occlusion, 4)})
+		rows.append(row)
+	return rows
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='list, export or analyse a recording of camera frames')
+	parser.add_argument('recording')
+	parser.add_argument('--states', type=int, nargs='+', help='only the frames recorded in these states')
+	parser.add_argument('--export', metavar='dir', help='write the frames to this directory as PNGs')
+	parser.add_argument('--perception', action='store_true', help='run the frames through the perception analysis')
+	parser.add_argument('--json', action='store_true')
+	args = parser.parse_args()
+	replay = FrameReplay(args.recording)
+	states = set(args.states) if args.states else None
+	rows = summary(replay, states, args.perception)
+	if args.export:
+		os.makedirs(args.export, exist_ok=True)
+		for frame in replay:
+			if states is None or frame.state in states:
+				replay.image(frame).save(os.path.join(args.export, 'frame_%08d_state_%d.png' % (frame.seq, frame.state)))
+	if args.json:
+		print(json.dumps(rows, indent=2))
+		sys.exit(0)
+	print('%s: %d of %d slots, %dx%d (1/%d of the camera)' % (args.recording, len(replay), replay.slots, replay.width, replay.height, replay.scale))
+	for row in rows:
+		line = '  %8d  %10.2fs  state %-3d  pose (%.0f, %.0f, %.0f) %.0f deg' % (row['seq'], row['time'], row['state'], *row['pose'])
+		if args.perception:
+			line += '  brightness %.0f  motion %.3f  covered %.2f' % (row['brightness'], row['motion'], row['covered'])
+		print(line)
@@ -0,0 +1,1157 @@
+#!/usr/bin/env python3
+#
+# SIMULATED COZMO FOR COZMO_UNLEASHED
+#
+# run with: python3 cozmo_sim.py [--scenario name] [--seed n] [--duration secs] [--speed x] [--start yyyy-mm-ddThh:mm] [--scheduler] [--schedule file]
+#
+# A stand-in for cozmo.robot.Robot and cozmo.world.World covering the part of the SDK cozmo_unleashed.py uses,
+# so the whole state machine (charging, freeplay, looking for the charger, docking, being picked up) can run
+# on a plain computer without a robot or phone. The poses, objects and events are the real SDK classes, only
+# the robot, its world and the physics behind them are simulated:
+#
+# - a flat table with cliffs on every edge, the charger, the custom marker on top of it and three cubes
+# - the camera sees objects inside a cone in front of the robot, up to a fixed range
+# - wheels slip a little, so where the robot thinks it is drifts away from where it really is (the heading
+#   comes from the gyro, that one stays right)
+# - the battery drains faster when moving or animating and charges on the charger
+# - backing off the table makes the robot fall, a "person" then puts it back and it delocalizes
+# - scheduled pickups, delocalizations and charger moves per scenario
+#
+# By default the script's clock is swapped for a VirtualClock (see CLOCK in cozmo_unleashed.py): simulated time
+# only moves while the program waits, the sim and the status handlers are stepped on the program's own thread,
+# and a whole day runs through as fast as the computer goes - with the same decisions every time for a given
+# seed. With --speed the sim runs on its own thread in sped up real time instead, the program on the calling
+# thread just like under cozmo.run_program.
+#
+import sys, math, random, threading, time, datetime, argparse, json, asyncio
+import cozmo, cozmo.objects, cozmo.util, cozmo.exceptions
+from cozmo.util import degrees, Pose
+from cozmo.objects import CustomObject
+
+
+class SimulationFinished(BaseException):
+	# raised into the program thread once the simulated run is over; like SystemExit it isn't an Exception,
+	# so the handlers that catch and log everything let it through
+	pass
+
+
+#
+# SCENARIOS
+#
+# table       - width and depth of the table in mm, (0, 0) is a corner
+# charger     - x, y and heading of Cozmo when he sits docked on the charger
+# robot       - starting x, y and heading, or 'charger' to start docked
+# battery     - starting state of charge, 0 is flat, 1 is full
+# marker      - whether the custom marker (CustomType01) is stuck on top of the charger
+# cubes       - list of cube positions, None to scatter three of them randomly
+# obstacles   - list of (x0, y0, x1, y1) boxes on the table that block driving and the camera's view
+# events      - list of (time, kind, argument): 'pickup' (seconds held), 'delocalize', 'move_charger' (x, y, heading)
+#
+scenarios = {
+	'cycle'      : {'robot': 'charger', 'battery': 0.6},
+	'dock'       : {'robot': (350, 420, 170), 'battery': 0.33},
+	'low'        : {'robot': (700, 500, 90), 'battery': 0.36},
+	'lost'       : {'robot': (1050, 650, 45), 'battery': 0.33, 'marker': False},
+	'pickup'     : {'robot': (600, 400, 0), 'battery': 0.9, 'events': [(20, 'pickup', 4), (60, 'pickup', 2)]},
+	'delocalize' : {'robot': (350, 420, 170), 'battery': 0.33, 'events': [(12, 'delocalize', None)]},
+	'moved'      : {'robot': (350, 420, 170), 'battery': 0.33, 'events': [(5, 'move_charger', (1000, 650, 180))]},
+}
+
+scenario_defaults = {
+	'table'     : (1200, 800),
+	'charger'   : (60, 400, 0),
+	'robot'     : 'charger',
+	'battery'   : 1.0,
+	'marker'    : True,
+	'cubes'     : None,
+	'obstacles' : [],
+	'events'    : [],
+}
+
+#
+# MODEL CONSTANTS
+#
+simtick = 0.05             # seconds of simulated time per step
+statusinterval = 0.1       # seconds between EvtRobotStateUpdated
+drivespeed = 100           # mm/s for go_to_pose
+turnspeed = 100            # degrees/s for go_to_pose and turn_in_place
+drivenoise = 0.03          # relative error on every distance driven
+turnslip = 0.05            # turns come out this much short on the table
+turnnoise = 0.02           # relative error on every turn
+cliffsensor = 30           # mm from the robot's center to the cliff sensor at the front
+robotradius = 35           # mm around the robot's center that bumps into obstacles
+camerafov = 58
+chargerrange = 400         # mm at which the charger symbol can be made out
+markerrange = 600
+cuberange = 500
+observenoise = 4           # mm of noise on every object sighting
+visibilitytimeout = 0.4
+dockpoint = 127            # the SDK's charger pose is this far in front of the contacts, where the docking routine lines up
+dockx = 20                 # how far off the contacts (mm, degrees) backing in still finds them
+docky = 12
+dockangle = 12
+batteryidle = 1 / 14400.0  # state of charge per second, sitting still
+batteryload = 1 / 4200.0   # extra per second while driving or animating
+batterycharge = 1 / 1200.0
+headspeed = 120            # degrees/s the head moves in set_head_angle
+liftspeed = 120            # mm/s the lift moves in set_lift_height
+actionsettle = 0.1         # seconds every head or lift action takes on top of moving
+rescuedelay = 3.0          # seconds before somebody puts a fallen Cozmo back on the table
+
+
+def wrap(angle):
+	return (angle + 180) % 360 - 180
+
+def compose(a, b):
+	# pose b, given in the frame of pose a, as (x, y, heading)
+	c = math.cos(math.radians(a[2]))
+	s = math.sin(math.radians(a[2]))
+	return (a[0] + c * b[0] - s * b[1], a[1] + s * b[0] + c * b[1], wrap(a[2] + b[2]))
+
+def relative(a, b):
+	# pose b in the frame of pose a
+	c = math.cos(math.radians(a[2]))
+	s = math.sin(math.radians(a[2]))
+	dx = b[0] - a[0]
+	dy = b[1] - a[1]
+	return (c * dx + s * dy, -s * dx + c * dy, wrap(b[2] - a[2]))
+
+
+#
+# ACTIONS
+# an action is a list of segments worked off by the sim thread: ('turn', degrees, speed), ('drive', mm, speed)
+# or ('wait', seconds, 1), and ('head', degrees, speed) / ('lift', mm, speed) which move the head or lift to that
+# position rather than by that much. go_to_pose plans its segments from where the robot believes it is
+#
+class SimAction:
+	def __init__(self, world, name, segments, pathing=False, animating=False):
+		self.world = world
+		self.name = name
+		self.segments = list(segments)
+		self.pathing = pathing
+		self.animating = animating
+		self.state = 'action_running'
+		self.failure_reason = None
+		self.progress = 0.0
+		self.factor = None
+
+	def __repr__(self):
+		return '<SimAction %s state=%s>' % (self.name, self.state)
+
+	@property
+	def is_running(self):
+		return self.state == 'action_running'
+
+	@property
+	def is_completed(self):
+		return self.state != 'action_running'
+
+	@property
+	def has_failed(self):
+		return self.state in ('action_failed', 'action_aborting')
+
+	def finish(self, state='action_succeeded', reason=None):
+		self.state = state
+		self.failure_reason = reason
+
+	def wait_for_completed(self, timeout=None):
+		world = self.world
+		deadline = None if timeout is None else world.t + timeout
+		with world.cond:
+			while self.is_running and not world.finished:
+				world.check()
+				if deadline is not None and world.t >= deadline:
+					raise asyncio.TimeoutError()
+				world.idle()
+		return self
+
+	def abort(self):
+		with self.world.cond:
+			if self.is_running:
+				self.finish('action_aborting', 'aborted')
+				self.world.cond.notify_all()
+
+
+class SimBehavior:
+	def __init__(self, world, behavior_type):
+		self.world = world
+		self.type = behavior_type
+		self.is_active = True
+
+	def __repr__(self):
+		return '<SimBehavior type="%s">' % self.type.name
+
+	def stop(self):
+		with self.world.cond:
+			self.is_active = False
+			if self.world.behavior is self:
+				self.world.behavior = None
+
+
+class SimCamera:
+	def __init__(self, world):
+		self._world = world
+		self.exposure_ms = 33
+		self.gain = 1.0
+		self.color_image_enabled = False
+
+	# no images are made, whether they'd be streaming is only recorded
+	@property
+	def image_stream_enabled(self):
+		return self._world.settings.get('camera', False)
+
+	@image_stream_enabled.setter
+	def image_stream_enabled(self, enabled):
+		self._world.settings['camera'] = enabled
+
+	def enable_auto_exposure(self, enable_auto_exposure=True):
+		pass
+
+
+class SimAnnotator:
+	def __init__(self):
+		self.annotators = {}
+
+	def add_annotator(self, name, annotator):
+		self.annotators[name] = annotator
+
+
+#
+# ROBOT
+# a cozmo.robot.Robot so isinstance checks pass, but none of the SDK's connection machinery is set up;
+# everything the script touches is overridden here and reads or drives the SimWorld
+#
+class SimRobot(cozmo.robot.Robot):
+	def __init__(self, world):
+		self._world = world
+		self.world = world
+		self.camera = SimCamera(world)
+
+	def __repr__(self):
+		return '<SimRobot serial=%s>' % self._world.serial
+
+	@property
+	def serial(self):
+		return self._world.serial
+
+	@property
+	def pose(self):
+		w = self._world
+		with w.cond:
+			w.check()
+			return Pose(w.belief[0], w.belief[1], 0, angle_z=degrees(w.belief[2]), origin_id=w.originid)
+
+	@property
+	def head_angle(self):
+		self._world.check()
+		return degrees(self._world.head)
+
+	@property
+	def lift_height(self):
+		self._world.check()
+		return cozmo.util.distance_mm(self._world.lift)
+
+	@property
+	def battery_voltage(self):
+		with self._world.cond:
+			self._world.check()
+			return self._world.voltage
+
+	@property
+	def is_on_charger(self):
+		self._world.check()
+		return self._world.oncharger
+
+	@property
+	def is_charging(self):
+		self._world.check()
+		return self._world.oncharger and not self._world.charged
+
+	@property
+	def is_picked_up(self):
+		self._world.check()
+		return self._world.pickedup is not None
+
+	@property
+	def is_falling(self):
+		self._world.check()
+		return self._world.falling is not None
+
+	@property
+	def is_cliff_detected(self):
+		self._world.check()
+		return self._world.cliff
+
+	@property
+	def is_carrying_block(self):
+		self._world.check()
+		return self._world.activity_flag('carrying')
+
+	@property
+	def is_picking_or_placing(self):
+		self._world.check()
+		return self._world.activity_flag('picking')
+
+	@property
+	def is_pathing(self):
+		w = self._world
+		w.check()
+		return any(a.pathing for a in w.actions) or w.activity_flag('pathing')
+
+	@property
+	def is_animating(self):
+		w = self._world
+		w.check()
+		return any(a.animating for a in w.actions) or w.activity_flag('animating')
+
+	@property
+	def is_animating_idle(self):
+		return False
+
+	@property
+	def is_behavior_running(self):
+		w = self._world
+		w.check()
+		return w.behavior is not None or w.activity is not None
+
+	@property
+	def is_freeplay_mode_active(self):
+		self._world.check()
+		return self._world.freeplay
+
+	@property
+	def current_behavior(self):
+		self._world.check()
+		return self._world.behavior
+
+	@property
+	def has_in_progress_actions(self):
+		return len(self._world.actions) > 0
+
+	@property
+	def anim_triggers(self):
+		return list(cozmo.anim.Triggers.trigger_list)
+
+	# settings, only recorded
+
+	def set_robot_volume(self, robot_volume):
+		self._world.settings['volume'] = robot_volume
+
+	def enable_freeplay_cube_lights(self, enable=True):
+		self._world.settings['cube_lights'] = enable
+
+	def enable_facial_expression_estimation(self, enable=True):
+		self._world.settings['expressions'] = enable
+
+	def enable_all_reaction_triggers(self, should_enable):
+		self._world.settings['reactions'] = should_enable
+
+	def enable_stop_on_cliff(self, enable):
+		self._world.settings['stop_on_cliff'] = enable
+
+	def enable_device_imu(self, enable_raw=False, enable_user=False, enable_gyro=False):
+		pass
+
+	def clear_idle_animation(self):
+		pass
+
+	def set_needs_levels(self, repair_value=1, energy_value=1, play_value=1):
+		self._world.count('set_needs_levels')
+
+	def set_backpack_lights(self, light1, light2, light3, light4, light5):
+		self._world.count('set_backpack_lights')
+
+	def set_all_backpack_lights(self, light):
+		self._world.count('set_backpack_lights')
+
+	def set_backpack_lights_off(self):
+		self._world.count('set_backpack_lights')
+
+	def set_head_light(self, enable):
+		self._world.count('set_head_light')
+
+	def move_lift(self, speed):
+		# the lift motor runs until it hits the end stop, near enough straight away
+		w = self._world
+		with w.cond:
+			w.check()
+			w.lift = cozmo.robot.MAX_LIFT_HEIGHT_MM if speed > 0 else cozmo.robot.MIN_LIFT_HEIGHT_MM
+
+	# freeplay and behaviors
+
+	def start_freeplay_behaviors(self):
+		w = self._world
+		with w.cond:
+			w.check()
+			w.freeplay = True
+
+	def stop_freeplay_behaviors(self):
+		w = self._world
+		with w.cond:
+			w.check()
+			w.freeplay = False
+			w.activity = None
+
+	def start_behavior(self, behavior_type):
+		w = self._world
+		with w.cond:
+			w.check()
+			w.behavior = SimBehavior(w, behavior_type)
+			return w.behavior
+
+	# motors
+
+	def stop_all_motors(self):
+		w = self._world
+		with w.cond:
+			w.motors = None
+
+	def drive_wheels(self, l_wheel_speed, r_wheel_speed, l_wheel_acc=None, r_wheel_acc=None, duration=None):
+		w = self._world
+		with w.cond:
+			w.check()
+			w.motors = (l_wheel_speed, r_wheel_speed)
+			if duration:
+				w.wait_for(duration)
+				w.motors = None
+
+	# actions
+
+	def abort_all_actions(self, log_abort_messages=False):
+		w = self._world
+		with w.cond:
+			w.check()
+			for action in w.actions:
+				action.finish('action_aborting', 'aborted')
+			w.actions = []
+			w.cond.notify_all()
+
+	def wait_for_all_actions_completed(self):
+		w = self._world
+		with w.cond:
+			while w.actions and not w.finished:
+				w.check()
+				w.idle()
+
+	def go_to_pose(self, pose, relative_to_robot=False, in_parallel=False, num_retries=0):
+		w = self._world
+		with w.cond:
+			if relative_to_robot:
+				pose = self.pose.define_pose_relative_this(pose)
+			if pose.origin_id != w.originid:
+				# the SDK can't plan to a pose from another origin
+				action = w.start_action('go_to_pose', [], in_parallel, pathing=True)
+				action.finish('action_failed', 'bad_origin')
+				return action
+			return w.start_action('go_to_pose', w.plan_to(pose.position.x, pose.position.y, pose.rotation.angle_z.degrees), in_parallel, pathing=True)
+
+	def go_to_object(self, target_object, distance_from_object, in_parallel=False, num_retries=0):
+		w = self._world
+		with w.cond:
+			p = target_object.pose
+			if p is None or p.origin_id != w.originid:
+				action = w.start_action('go_to_object', [], in_parallel, pathing=True)
+				action.finish('action_failed', 'bad_origin')
+				return action
+			x, y = p.position.x, p.position.y
+			heading = math.degrees(math.atan2(y - w.belief[1], x - w.belief[0]))
+			d = distance_from_object.distance_mm
+			return w.start_action('go_to_object', w.plan_to(x - d * math.cos(math.radians(heading)), y - d * math.sin(math.radians(heading)), heading), in_parallel, pathing=True)
+
+	def drive_straight(self, distance, speed, should_play_anim=True, in_parallel=False, num_retries=0):
+		return self._world.start_action('drive_straight', [('drive', distance.distance_mm, abs(speed.speed_mmps))], in_parallel)
+
+	def turn_in_place(self, angle, in_parallel=False, num_retries=0, speed=None, accel=None, angle_tolerance=None, is_absolute=False):
+		w = self._world
+		a = angle.degrees
+		if is_absolute:
+			a = wrap(a - w.belief[2])
+		return w.start_action('turn_in_place', [('turn', a, speed.degrees if speed else turnspeed)], in_parallel)
+
+	def set_head_angle(self, angle, accel=10.0, max_speed=10.0, duration=0.0, warn_on_clamp=True, in_parallel=False, num_retries=0):
+		target = min(max(angle.degrees, cozmo.robot.MIN_HEAD_ANGLE.degrees), cozmo.robot.MAX_HEAD_ANGLE.degrees)
+		return self._world.start_action('set_head_angle', [('wait', actionsettle, 1), ('head', target, headspeed)], in_parallel)
+
+	def set_lift_height(self, height, accel=10.0, max_speed=10.0, duration=0.0, in_parallel=False, num_retries=0):
+		target = cozmo.robot.MIN_LIFT_HEIGHT_MM + min(max(height, 0.0), 1.0) * (cozmo.robot.MAX_LIFT_HEIGHT_MM - cozmo.robot.MIN_LIFT_HEIGHT_MM)
+		return self._world.start_action('set_lift_height', [('wait', actionsettle, 1), ('lift', target, liftspeed)], in_parallel)
+
+	def drive_off_charger_contacts(self, in_parallel=False, num_retries=0):
+		w = self._world
+		segments = [('drive', 60, 50)] if w.oncharger else []
+		return w.start_action('drive_off_charger_contacts', segments, in_parallel)
+
+	def play_anim_trigger(self, trigger, loop_count=1, in_parallel=False, num_retries=0, use_lift_safe=False, ignore_body_track=False, ignore_head_track=False, ignore_lift_track=False):
+		if not isinstance(trigger, cozmo.anim._AnimTrigger):
+			raise TypeError("Invalid trigger supplied")
+		return self._world.start_action('play_anim_trigger', anim_segments(trigger.name, loop_count, ignore_head_track, ignore_lift_track), in_parallel, animating=True)
+
+	def play_anim(self, name, loop_count=1, in_parallel=False, num_retries=0, ignore_body_track=False, ignore_head_track=False, ignore_lift_track=False):
+		return self._world.start_action('play_anim', anim_segments(name, loop_count, ignore_head_track, ignore_lift_track), in_parallel, animating=True)
+
+
+def anim_duration(name):
+	# every animation gets its own fixed length
+	return round(random.Random(name).uniform(1.5, 5.0), 2)
+
+def anim_segments(name, loop_count, ignore_head_track, ignore_lift_track):
+	# and leaves the head and lift where it always does: most put them back down, some end looking up or with the lift raised
+	rng = random.Random(name + '/pose')
+	segments = [('wait', anim_duration(name) * loop_count, 1)]
+	head = rng.choice((0.0, 0.0, rng.uniform(-25, 44.5)))
+	lift = rng.choice((cozmo.robot.MIN_LIFT_HEIGHT_MM, cozmo.robot.MIN_LIFT_HEIGHT_MM, cozmo.robot.MIN_LIFT_HEIGHT_MM, rng.uniform(32, 92)))
+	if not ignore_head_track:
+		segments.append(('head', head, 1000))
+	if not ignore_lift_track:
+		segments.append(('lift', lift, 1000))
+	return segments
+
+
+#
+# WORLD
+#
+class SimWorld:
+	def __init__(self, seed=0, scenario=None, clock=None, **overrides):
+		config = dict(scenario_defaults)
+		if isinstance(scenario, str):
+			config.update(scenarios[scenario])
+		elif scenario:
+			config.update(scenario)
+		config.update(overrides)
+		self.config = config
+		self.rng = random.Random(seed)
+		self.serial = 'sim-%d' % seed
+		self.cond = threading.Condition(threading.RLock())
+		self.loop = asyncio.new_event_loop()  # the SDK objects insist on one, nothing runs on it
+		self.t = 0.0
+		self.duration = None
+		self.finished = False
+		self.programthread = None
+		self.thread = None
+		self.handlers = {}
+		self.settings = {}
+		self.stats = {'docked': 0, 'undocked': 0, 'cliffs': 0, 'bumps': 0, 'falls': 0, 'pickups': 0, 'delocalized': 0, 'actions': 0, 'actions_failed': 0, 'commands': {}, 'time_on_charger': 0.0, 'time_freeplay': 0.0, 'min_voltage': None, 'battery_flat': None, 'charger_first_seen': None, 'docked_on': {'camera': 0.0, 'expressions': 0.0, 'cubes': 0.0, 'reactions': 0.0}}
+		self.log = []
+		self.robot = SimRobot(self)
+		self.image_annotator = SimAnnotator()
+		self.table = config['table']
+		self.obstacles = [tuple(box) for box in config['obstacles']]
+		self.place_charger(*config['charger'])
+		# the SDK's world.charger is only filled in the first time the charger is seen
+		self.charger = None
+		self.chargerobj = cozmo.objects.Charger(None, self, object_id=1, loop=self.loop)
+		self.customtypes = set()
+		self.markerobj = CustomObject(None, self, cozmo.objects.CustomObjectTypes.CustomType01, 40, 40, 10, 40, 40, True, object_id=2, loop=self.loop)
+		self.light_cubes = {}
+		self.cubes = []
+		positions = config['cubes']
+		if positions is None:
+			positions = [(self.rng.uniform(150, self.table[0] - 150), self.rng.uniform(150, self.table[1] - 150)) for _ in range(3)]
+		for i, (x, y) in enumerate(positions):
+			cube_id = (cozmo.objects.LightCube1Id, cozmo.objects.LightCube2Id, cozmo.objects.LightCube3Id)[i]
+			cube = cozmo.objects.LightCube(cube_id, None, self, object_id=3 + i, loop=self.loop)
+			self.light_cubes[cube_id] = cube
+			self.cubes.append((cube, (x, y, self.rng.uniform(-180, 180))))
+		self.cubesconnected = False
+		self.seen = {}
+		self.visionkey = None
+		self.appeared = []
+		# where Cozmo really is on the table, and where he thinks he is in his current origin
+		start = config['robot']
+		self.truth = self.dockpose if start == 'charger' else tuple(start)
+		self.originid = 1
+		self.belief = (0.0, 0.0, 0.0)
+		self.oncharger = False
+		self.charged = False
+		self.soc = config['battery']
+		self.voltage = 0.0
+		self.cliff = False
+		self.falling = None
+		self.pickedup = None
+		self.putdown = None
+		self.actions = []
+		self.head = 0.0
+		self.lift = cozmo.robot.MIN_LIFT_HEIGHT_MM
+		self.motors = None
+		self.behavior = None
+		self.freeplay = False
+		self.activity = None
+		self.moving = False
+		self.events = sorted(config['events'], key=lambda e: e[0])
+		self.laststatus = -statusinterval
+		self.update_ground()
+		self.update_battery(0)
+		# with a VirtualClock there is no sim thread, the clock steps the sim whenever the program waits
+		self.clock = clock
+		if clock is not None:
+			clock.add_ticker(self.tick)
+
+	def place_charger(self, x, y, heading):
+		# (x, y, heading) is Cozmo sitting docked; the pose the SDK reports faces back at the contacts from dockpoint mm out
+		self.dockpose = (x, y, wrap(heading))
+		self.chargerpose = compose(self.dockpose, (dockpoint, 0, 180))
+
+	def note(self, text):
+		self.log.append((round(self.t, 2), text))
+
+	def count(self, command):
+		commands = self.stats['commands']
+		commands[command] = commands.get(command, 0) + 1
+
+	def activity_flag(self, flag):
+		return self.activity is not None and self.activity['flag'] == flag
+
+	#
+	# SDK world interface
+	#
+	def add_event_handler(self, event, f):
+		self.handlers.setdefault(event, []).append(f)
+		return f
+
+	def remove_event_handler(self, event, f):
+		if f in self.handlers.get(event, []):
+			self.handlers[event].remove(f)
+
+	def define_custom_wall(self, custom_object_type, marker, width_mm, height_mm, marker_width_mm, marker_height_mm, is_unique=True):
+		self.customtypes.add(custom_object_type)
+		if custom_object_type == self.markerobj.object_type:
+			return self.markerobj
+		return CustomObject(None, self, custom_object_type, 10, width_mm, height_mm, marker_width_mm, marker_height_mm, is_unique, loop=self.loop)
+
+	def connect_to_cubes(self):
+		self.cubesconnected = True
+		return True
+
+	def disconnect_from_cubes(self):
+		self.cubesconnected = False
+
+	@property
+	def connected_light_cubes(self):
+		return list(self.light_cubes.values()) if self.cubesconnected else []
+
+	@property
+	def visible_objects(self):
+		return [obj for obj in self.seen if obj.is_visible]
+
+	def wait_until_observe_num_objects(self, num, object_type=None, timeout=None, include_existing=True):
+		with self.cond:
+			self.check()
+			found = []
+			if include_existing:
+				found = [obj for obj in self.visible_objects if object_type is None or isinstance(obj, object_type)]
+			index = len(self.appeared)
+			deadline = None if timeout is None else self.t + timeout
+			while len(found) < num and (deadline is None or self.t < deadline) and not self.finished:
+				self.idle()
+				self.check()
+				for obj in self.appeared[index:]:
+					if (object_type is None or isinstance(obj, object_type)) and obj not in found:
+						found.append(obj)
+				index = len(self.appeared)
+			return found[:num]
+
+	def wait_for_observed_charger(self, timeout=None, include_existing=True):
+		found = self.wait_until_observe_num_objects(1, cozmo.objects.Charger, timeout, include_existing)
+		if not found:
+			raise asyncio.TimeoutError()
+		return found[0]
+
+	#
+	# program side helpers
+	#
+	def check(self):
+		# the program thread gets thrown out, anything else waiting on the sim just stops waiting
+		if self.finished and threading.current_thread() is self.programthread:
+			raise SimulationFinished()
+
+	def idle(self):
+		# let a little simulated time go by: on a VirtualClock that means ticking it, otherwise the sim thread does
+		if self.clock is not None:
+			self.clock.sleep(simtick)
+		else:
+			self.cond.wait(0.05)
+
+	def wait_for(self, seconds):
+		# block the calling thread for some simulated time
+		with self.cond:
+			end = self.t + seconds
+			while self.t < end and not self.finished:
+				self.check()
+				self.idle()
+
+	def start_action(self, name, segments, in_parallel, pathing=False, animating=False):
+		with self.cond:
+			self.check()
+			if self.actions and not in_parallel:
+				raise cozmo.exceptions.RobotBusy('Robot is already performing %d action(s) %s' % (len(self.actions), self.actions[0]))
+			action = SimAction(self, name, segments, pathing, animating)
+			self.stats['actions'] += 1
+			if self.pickedup is not None or self.falling is not None:
+				action.finish('action_failed', 'picked_up')
+			elif not segments:
+				action.finish()
+			else:
+				self.actions.append(action)
+				# the SDK's own behaviors give way to anything the program asks for
+				self.activity = None
+			if action.has_failed:
+				self.stats['actions_failed'] += 1
+			return action
+
+	def plan_to(self, x, y, heading):
+		# turn toward the target, drive there, turn to the final heading - planned in the robot's own origin
+		bx, by, bh = self.belief
+		distance = math.hypot(x - bx, y - by)
+		segments = []
+		if distance > 5:
+			direction = math.degrees(math.atan2(y - by, x - bx))
+			segments.append(('turn', wrap(direction - bh), turnspeed))
+			segments.append(('drive', distance, drivespeed))
+			bh = direction
+		segments.append(('turn', wrap(heading - bh), turnspeed))
+		return segments
+
+	#
+	# physics
+	#
+	def on_table(self, x, y):
+		return 0 <= x <= self.table[0] and 0 <= y <= self.table[1]
+
+	def obstructed(self, x, y):
+		return any(x0 - robotradius < x < x1 + robotradius and y0 - robotradius < y < y1 + robotradius for x0, y0, x1, y1 in self.obstacles)
+
+	def view_blocked(self, a, b):
+		# whether the line of sight from a to b passes through an obstacle (Liang-Barsky clipping)
+		dx = b[0] - a[0]
+		dy = b[1] - a[1]
+		for x0, y0, x1, y1 in self.obstacles:
+			low, high = 0.0, 1.0
+			for p, q in ((-dx, a[0] - x0), (dx, x1 - a[0]), (-dy, a[1] - y0), (dy, y1 - a[1])):
+				if p == 0:
+					if q < 0:
+						break
+				else:
+					r = q / p
+					if p < 0:
+						low = max(low, r)
+					else:
+						high = min(high, r)
+			else:
+				if low <= high:
+					return True
+		return False
+
+	def move(self, distance, turn, factor=1.0):
+		# move by distance (mm, along the heading) and turn (degrees), the truth by factor times as much - the
+		# gyro sees the real turn, the distance is what the treads were asked for; returns False when the cliff
+		# sensor stopped the move
+		tx, ty, th = self.truth
+		bx, by, bh = self.belief
+		if turn:
+			th = wrap(th + turn * factor)
+			bh = wrap(bh + turn * factor)
+		if distance < 0 and self.oncharger:
+			# up against the back of the charger, the treads just slip
+			distance = 0
+		if distance:
+			c = math.cos(math.radians(th))
+			s = math.sin(math.radians(th))
+			nx = tx + distance * factor * c
+			ny = ty + distance * factor * s
+			if distance > 0 and not self.on_table(nx + cliffsensor * c, ny + cliffsensor * s):
+				if not self.cliff:
+					self.stats['cliffs'] += 1
+					self.note('cliff')
+				self.cliff = True
+				self.truth = (tx, ty, th)
+				self.belief = (bx, by, bh)
+				return False
+			if self.obstructed(nx, ny) and not self.obstructed(tx, ty):
+				# pushing against a box gets him nowhere
+				self.stats['bumps'] += 1
+				self.truth = (tx, ty, th)
+				self.belief = (bx, by, bh)
+				return False
+			tx, ty = nx, ny
+			bx += distance * math.cos(math.radians(bh))
+			by += distance * math.sin(math.radians(bh))
+		self.truth = (tx, ty, th)
+		self.belief = (bx, by, bh)
+		self.moving = True
+		self.update_ground()
+		return True
+
+	def update_ground(self):
+		tx, ty, th = self.truth
+		if self.cliff and self.on_table(tx + (cliffsensor + 15) * math.cos(math.radians(th)), ty + (cliffsensor + 15) * math.sin(math.radians(th))):
+			self.cliff = False
+		if self.falling is None and self.pickedup is None and not self.on_table(tx, ty):
+			self.note('fell off the table')
+			self.stats['falls'] += 1
+			self.falling = self.t
+			self.abort_everything('falling')
+			return
+		dx, dy, dh = relative(self.dockpose, self.truth)
+		docked = abs(dx) <= dockx and abs(dy) <= docky and abs(dh) <= dockangle
+		if docked and not self.oncharger:
+			# the ramp pulls him onto the contacts
+			self.truth = self.dockpose
+			self.oncharger = True
+			self.charged = self.soc >= 1.0
+			self.stats['docked'] += 1
+			self.note('on charger')
+		elif not docked and self.oncharger:
+			self.oncharger = False
+			self.charged = False
+			self.stats['undocked'] += 1
+			self.note('off charger')
+
+	def abort_everything(self, reason):
+		for action in self.actions:
+			action.finish('action_failed', reason)
+			self.stats['actions_failed'] += 1
+		self.actions = []
+		self.motors = None
+		self.activity = None
+		self.cond.notify_all()
+
+	def delocalize(self):
+		self.originid += 1
+		self.belief = (0.0, 0.0, 0.0)
+		self.stats['delocalized'] += 1
+		self.note('delocalized, origin %d' % self.originid)
+
+	def scatter(self):
+		# somewhere on the table away from the edges
+		return (self.rng.uniform(150, self.table[0] - 150), self.rng.uniform(150, self.table[1] - 150), self.rng.uniform(-180, 180))
+
+	def run_events(self):
+		while self.events and self.events[0][0] <= self.t:
+			_, kind, argument = self.events.pop(0)
+			if kind == 'pickup':
+				self.pick_up(argument, self.truth)
+			elif kind == 'delocalize':
+				self.delocalize()
+			elif kind == 'move_charger':
+				self.note('charger moved')
+				self.place_charger(*argument)
+				self.update_ground()
+
+	def pick_up(self, seconds, putdown):
+		self.note('picked up')
+		self.stats['pickups'] += 1
+		self.pickedup = self.t + seconds
+		self.putdown = putdown
+		self.abort_everything('picked_up')
+		if self.oncharger:
+			self.oncharger = False
+			self.charged = False
+
+	def update_handling(self):
+		if self.falling is not None and self.t - self.falling > 0.5:
+			# lying on the floor now, somebody will come and put him back
+			self.falling = None
+			self.pick_up(rescuedelay, self.scatter())
+		if self.pickedup is not None and self.t >= self.pickedup:
+			self.pickedup = None
+			self.truth = self.putdown
+			self.note('put down')
+			self.delocalize()
+			self.update_ground()
+
+	def step_action(self, action, dt):
+		kind, amount, speed = action.segments[0]
+		if kind in ('head', 'lift'):
+			current = getattr(self, kind)
+			setattr(self, kind, current + math.copysign(min(abs(amount - current), speed * dt), amount - current))
+			if abs(amount - getattr(self, kind)) < 1e-6:
+				action.segments.pop(0)
+				if not action.segments:
+					action.finish()
+			return
+		if action.factor is None:
+			# each segment comes out a little different from what was asked
+			if kind == 'turn':
+				action.factor = 1 - turnslip + self.rng.gauss(0, turnnoise)
+			else:
+				action.factor = 1 + self.rng.gauss(0, drivenoise)
+		step = math.copysign(min(abs(amount) - action.progress, speed * dt), amount)
+		ok = True
+		if kind == 'turn':
+			ok = self.move(0, step, action.factor)
+		elif kind == 'drive':
+			ok = self.move(step, 0, action.factor)
+		action.progress += abs(step)
+		if not ok:
+			action.finish('action_failed', 'cliff' if self.cliff else 'obstacle')
+			self.stats['actions_failed'] += 1
+		elif action.progress >= abs(amount) - 1e-6:
+			action.segments.pop(0)
+			action.progress = 0.0
+			action.factor = None
+			if not action.segments:
+				action.finish()
+
+	def step_freeplay(self, dt):
+		# a rough stand-in for what freeplay gets up to: wander about, animate, fiddle with cubes, sit idle
+		if self.oncharger:
+			return
+		if self.activity is None:
+			roll = self.rng.random()
+			if roll < 0.4:
+				self.activity = {'flag': 'pathing', 'segments': [('turn', self.rng.uniform(-120, 120), 60), ('drive', self.rng.uniform(50, 250), 60)], 'progress': 0.0}
+			elif roll < 0.6:
+				self.activity = {'flag': 'animating', 'segments': [('wait', self.rng.uniform(2, 5), 1)], 'progress': 0.0}
+			elif roll < 0.8:
+				self.activity = {'flag': 'picking', 'segments': [('drive', 80, 40), ('wait', 2, 1)], 'progress': 0.0, 'next': [('carrying', [('wait', 5, 1)]), ('picking', [('wait', 2, 1)])]}
+			else:
+				self.activity = {'flag': 'idle', 'segments': [('wait', self.rng.uniform(2, 6), 1)], 'progress': 0.0}
+		activity = self.activity
+		kind, amount, speed = activity['segments'][0]
+		step = math.copysign(min(abs(amount) - activity['progress'], speed * dt), amount)
+		ok = True
+		if kind == 'turn':
+			ok = self.move(0, step, 1 - turnslip)
+		elif kind == 'drive':
+			ok = self.move(step, 0)
+		activity['progress'] += abs(step)
+		if not ok:
+			self.activity = None
+		elif activity['progress'] >= abs(amount) - 1e-6:
+			activity['segments'].pop(0)
+			activity['progress'] = 0.0
+			if not activity['segments']:
+				if activity.get('next'):
+					flag, segments = activity['next'].pop(0)
+					activity['flag'] = flag
+					activity['segments'] = list(segments)
+				else:
+					self.activity = None
+
+	def update_motion(self, dt):
+		self.moving = False
+		if self.pickedup is not None or self.falling is not None:
+			return
+		if self.actions:
+			for action in list(self.actions):
+				if action.is_running:
+					self.step_action(action, dt)
+				if not action.is_running and action in self.actions:
+					self.actions.remove(action)
+		elif self.motors:
+			l, r = self.motors
+			self.move((l + r) / 2 * dt, math.degrees((r - l) / 48.0 * dt), 1 - turnslip if l != r else 1.0)
+		elif self.behavior is not None and self.behavior.is_active:
+			if self.behavior.type.name == 'LookAroundInPlace':
+				self.move(0, 30 * dt, 1 - turnslip)
+		elif self.freeplay:
+			self.step_freeplay(dt)
+
+	def update_battery(self, dt):
+		if self.oncharger:
+			if not self.charged:
+				self.soc = min(1.0, self.soc + batterycharge * dt)
+				if self.soc >= 1.0:
+					self.charged = True
+					self.note('charged')
+			voltage = 4.8 if self.charged else 4.3 + 0.5 * self.soc
+		else:
+			load = 1.0 if self.moving else 0.0
+			if self.robot.is_animating:
+				load += 0.5
+			self.soc = max(0.0, self.soc - (batteryidle + batteryload * load) * dt)
+			voltage = 3.45 + 0.75 * self.soc - 0.04 * load
+			if self.soc <= 0.0 and self.stats['battery_flat'] is None:
+				self.stats['battery_flat'] = round(self.t, 1)
+				self.note('battery flat')
+				self.finished = True
+		self.voltage = round(voltage + self.rng.gauss(0, 0.004), 4)
+		if self.stats['min_voltage'] is None or (not self.oncharger and self.voltage < self.stats['min_voltage']):
+			self.stats['min_voltage'] = self.voltage
+
+	def observe(self, obj, truepose, visiblerange, at=None):
+		# returns True when obj just came into view; at is where it physically sits if that's not truepose
+		if self.pickedup is not None or self.falling is not None:
+			visible = False
+		else:
+			dx, dy, _ = relative(self.truth, at or truepose)
+			visible = math.hypot(dx, dy) <= visiblerange and abs(math.degrees(math.atan2(dy, dx))) <= camerafov / 2
+			if visible and self.obstacles:
+				visible = not self.view_blocked(self.truth, at or truepose)
+		if visible:
+			# seen relative to where he really is, placed relative to where he thinks he is
+			x, y, h = compose(self.belief, relative(self.truth, truepose))
+			obj._pose = Pose(x + self.rng.gauss(0, observenoise), y + self.rng.gauss(0, observenoise), 0, angle_z=degrees(h + self.rng.gauss(0, 1.5)), origin_id=self.originid)
+			appeared = not obj._is_visible
+			obj._is_visible = True
+			self.seen[obj] = self.t
+			return appeared
+		if obj._is_visible and self.t - self.seen[obj] > visibilitytimeout:
+			obj._is_visible = False
+		return False
+
+	def update_vision(self):
+		# sitting still with nothing moved around (most of the time on the charger) nothing comes into or
+		# drops out of view, the sightings only need keeping fresh
+		key = (self.truth, self.originid, self.pickedup is None and self.falling is None, self.dockpose, len(self.customtypes))
+		if key == self.visionkey:
+			for obj in self.seen:
+				if obj._is_visible:
+					self.seen[obj] = self.t
+			return []
+		self.visionkey = key
+		appeared = []
+		if self.observe(self.chargerobj, self.chargerpose, chargerrange, self.dockpose):
+			if self.stats['charger_first_seen'] is None:
+				self.stats['charger_first_seen'] = round(self.t, 1)
+				self.charger = self.chargerobj
+			appeared.append(self.chargerobj)
+		if self.config['marker'] and self.markerobj.object_type in self.customtypes:
+			if self.observe(self.markerobj, self.dockpose, markerrange):
+				appeared.append(self.markerobj)
+		for cube, pose in self.cubes:
+			if self.observe(cube, pose, cuberange):
+				appeared.append(cube)
+		self.appeared.extend(appeared)
+		return appeared
+
+	def step(self, dt):
+		# one tick of simulated time, returns the events to dispatch
+		self.t += dt
+		self.run_events()
+		self.update_handling()
+		self.update_motion(dt)
+		self.update_ground()
+		self.update_battery(dt)
+		if self.oncharger:
+			self.stats['time_on_charger'] += dt
+			# how long the resources the script can switch off stay on while docked
+			on = self.stats['docked_on']
+			for name in ('camera', 'expressions', 'reactions'):
+				if self.settings.get(name):
+					on[name] += dt
+			if self.cubesconnected:
+				on['cubes'] += dt
+		if self.freeplay:
+			self.stats['time_freeplay'] += dt
+		events = [(cozmo.objects.EvtObjectAppeared, {'obj': obj, 'updated': set(), 'image_box': None, 'pose': obj.pose}) for obj in self.update_vision()]
+		if self.t - self.laststatus >= statusinterval - 1e-9:
+			self.laststatus = self.t
+			events.append((cozmo.robot.EvtRobotStateUpdated, {'robot': self.robot}))
+		self.cond.notify_all()
+		return events
+
+	def dispatch(self, event_class, kwargs):
+		event = event_class(**kwargs)
+		for cls, handlers in list(self.handlers.items()):
+			if isinstance(event, cls):
+				for handler in list(handlers):
+					try:
+						handler(event, **kwargs)
+					except Exception as e:
+						print('sim: %s handler %s failed: %r' % (event_class.__name__, handler.__name__, e), file=sys.stderr)
+
+	#
+	# running
+	#
+	def tick(self):
+		# VirtualClock ticker, everything happens on the program thread so it can be thrown out right here
+		with self.cond:
+			events = self.step(simtick)
+			if self.duration is not None and self.t >= self.duration - 1e-9:
+				self.finished = True
+		for event_class, kwargs in events:
+			self.dispatch(event_class, kwargs)
+		self.check()
+
+	def run(self, speed, duration):
+		# the sim thread: step, then hand events to the handlers outside the lock, like the SDK's event loop
+		start = time.perf_counter()
+		try:
+			while not self.finished:
+				with self.cond:
+					events = self.step(simtick)
+					if duration is not None and self.t >= duration:
+						self.finished = True
+						self.cond.notify_all()
+				for event_class, kwargs in events:
+					self.dispatch(event_class, kwargs)
+				delay = start + self.t / speed - time.perf_counter()
+				if delay > 0:
+					time.sleep(delay)
+		finally:
+			# a broken sim must not leave the program waiting forever
+			with self.cond:
+				self.finished = True
+				self.cond.notify_all()
+
+	def start(self, speed=1.0, duration=None):
+		self.thread = threading.Thread(target=self.run, args=(speed, duration), name='SimWorld', daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		with self.cond:
+			self.finished = True
+			self.cond.notify_all()
+		if self.thread is not None and self.thread is not threading.current_thread():
+			self.thread.join()
+
+	def summary(self):
+		stats = dict(self.stats)
+		stats['time'] = round(self.t, 1)
+		stats['time_on_charger'] = round(stats['time_on_charger'], 1)
+		stats['time_freeplay'] = round(stats['time_freeplay'], 1)
+		stats['docked_on'] = {name: round(seconds, 1) for name, seconds in stats['docked_on'].items()}
+		stats['battery'] = round(self.soc, 3)
+		return stats
+
+
+def run_program(program, world=None, duration=None, speed=1.0):
+	# like cozmo.run_program: call program(robot) on this thread until the simulated time runs out
+	world = world or SimWorld()
+	world.programthread = threading.current_thread()
+	if world.clock is not None:
+		world.duration = duration
+	else:
+		world.start(speed, duration)
+	try:
+		program(world.robot)
+	except SimulationFinished:
+		pass
+	finally:
+		world.stop()
+		if world.clock is not None:
+			world.clock.remove_ticker(world.tick)
+	return world
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='run cozmo_unleashed against a simulated Cozmo')
+	parser.add_argument('--scenario', default='cycle', choices=sorted(scenarios))
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--duration', type=float, default=600, help='simulated seconds to run for')
+	parser.add_argument('--speed', type=float, help='run the sim thread this much faster than real time instead of on a virtual clock')
+	parser.add_argument('--start', default='2017-10-14T09:00', help='date and time the virtual clock starts at (for the scheduler)')
+	parser.add_argument('--log', help='write the status lines to this file instead of the screen')
+	parser.add_argument('--calibration', help='calibration file to use (default: none, so the real one is left alone)')
+	parser.add_argument('--scheduler', action='store_true', help='only play in the scheduled play windows')
+	parser.add_argument('--schedule', help='schedule file to use (default: none, the play hours in cozmo_unleashed.py)')
+	args = parser.parse_args()
+	import cozmo_unleashed as cu
+	random.seed(args.seed)
+	cu.calibrationfile = args.calibration
+	cu.logfile = args.log
+	cu.use_scheduler = 1 if args.scheduler else 0
+	cu.schedulefile = args.schedule
+	clock = None
+	if args.speed is None:
+		clock = cu.VirtualClock(datetime.datetime.strptime(args.start, '%Y-%m-%dT%H:%M').timestamp(), simtick)
+		cu.clock = clock
+	world = SimWorld(args.seed, args.scenario, clock)
+	run_program(cu.cozmo_unleashed, world, args.duration, args.speed)
+	cu.unmonitor(world.robot)
+	if clock is None:
+		time.sleep(cu.logflushinterval * 2)
+	elif cu.logwriter is not None:
+		cu.logwriter.flush()
+	print(json.dumps({'scenario': args.scenario, 'seed': args.seed, 'stats': world.summary(), 'events': world.log}, indent=1))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# MULTI-ROBOT SUPERVISOR
+#
+# cozmo_unleashed.py keeps everything it knows about its robot in module globals, so one module drives one Cozmo.
+# This runs a whole desk of them from one Python process: every robot gets its own copy of the module (its own
+# state, charger, battery calibration, log file), all the SDK connections share one event loop, and every state
+# machine runs on its own thread calling into that loop, the same way cozmo.run_program runs a program that isn't
+# async. Every few seconds it prints one status line per robot.
+#
+# usage: python3 cozmo_supervisor.py [--android serial ...] [--ios serial ...] [--status secs] [--logdir dir]
+#        python3 cozmo_supervisor.py --sim n [--scenario name] [--duration secs] [--speed x]
+#
+# --sim runs n simulated robots from cozmo_sim.py instead (in real time sped up by --speed), which is what
+# `cozmo_benchmarks.py fleet` uses to compare one supervisor against one process per robot.
+#
+# The SDK's public calls connect either one robot for a synchronous program (cozmo.connect, cozmo.run_program,
+# which own the event loop) or a robot on your own loop that only has coroutines. cozmo_unleashed.py is a
+# synchronous program, so for every robot this does what cozmo.run._connect_sync() does for one, and that takes
+# some of the SDK's internals:
+#   _sync_abort_future - a CozmoConnection made with one hands out objects that can be called from another thread
+#   base._SyncProxy    - wraps the connection so wait_for_robot(), and everything the robot returns, blocks on the loop
+#   AndroidConnector._add_forward(), _exec() - the adb port forward, see AndroidConnector below
+# They are checked against sdkversion, the SDK release they're written for (and the last one there was).
+#
+import sys, os, time, json, queue, argparse, asyncio, threading, functools, concurrent.futures, importlib.util
+import cozmo
+from cozmo import base, conn
+
+modulepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cozmo_unleashed.py')
+sdkversion = '1.4.10'
+
+# one calibration file for the whole desk, keyed by robot serial - the instances share the dict and its lock so
+# they don't write over each other's entries
+calibration = {}
+calibrationlock = threading.Lock()
+
+
+class RobotInstance:
+	def __init__(self, name, logdir, calibrationfile):
+		self.name = name
+		# a fresh module object rather than the one in sys.modules, so none of its globals are shared
+		spec = importlib.util.spec_from_file_location('cozmo_unleashed_%s' % name, modulepath)
+		self.cu = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(self.cu)
+		self.cu.logfile = os.path.join(logdir, 'cozmo_%s.log' % name)
+		self.cu.calibrationfile = calibrationfile
+		self.cu.calibration = calibration
+		self.cu.calibrationlock = calibrationlock
+		self.robot = None
+		self.thread = None
+		self.started = None
+		self.error = None
+
+	def run(self, robot):
+		self.robot = robot
+		self.started = time.time()
+		try:
+			self.cu.cozmo_unleashed(robot)
+		except cozmo.exceptions.SDKShutdown:
+			pass
+		except Exception as e:
+			# this robot is out, the others carry on
+			self.error = e
+
+	def status(self):
+		if self.error is not None:
+			return '%-10s stopped: %s' % (self.name, self.error)
+		if self.robot is None:
+			return '%-10s connecting' % self.name
+		cu = self.cu
+		robot = self.robot
+		if robot.is_on_charger:
+			where = 'charging' if robot.is_charging else 'on charger'
+		else:
+			where = 'off charger'
+		return '%-10s %-12s %.2fV %-11s up %5.1fh | %s | %d transitions | %d log lines dropped' % (self.name, cu.statecontext.name(), robot.battery_voltage, where, (time.time() - self.started) / 3600, cu.robot_dock_report(), cu.statecontext.transitions, cu.logdropped)
+
+
+class AndroidConnector(cozmo.run.AndroidConnector):
+	# the SDK forwards the same port number on both ends, so a second phone would collide with the first -
+	# give every phone its own local port and forward that to the Cozmo app's port on the phone. connect() calls
+	# _add_forward() and _remove_forward() for every phone it tries, the latter only removes the local port
+	def __init__(self, serial, localport):
+		super().__init__(serial=serial)
+		self.cozmo_port = localport
+		self.portspec = 'tcp:%d' % localport
+
+	def _add_forward(self, serial):
+		self._exec('-s', serial, 'forward', self.portspec, 'tcp:%d' % cozmo.run.COZMO_PORT)
+
+
+def connect_all(connectors):
+	# opens every connection on one event loop, then leaves the loop running on its own thread
+	loop = asyncio.new_event_loop()
+	ready = queue.Queue()
+	def run_loop():
+		asyncio.set_event_loop(loop)
+		connections = []
+		try:
+			for connector in connectors:
+				# an abort future per connection puts it in the SDK's synchronous mode, and a robot that
+				# disconnects only fails its own calls
+				factory = functools.partial(conn.CozmoConnection, _sync_abort_future=concurrent.futures.Future())
+				connections.append(cozmo.connect_on_loop(loop, factory, connector))
+		except Exception as e:
+			ready.put(e)
+			return
+		ready.put(connections)
+		loop.run_forever()
+	thread = threading.Thread(target=run_loop, name='SDKEventLoop', daemon=True)
+	thread.start()
+	connections = ready.get()
+	if isinstance(connections, Exception):
+		raise connections
+	return loop, connections
+
+def start_robot(instance, connection):
+	def run():
+		try:
+			robot = base._SyncProxy(connection).wait_for_robot()
+		except Exception as e:
+			instance.error = e
+			return
+		instance.run(robot)
+	instance.thread = threading.Thread(target=run, name='Cozmo-%s' % instance.name, daemon=True)
+	instance.thread.start()
+
+def start_sim_robot(instance, world, duration, speed):
+	import cozmo_sim as sim
+	instance.thread = threading.Thread(target=sim.run_program, args=(instance.run, world, duration, speed), name='Cozmo-%s' % instance.name, daemon=True)
+	instance.thread.start()
+
+def print_status(instances):
+	lines = [time.strftime('%H:%M:%S') + ' - %d robots' % len(instances)]
+	lines.extend(instance.status() for instance in instances)
+	sys.stdout.write('\n'.join(lines) + '\n\n')
+	sys.stdout.flush()
+
+def supervise(instances, interval):
+	# the state machines run by themselves, this only reports on them until they've all stopped
+	try:
+		while any(instance.thread.is_alive() for instance in instances):
+			print_status(instances)
+			for instance in instances:
+				instance.thread.join(interval / len(instances))
+	except KeyboardInterrupt:
+		pass
+	print_status(instances)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='run cozmo_unleashed for several robots from one process')
+	parser.add_argument('--android', action='append', default=[], metavar='serial', help='Android phone to connect through (adb serial), repeat for more')
+	parser.add_argument('--ios', action='append', default=[], metavar='serial', help='iOS device to connect through, repeat for more')
+	parser.add_argument('--status', type=float, default=10, help='seconds between status updates')
+	parser.add_argument('--logdir', default='.', help='where the per-robot log files go')
+	parser.add_argument('--calibration', default=os.path.join(os.path.dirname(modulepath), 'cozmo_calibration.json'))
+	parser.add_argument('--sim', type=int, metavar='n', help='run n simulated robots instead')
+	parser.add_argument('--scenario', default='cycle')
+	parser.add_argument('--seed', type=int, default=0, help='seed of the first simulated robot, the others count up from it')
+	parser.add_argument('--duration', type=float, default=600, help='simulated seconds to run for')
+	parser.add_argument('--speed', type=float, default=20, help='how much faster than real time the simulations run')
+	args = parser.parse_args()
+	cozmo.robot.Robot.drive_off_charger_on_connect = False
+	if args.sim:
+		import cozmo_sim as sim
+		# like cozmo_sim.py, simulated robots don't touch the real calibration file
+		instances = [RobotInstance('sim%d' % i, args.logdir, None) for i in range(args.sim)]
+		worlds = [sim.SimWorld(args.seed + i, args.scenario) for i in range(args.sim)]
+		for instance, world in zip(instances, worlds):
+			start_sim_robot(instance, world, args.duration, args.speed)
+		supervise(instances, args.status)
+		for instance, world in zip(instances, worlds):
+			instance.cu.unmonitor(world.robot)
+		print(json.dumps({instance.name: world.summary() for instance, world in zip(instances, worlds)}, indent=1))
+	else:
+		targets = [('android', serial) for serial in args.android] + [('ios', serial) for serial in args.ios]
+		if not targets:
+			parser.error('give at least one --android or --ios device (or --sim n)')
+		if cozmo.__version__ != sdkversion:
+			sys.exit('cozmo_supervisor.py uses internals of version %s of the Cozmo SDK, this is %s' % (sdkversion, cozmo.__version__))
+		connectors = []
+		for i, (kind, serial) in enumerate(targets):
+			if kind == 'android':
+				connectors.append(AndroidConnector(serial, cozmo.run.COZMO_PORT + 100 + i))
+			else:
+				connectors.append(cozmo.run.IOSConnector(serial=serial))
+		instances = [RobotInstance(serial, args.logdir, args.calibration) for kind, serial in targets]
+		loop, connections = connect_all(connectors)
+		for instance, connection in zip(instances, connections):
+			start_robot(instance, connection)
+		supervise(instances, args.status)
+		for connection in connections:
+			asyncio.run_coroutine_threadsafe(connection.shutdown(), loop).result()
+		loop.call_soon_threadsafe(loop.stop)
@@ -64,7 +64,7 @@
 
 
 #import required functions
-import sys, os, datetime, random, time, math, re, threading
+import sys, os, datetime, random, time, math, re, threading, queue, collections, bisect, json, multiprocessing
 ##import logging
 import asyncio, cozmo, cozmo.objects, cozmo.util
 from cozmo.util import degrees, distance_mm, speed_mmps, Pose
@@ -72,8 +72,10 @@ from cozmo.objects import CustomObject, CustomObjectMarkers, CustomObjectTypes
 
 #external libraries used for camera annotation
 #you will need to add these using pip/pip3
-from PIL import ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont
 import numpy as np
+#the camera frame analysis, run in a process of its own, and the frame recorder
+import cozmo_perception, cozmo_recorder
 #logging.basicConfig(filename='cozmo.log',level=logging.WARN)
 
 # set up global variables
@@ -81,7 +83,7 @@ global robot
 global freeplay
 global tempfreeplay
 global needslevel
-global cozmostate
+global statecontext
 global scheduler_playokay
 global msg
 global start_time
@@ -99,11 +101,63 @@ global robotvolume
 global debugging
 global batcounter
 global chargermarker1
+global statechange
+global laststatus
+global statechange_time
+global controlthread
+global statewaiting
+global resources
+global resourcestate
+global perception
+global recorder
+global transitionlatency
+global dockstats
+global docksearch
+global pickupreset
+global cliffwasinfreeplay
 
 # initialize needed variables
 freeplay = 0
 lightstate = 0
 batcounter = 0
+statechange = threading.Event() # set from the SDK event loop whenever a status that drives the state machine changes
+laststatus = None
+statusdraining = False
+statechange_time = None
+controlthread = None # the thread running the state loop, see robot_state_wake()
+statewaiting = False
+resources = {} # what's switched on right now, see robot_resource()
+resourcestate = None # the state whose profile that is
+perception = None # the worker process, its frame ring and queues while it runs
+recorder = None # the cozmo_recorder.FrameRecorder while recording
+perceptionstats = {'frames': 0, 'dropped': 0, 'results': 0, 'latency_total': 0.0, 'latency_max': 0.0, 'last': None, 'motion': False, 'camera_covered': False}
+perceptionlock = threading.Lock() # the event loop counts frames, the results thread the rest, see robot_perception_stats()
+transitionlatency = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0, 'state': None}
+dockstats = {'searches': 0, 'found': 0, 'find_time': 0.0, 'docked': 0, 'dock_time': 0.0, 'attempts': 0, 'first_attempt': 0, 'fallbacks': 0}
+docksearch = None # the charger search in progress, from low battery until on the charger
+sequencetrace = collections.deque(maxlen=200) # (time, sequence, step, seconds, tries, result) of the last steps run
+pickupreset = None
+cliffwasinfreeplay = 0
+logbuffer = collections.deque(maxlen=1000) # oldest records fall off if the writer can't keep up
+logtokens = 0
+logtokentime = 0
+logdropped = 0
+loglock = threading.Lock() # guards the token bucket above
+logwriter = None
+loglevelnames = ('DEBUG', 'INFO', 'WARN')
+batteryestimate = {'voltage': None, 'rate': 0.0, 'time': None, 'charger': None}
+batterytrace = None
+batterytracetime = 0
+calibration = {}
+calibrationlock = threading.Lock()
+schedule = None # play windows, see robot_schedule_load()
+chargerpose = None
+chargerrelative = None
+chargermarkerseen = None
+chargerlastseen = None
+searchorigin = None
+searchseen = set()
+searchblocked = set()
 robot = cozmo.robot.Robot
 msg = 'No status'
 q = None # dependency on queue variable for messaging instead of printing to event-content directly
@@ -124,6 +178,96 @@ lowbatvoltage = 3.7
 highbatvoltage= 4.14
 maxbatvoltage = 4.8
 #
+# BATTERY ESTIMATOR
+#
+# batteryfiltertau - seconds of smoothing on the voltage, long enough to ride out motor load sag
+# batteryratetau - seconds of smoothing on the discharge rate
+# batterydocklead - go look for the charger when the predicted time until lowbatvoltage drops below this many seconds
+# batterytracefile - record a voltage trace to this csv file (for battery_replay.py), None to disable
+batteryfiltertau = 20
+batteryratetau = 600
+batterydocklead = 180
+batterytracefile = None
+batterytraceinterval = 1.0
+#
+# CALIBRATION FILE
+#
+# calibrated battery voltages and charge history are saved here per robot, next to this script whatever
+# directory it's started from, None to disable
+calibrationfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cozmo_calibration.json')
+calibrationhistory = 200
+#
+# CHARGER SEARCH
+#
+# search_planner - 1 picks search poses that bring unexplored floor into view, 0 uses the old random poses
+# searchviewrange - distance (mm) at which Cozmo can still make out the charger
+# searchfov - horizontal field of view of the camera in degrees
+search_planner = 1
+searchcellsize = 100
+searchviewrange = 400
+searchfov = 58
+searchstepdistances = (150, 250, 350)
+searchtravelcost = 0.01
+searchturncost = 0.005
+searchchargerbias = 6
+#
+# DOCKING
+#
+# dockclosedloop - 1 turns around and backs onto the charger steering by robot.pose, stopping as soon as he's on
+# the contacts; 0 does the old blind 2 x 95 degree turn and 147 mm reverse
+# dockdistance - mm from the charger pose (where lining up ends) to where Cozmo sits on the contacts
+# dockspeed - mm/s backing onto the charger
+# dockheadingtolerance - degrees of heading error left after turning around before he starts backing in
+# dockovershoot - mm past the contacts before a reverse that didn't end up on the charger is given up
+dockclosedloop = 1
+dockdistance = 127
+dockspeed = 80
+dockheadingtolerance = 3
+dockovershoot = 30
+dockinterval = 0.05
+#
+# RANDOM ANIMATIONS
+#
+# animblacklist - random animations never pick a trigger with one of these in its name
+# animwhitelist - if not empty, only triggers with one of these in their name are picked
+# animcategoryweights - how often each category (the first word of the trigger name: Code, Feeding, Cube...) comes
+# up compared to the others, shared out over the triggers in it; categories not listed get animdefaultweight
+animblacklist = ('Onboarding', 'MeetCozmo', 'list', 'List', 'Severe', 'TakaTaka', 'Test', 'Loop', 'Sleep', 'Request', 'Singing', 'Drone', 'SoundOnly')
+animwhitelist = ()
+animcategoryweights = {'Code': 3.0, 'Feeding': 0.5, 'Needs': 0.5, 'Repair': 0.5}
+animdefaultweight = 1.0
+#
+# ANIMATION CATALOG
+#
+# animcatalog - 1 times every animation trigger that plays and how far the voltage sags while it plays, kept per
+# robot in the calibration file (anim_catalog.py exports it)
+# animbudgetshare - an animation may take at most this share of the time left before Cozmo has to go looking for
+# his charger (or before scheduled play time ends), or of the voltage left above lowbatvoltage; longer or
+# costlier ones are skipped
+animcatalog = 1
+animbudgetshare = 0.25
+animcatalogwindow = 20
+animcatalogsaveinterval = 60
+#
+# ANIMATION RESET
+#
+# after an animation the head goes back to resetheadangle (degrees) and the lift all the way down; both moves
+# run at the same time, and are skipped when the head is within resetheadtolerance degrees and the lift within
+# resetlifttolerance mm of where they should be already
+resetheadangle = 0
+resetheadtolerance = 2
+resetlifttolerance = 3
+#
+# ACTION SEQUENCES
+#
+# the maneuvers (backing onto the charger, leaving it, the search) run as sequences of steps, see robot_run_sequence()
+# steptimeout - seconds a drive, turn or animation step may take before it is aborted
+# stepbackoff - seconds before a failed step is tried again (for steps that have retries), doubling every time
+# steppoll - how often (seconds) a running step checks whether the sequence has to stop
+steptimeout = 30
+stepbackoff = 0.5
+steppoll = 0.25
+#
 # CUBE USAGE
 #
 # whether or not to activate the cubes (saves battery if you don't)
@@ -135,48 +279,456 @@ use_cubes = 1
 # what volume Cozmo should play sounds at, value between 0 and 1
 robotvolume = 0.2
 #
+# RESOURCE PROFILES
+#
+# what Cozmo has switched on in each state, set every time the state changes (see robot_apply_profile())
+# camera      - the camera image stream to this computer (his own vision on the phone keeps working without it)
+# expressions - facial expression estimation
+# cubes       - the cube connection (never on without use_cubes)
+# reactions   - the reaction triggers
+# poll        - seconds the state loop waits between passes when nothing changes
+# volume      - between 0 and 1
+# a state that leaves a setting out (or isn't listed, like 9 and 99) keeps what the state before it had
+resourceprofiles = {
+	0  : {'camera': True,  'expressions': True,  'reactions': True,  'poll': 0.5, 'volume': robotvolume},
+	1  : {'camera': False, 'expressions': False, 'cubes': False, 'reactions': False, 'poll': 2.0, 'volume': robotvolume / 2},
+	2  : {'camera': False, 'expressions': False, 'cubes': False, 'reactions': False, 'poll': 2.0, 'volume': robotvolume},
+	4  : {'camera': True,  'expressions': True,  'cubes': True,  'reactions': True,  'poll': 0.5, 'volume': robotvolume},
+	5  : {'camera': True,  'expressions': True,  'cubes': False, 'reactions': True,  'poll': 0.5},
+	6  : {'camera': True,  'expressions': True,  'cubes': False, 'reactions': True,  'poll': 0.5},
+	98 : {'camera': True,  'expressions': True,  'cubes': False, 'poll': 0.5},
+}
+#
 # SCHEDULER USAGE
 #
 # whether or not to use the schedule to define allowed "play times"
 # this code is a bit rough, use at your own risk
 use_scheduler = 0
+# play from 7pm to 11pm on weekdays, from 7am to 11pm on weekends
+weekdaystartplay = 19
+weekdaystopplay  = 23
+weekendstartplay = 7
+weekendstopplay  = 23
+# schedulefile - play windows per day of the week, holidays and single-date exceptions (see
+# cozmo_schedule.example.json); days the file leaves out keep the hours above, no file means just the hours above
+# scheduletopup - seconds before a play window opens to drive off the charger contacts and back on, so the charger
+# tops the battery up after sitting full all night (0 to leave him alone until play time)
+schedulefile = 'cozmo_schedule.json'
+scheduletopup = 0
+#
+# PERCEPTION
+#
+# use_perception - analyse the camera frames in a worker process (cozmo_perception.py) for brightness, motion and
+# something covering the camera. Needs the image stream, so there's nothing to see while he's docked
+# perceptionslots - frames that can be with the worker at once, any more than that are dropped
+# motionlevel / coveredlevel - scores above these switch the 'motion' and 'camera_covered' status events on, motion is the
+# share of the view that changed between frames, covered the share that's dark and featureless
+use_perception = 0
+perceptionslots = 3
+motionlevel = 0.01
+coveredlevel = 0.6
+#
+# FRAME RECORDER
+#
+# use_recorder - keep the last camera frames with his state and pose in recordfile while in one of recordstates, see
+# cozmo_recorder.py for looking at them afterwards. Needs the image stream like perception does
+# recordslots - frames the file holds, at 15 frames a second the default is the last minute
+# recordscale - every recordscale'th pixel is kept, 2 makes the 320x240 frames 160x120 and the file about 17MB
+use_recorder = 0
+recordfile = 'cozmo_frames.ring'
+recordslots = 900
+recordscale = 2
+recordstates = (5, 6, 98)
 # 
 # DEBUGGING
 # when disabled, clears the screen status updates every cycle
 debugging = 1
+#
+# LOGGING
+# status lines are buffered and written by a background thread
+# logfile - write status lines to this file instead of the screen (None for screen only)
+# loglevel - 0 debug, 1 info, 2 warnings only
+# logratelimit - max status lines per second, extra lines are dropped and counted
+logfile = None
+loglevel = 0
+logratelimit = 50
+logflushinterval = 0.25
 
 # END OF CONFIGURABLE VARIABLES
 #
 
 
 #
-# CAMERA ANNOTATOR
+# CLOCK
+#
+# everything in the control code that sleeps, waits for a status change or reads the time goes through clock.
+# RealClock is the wall clock; VirtualClock is simulated time for cozmo_sim.py, so a day of charging and playing
+# can be run through in a few seconds
+#
+class RealClock:
+	threaded = True # status edges are handed out by the CheckState thread
+
+	def time(self):
+		return time.time()
+
+	def now(self):
+		return datetime.datetime.now()
+
+	def sleep(self, seconds):
+		time.sleep(seconds)
+
+	def wait(self, event, timeout):
+		return event.wait(timeout)
+
+	def timer(self, seconds, function):
+		t = threading.Timer(seconds, function)
+		t.start()
+		return t
+
+class VirtualClock:
+	# time only moves while the program sleeps or waits, one tick at a time, and everything else happens on the
+	# waiting thread: each tick runs the tickers (the simulator, the status edge dispatch) and then any timers
+	# that came due. Nothing depends on how fast the computer is, so the same seed gives the same decisions
+	threaded = False
+
+	def __init__(self, start=0.0, tick=0.05):
+		self.start = start
+		self.tick = tick
+		self.ticks = 0
+		self.t = start
+		self.tickers = []
+		self.timers = []
+
+	def time(self):
+		return self.t
+
+	def now(self):
+		return datetime.datetime.fromtimestamp(self.t)
+
+	def sleep(self, seconds):
+		for _ in range(max(1, int(round(seconds / self.tick)))):
+			self.step()
+
+	def wait(self, event, timeout):
+		for _ in range(max(1, int(round(timeout / self.tick)))):
+			if event.is_set():
+				break
+			self.step()
+		return event.is_set()
+
+	def timer(self, seconds, function):
+		t = VirtualTimer(self.t + seconds, function)
+		self.timers.append(t)
+		return t
+
+	def add_ticker(self, function):
+		self.tickers.append(function)
+
+	def remove_ticker(self, function):
+		if function in self.tickers:
+			self.tickers.remove(function)
+
+	def step(self):
+		# counting ticks instead of adding up floats keeps long runs on the same grid
+		self.ticks += 1
+		self.t = self.start + self.ticks * self.tick
+		for function in list(self.tickers):
+			function()
+		for t in [t for t in self.timers if t.due <= self.t]:
+			self.timers.remove(t)
+			if not t.cancelled:
+				t.function()
+
+class VirtualTimer:
+	def __init__(self, due, function):
+		self.due = due
+		self.function = function
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+clock = RealClock()
+
 #
+# STATE CONTEXT
+# the state is changed from the control loop, the CheckState thread and the SDK event handlers, so every change
+# goes through statecontext: the check and the write happen under one lock (compare_and_set only moves on from
+# the state the caller expects, so an animation finishing can't put back a state a handler has since left),
+# every transition is counted, and the subscribers hear about it in the thread that made the change
 #
+statenames = {0: 'recovering', 1: 'charging', 2: 'charged', 3: 'battery low', 4: 'freeplay', 5: 'find charger', 6: 'docking', 9: 'picked up', 98: 'look around', 99: 'animating'}
+
+class StateContext:
+	def __init__(self, state=0):
+		self.lock = threading.Lock()
+		self.state = state
+		self.since = clock.time()
+		self.transitions = 0
+		self.histogram = collections.Counter() # (from, to) -> times
+		self.last = None # (time, from, to, reason)
+		self.subscribers = []
+
+	def subscribe(self, function):
+		# function(old, new, reason), called after every transition
+		self.subscribers.append(function)
+
+	def set(self, new, reason=None):
+		# returns the state we left
+		with self.lock:
+			old = self.state
+			changed = self.commit(old, new, reason)
+		if changed:
+			self.notify(old, new, reason)
+		return old
+
+	def compare_and_set(self, expected, new, reason=None):
+		# only from the expected state (or one of a tuple of them), True if we're in the new state now
+		with self.lock:
+			old = self.state
+			if old not in (expected if isinstance(expected, tuple) else (expected,)):
+				return False
+			changed = self.commit(old, new, reason)
+		if changed:
+			self.notify(old, new, reason)
+		return True
+
+	def set_unless(self, excluded, new, reason=None):
+		# from anything but the excluded state(s), e.g. never out of charging into looking for the charger
+		with self.lock:
+			old = self.state
+			if old in (excluded if isinstance(excluded, tuple) else (excluded,)):
+				return False
+			changed = self.commit(old, new, reason)
+		if changed:
+			self.notify(old, new, reason)
+		return True
+
+	def commit(self, old, new, reason):
+		if old == new:
+			return False
+		self.state = new
+		self.since = clock.time()
+		self.transitions += 1
+		self.histogram[(old, new)] += 1
+		self.last = (self.since, old, new, reason)
+		return True
+
+	def notify(self, old, new, reason):
+		for function in self.subscribers:
+			try:
+				function(old, new, reason)
+			except Exception as e:
+				robot_print_current_state('state subscriber failed: %s' % str(e), 2)
+
+	def name(self, state=None):
+		state = self.state if state is None else state
+		return statenames.get(state, str(state))
+
+	def report(self, top=3):
+		common = ', '.join('%d>%d x%d' % (old, new, n) for (old, new), n in self.histogram.most_common(top))
+		return '%s for %ds, %d transitions (%s)' % (self.name(), clock.time() - self.since, self.transitions, common or 'none yet')
+
+statecontext = StateContext()
+
+
+#
+# CAMERA ANNOTATOR
+# the viewer calls camera_info for every frame. Laying out outlined text is most of what that costs, so every line
+# is drawn once into a transparent bitmap and the lines into one overlay; a frame only gets the overlay pasted on.
+# The overlay is put together again when what it shows changes, the lines only when one reads differently
+#
+overlaylines = {} # text -> outlined line
+overlaykey = None # the values the overlay shows
+overlay = None
+overlayspacing = 2
+overlaymeasure = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+def robot_overlay_textsize(text):
+	if hasattr(overlaymeasure, 'textbbox'):
+		left, top, right, bottom = overlaymeasure.textbbox((0, 0), text)
+		return right, bottom
+	return overlaymeasure.textsize(text)
+
+def robot_overlay_line(text):
+	line = overlaylines.get(text)
+	if line is None:
+		if len(overlaylines) > 500:
+			# battery and gain keep reading differently, don't hold on to every line ever shown
+			overlaylines.clear()
+		# every line as tall as the tallest letters, so they don't move about as the text changes
+		width = robot_overlay_textsize(text)[0]
+		height = robot_overlay_textsize('Ag')[1]
+		line = Image.new('RGBA', (width + 2, height + 2))
+		d = ImageDraw.Draw(line)
+		# black all around, like ImageText's full outline
+		for x, y in ((0, 1), (2, 1), (1, 0), (1, 2)):
+			d.text((x, y), text, fill='black')
+		d.text((1, 1), text, fill='white')
+		overlaylines[text] = line
+	return line
+
+def robot_overlay(key):
+	global overlaykey, overlay
+	if key != overlaykey:
+		exposure, gain, state, voltage = key
+		lines = [robot_overlay_line(text) for text in ('Exposure: %s ms' % exposure, 'Gain: %.3f' % gain, 'State: %s' % statecontext.name(state), 'Battery: %.2f V' % voltage)]
+		# line to line like multiline text, descenders hang into the spacing
+		pitch = robot_overlay_textsize('A')[1] + overlayspacing
+		overlay = Image.new('RGBA', (max(line.width for line in lines), pitch * (len(lines) - 1) + lines[-1].height))
+		for i, line in enumerate(lines):
+			overlay.paste(line, (0, i * pitch))
+		overlaykey = key
+	return overlay
+
 @cozmo.annotate.annotator
 def camera_info(image, scale, annotator=None, world=None, **kw):
 	global camera
-	d = ImageDraw.Draw(image)
-	bounds = [3, 0, image.width, image.height]
-
 	camera = world.robot.camera
-	text_to_display = 'Exposure: %s ms\n' % camera.exposure_ms
-	text_to_display += 'Gain: %.3f\n' % camera.gain
-	text = cozmo.annotate.ImageText(text_to_display,position=cozmo.annotate.TOP_LEFT,line_spacing=2,color="white",outline_color="black", full_outline=True)
-	text.render(d, bounds)
+	# battery to the hundredth of a volt, like it's shown
+	layer = robot_overlay((camera.exposure_ms, camera.gain, statecontext.state, round(world.robot.battery_voltage, 2)))
+	image.paste(layer, (2, -1), layer)
+
+#
+# PERCEPTION
+# camera frames go to the worker in cozmo_perception.py through a ring of shared memory slots. The event loop only
+# copies a frame into a free slot, the results come back on a thread of their own, and what matters to the state
+# machine is handed on like the robot's status changes: as 'motion' and 'camera_covered' events, only when they flip.
+# Latencies are real time from the frame arriving to its result, the virtual clock has nothing to do with frames
+#
+def robot_perception_start():
+	global perception
+	# spawned rather than forked, the SDK's threads don't survive a fork
+	context = multiprocessing.get_context('spawn')
+	ring = cozmo_perception.FrameRing(context, perceptionslots)
+	todo = context.Queue()
+	done = context.Queue()
+	process = context.Process(target=cozmo_perception.worker, args=(ring, todo, done), name='CozmoPerception', daemon=True)
+	process.start()
+	perception = {'ring': ring, 'todo': todo, 'done': done, 'process': process, 'free': list(range(perceptionslots)), 'lock': threading.Lock(), 'frameid': 0}
+	threading.Thread(target=robot_perception_results, args=(perception,), name='PerceptionResults', daemon=True).start()
+
+def robot_perception_stop():
+	global perception
+	worker = perception
+	if worker is None:
+		return
+	perception = None
+	worker['todo'].put(None)
+	worker['done'].put(None)
+	worker['process'].join(5)
+
+def monitor_EvtNewCameraImage(evt, *, image, **kwargs):
+	# on the SDK's event loop, so nothing but copying the frame where it's going happens here. The SDK hands over
+	# RGB, the grey version is made once for the recorder and the worker both
+	worker = perception
+	recording = recorder is not None and statecontext.state in recordstates
+	if worker is None and not recording:
+		return
+	frame = image.raw_image
+	if frame.mode != 'L':
+		frame = frame.convert('L')
+	width, height = frame.size
+	pixels = np.asarray(frame)
+	if recording:
+		robot_record_frame(pixels, width, height)
+	if worker is None:
+		return
+	with worker['lock']:
+		full = not worker['free'] or not worker['ring'].fits(width, height)
+		if not full:
+			slot = worker['free'].pop(0)
+			worker['frameid'] += 1
+			frameid = worker['frameid']
+	with perceptionlock:
+		perceptionstats['frames'] += 1
+		if full:
+			perceptionstats['dropped'] += 1
+	if full:
+		return
+	worker['ring'].view(slot, width, height)[:] = pixels
+	worker['todo'].put((slot, frameid, width, height, time.monotonic()))
+
+def robot_perception_results(worker):
+	reported = time.monotonic()
+	while True:
+		result = worker['done'].get()
+		if result is None:
+			break
+		slot, frameid, sent, histogram, brightness, motion, covered = result
+		now = time.monotonic()
+		with worker['lock']:
+			worker['free'].append(slot)
+		latency = (now - sent) * 1000
+		with perceptionlock:
+			perceptionstats['results'] += 1
+			perceptionstats['latency_total'] += latency
+			perceptionstats['latency_max'] = max(perceptionstats['latency_max'], latency)
+			perceptionstats['last'] = {'frame': frameid, 'histogram': histogram, 'brightness': brightness, 'motion': motion, 'covered': covered}
+		robot_perception_edge('motion', motion > motionlevel)
+		robot_perception_edge('camera_covered', covered > coveredlevel)
+		if now - reported >= 60:
+			reported = now
+			robot_print_current_state('perception - %s' % robot_perception_report(), 0)
+
+def robot_perception_edge(name, value):
+	# into the status queue, so the subscribers hear about it from CheckState like every other status change
+	with perceptionlock:
+		changed = perceptionstats[name] != value
+		perceptionstats[name] = value
+	if changed:
+		q.put((name, value))
+
+def robot_perception_stats():
+	# a copy taken in one go, so the dropped share and the mean latency are from the same moment
+	with perceptionlock:
+		return dict(perceptionstats)
+
+def robot_perception_report():
+	stats = robot_perception_stats()
+	last = stats['last'] or {'brightness': 0, 'motion': 0, 'covered': 0}
+	return '%d frames, %d dropped, latency %.1f ms (max %.1f), brightness %.0f, motion %.3f, covered %.2f' % (stats['frames'], stats['dropped'], stats['latency_total'] / max(stats['results'], 1), stats['latency_max'], last['brightness'], last['motion'], last['covered'])
+
+#
+# FRAME RECORDER
+# the frames seen while looking for and docking with the charger, with his state and pose, in a ring file of fixed
+# size (cozmo_recorder.py). Switched on and off with the state, frames from any other state aren't even converted
+#
+def robot_recorder_start():
+	global recorder
+	recorder = cozmo_recorder.FrameRecorder(recordfile, recordslots, 320 // recordscale, 240 // recordscale, recordscale)
+
+def robot_recorder_stop():
+	global recorder
+	frames = recorder
+	if frames is None:
+		return
+	recorder = None
+	frames.close()
+
+def robot_record_frame(pixels, width, height):
+	frames = recorder
+	if frames is None or not frames.fits(width, height):
+		return
+	pose = robot.pose
+	frames.write(pixels, clock.time(), statecontext.state, pose.position.x, pose.position.y, pose.position.z, pose.rotation.angle_z.degrees)
 
 		
 #
 # MAIN PROGRAM LOOP START
 #
 def cozmo_unleashed(robot: cozmo.robot.Robot):
-	cozmo.setup_basic_logging(general_log_level='WARN', protocol_log_level='WARN', protocol_log_messages='all', deprecated_filter='default')
+	if not cozmo.logger.handlers:
+		# once per process, cozmo_supervisor.py runs this for every robot
+		cozmo.setup_basic_logging(general_log_level='WARN', protocol_log_level='WARN', protocol_log_messages='all', deprecated_filter='default')
 	#os.system('cls' if os.name == 'nt' else 'clear')
-	global cozmostate,chargermarker1,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, batlightcounter, lowbatvoltage, highbatvoltage, maxbatvoltage, use_scheduler,msg,objmsg,facemsg,camera, foundcharger, tempfreeplay
+	global statecontext,controlthread,chargermarker1,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, batlightcounter, lowbatvoltage, highbatvoltage, maxbatvoltage, use_scheduler,msg,objmsg,facemsg,camera, foundcharger, tempfreeplay
 	#robot.world.charger = None
 	#charger = None
 	foundcharger = 0
-	robot.set_robot_volume(robotvolume)
+	robot_calibration_load(robot)
+	robot_schedule_load()
+	robot_anim_index_build(robot.anim_triggers)
 	if use_cubes == 1:
 		robot.enable_freeplay_cube_lights(enable=True)
 	#robot.enable_device_imu(enable_raw=False, enable_user=True, enable_gyro=True)
@@ -184,23 +736,17 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 	robot.world.image_annotator.add_annotator('camera_info', camera_info)
 	camera = robot.camera
 	camera.enable_auto_exposure()
-	robot.enable_facial_expression_estimation(enable=True)
-	robot.camera.image_stream_enabled = True
 	robot.camera.color_image_enabled = False
-	if use_cubes == 0:
-		robot.world.disconnect_from_cubes()
-	else:
-		robot.world.connect_to_cubes()
-	robot.enable_all_reaction_triggers(True)
 	robot.enable_stop_on_cliff(True)
 	q = None # dependency on queue variable for messaging instead of printing to event-content directly
 	thread_running = False # starting thread for custom events
-	robot.set_needs_levels(repair_value=1, energy_value=1, play_value=1)
-	needslevel = 1
 	tempfreeplay = 0
 	lowbatcount=0
 	batlightcounter=0
-	cozmostate = 0
+	controlthread = threading.current_thread()
+	statecontext = StateContext()
+	statecontext.subscribe(robot_state_wake)
+	statecontext.subscribe(robot_state_profile)
 	#some custom objects that I printed out and use as virtual walls, if you don't have them don't worry about it, it won't affect the program
 	# wall_obj1 = robot.world.define_custom_wall(CustomObjectTypes.CustomType01, CustomObjectMarkers.Circles2,  340, 120, 44, 44, True)
 	# wall_obj2 = robot.world.define_custom_wall(CustomObjectTypes.CustomType02, CustomObjectMarkers.Circles4,  340, 120, 44, 44, True)
@@ -213,32 +759,46 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 	# wall_obj8 = robot.world.define_custom_wall(CustomObjectTypes.CustomType08, CustomObjectMarkers.Hexagons3, 120, 340, 44, 44, True)
 	chargermarker1 = robot.world.define_custom_wall(CustomObjectTypes.CustomType01, CustomObjectMarkers.Hexagons2, 40, 40, 40, 40, True)
 	# initialize event monitoring thread
-	q = None
+	q = queue.Queue()
 	monitor(robot, q)
-	start_time = time.time()
+	# after monitor(), the command helpers send through the global robot it sets
+	robot_resource_start()
+	if use_perception == 1:
+		robot_perception_start()
+	if use_recorder == 1:
+		robot_recorder_start()
+	robot_cmd_set_needs_levels(1)
+	needslevel = 1
+	start_time = clock.time()
+	commandstats['since'] = start_time
+	robot_start_logwriter()
 	msg = 'initialization complete'
 	robot_print_current_state('entering main loop')
 # ENTERING STATE LOOP
+# instead of sleeping a fixed interval between passes the loop blocks in robot_wait_for_state_change(),
+# which returns as soon as monitor_EvtRobotStateUpdated sees charger/pickup/cliff/battery status change
 	while True:
+		# transitions the handlers made since the last pass
+		robot_apply_profile()
 		#robot_backbackbatteryindicator()
 		#robot_print_current_state('main loop checkpoint')
 #
 
 #State 1: on charger, charging
 		if (robot.is_on_charger == 1) and (robot.is_charging == 1):
-			if cozmostate != 1: # 1 is charging
+			if statecontext.state != 1: # 1 is charging
+				robot_record_transition_latency(1)
 				robot_print_current_state('switching to state 1')
-				cozmostate = 1
-				start_time = time.time()
+				statecontext.set(1)
+				robot_calibration_event('charging', robot.battery_voltage)
+				start_time = clock.time()
 				foundcharger = 0
 				if robot.is_freeplay_mode_active:
 					######robot.enable_all_reaction_triggers(False)
 					robot.stop_freeplay_behaviors()
 				freeplay = 0
-				if use_cubes == 1:
-					robot.world.disconnect_from_cubes()
 			lowbatcount=0
-			cozmostate = 1
+			statecontext.set(1)
 			msg = 'state 1 checkpoint'
 			robot_print_current_state('state 1 - charging')
 			# once in a while make random snoring noises
@@ -247,79 +807,82 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 #State 2: on charger, fully charged
 #
 		if (robot.is_on_charger == 1) and (robot.is_charging == 0):
-			cozmostate = 2
+			if statecontext.state != 2:
+				robot_record_transition_latency(2)
+				# fully charged - this is the top of the scale for the charging lights
+				maxbatvoltage = robot.battery_voltage
+				robot_calibration_event('charged', maxbatvoltage)
+			statecontext.set(2)
 			robot_print_current_state('switching to state 2 - pausing 30 secs')
-			time.sleep(30)
-			if cozmostate != 2:  # 2 is fully charged
+			robot_wait_for_state_change(30)
+			if statecontext.state != 2:  # 2 is fully charged
 				maxbatvoltage = robot.battery_voltage
 				robot_print_current_state('switching to state 2')
-				cozmostate = 2
+				statecontext.set(2)
 				lowbatcount=0
 				foundcharger = 0
-				if use_cubes == 1:
-					robot.world.connect_to_cubes()
 			msg = 'state 2 checkpoint'
 			robot_print_current_state('state 2 - charged')
-			robot.set_needs_levels(repair_value=1, energy_value=1, play_value=1)
+			robot_cmd_set_needs_levels(1)
 			# robot.drive_off_charger_contacts().wait_for_completed()
 			# robot.drive_straight(distance_mm(100), speed_mmps(50)).wait_for_completed()
 			robot_check_scheduler()
 #
 #State 3: not on charger, battery starting to get low
 #
-		# basic 'trigger guard' so Cozmo doesn't go to charger immediately if the voltage happens to dip below 3.7
-		if (robot.battery_voltage <= lowbatvoltage) and (robot.is_on_charger == 0) and cozmostate != 5 and cozmostate != 6  and cozmostate !=98 and cozmostate != 1 and cozmostate != 2:
+		# the battery estimator smooths out voltage dips under load, so Cozmo doesn't go to charger immediately if the voltage happens to dip below 3.7
+		if robot_battery_low() and (robot.is_on_charger == 0) and statecontext.state != 5 and statecontext.state != 6  and statecontext.state !=98 and statecontext.state != 1 and statecontext.state != 2:
 			lowbatcount += 1
 			robot_set_needslevel()
 			msg = 'state 3 checkpoint'
-			robot_print_current_state('state 3 - low battery threshold breach %s' % str(lowbatcount))
+			robot_print_current_state('state 3 - low battery predicted - %s' % robot_battery_report())
 			robot_reaction_chance(cozmo.anim.Triggers.CodeLabTakaTaka,1,False,False,False)
 			# print("Event log      : %s" % str(msg))
-			time.sleep(0.5)
-		# if we dip below the threshold three times we switch to state 5
-		if lowbatcount > 2 and (robot.is_on_charger == 0) and cozmostate !=5 and cozmostate !=6 and cozmostate !=99  and cozmostate !=98 and cozmostate != 1 and cozmostate != 2:
-			if use_cubes == 1:
-				robot.world.disconnect_from_cubes()
+			robot_wait_for_state_change(0.5)
+		# once the estimate says we're low we switch to state 5
+		if lowbatcount > 0 and (robot.is_on_charger == 0) and statecontext.state !=5 and statecontext.state !=6 and statecontext.state !=99  and statecontext.state !=98 and statecontext.state != 1 and statecontext.state != 2:
 			robot_set_needslevel()
 			msg = 'state 3 exit'
 			robot_print_current_state('state 3 - low battery - switching to state 5')
-			if cozmostate != 1 and cozmostate != 6:
-				cozmostate = 5
+			if statecontext.state != 1 and statecontext.state != 6:
+				robot_record_transition_latency(5)
+				statecontext.set(5)
+				robot_calibration_event('low', robot.battery_voltage)
+				robot_dock_event('low')
 #			
 #State 4: not on charger, good battery - freeplay active
 #
-		if (robot.battery_voltage > lowbatvoltage) and (robot.is_on_charger == 0) and cozmostate != 9 and cozmostate != 5 and cozmostate != 6 and cozmostate != 3 and lowbatcount < 3 and cozmostate != 99  and cozmostate !=98:
-			if cozmostate != 4: # 4 is freeplay
+		if not robot_battery_low() and (robot.is_on_charger == 0) and statecontext.state != 9 and statecontext.state != 5 and statecontext.state != 6 and statecontext.state != 3 and lowbatcount < 1 and statecontext.state != 99  and statecontext.state !=98:
+			if statecontext.state != 4: # 4 is freeplay
+				robot_record_transition_latency(4)
 				msg = 'state 4 checkpoint'
 				robot_print_current_state('freeplay - switching to state 4')
-				cozmostate = 4
+				statecontext.set(4)
 				if freeplay == 0:
 					freeplay = 1
-					start_time = time.time()
+					start_time = clock.time()
 					try:
 						robot.drive_wheels(40, 40, l_wheel_acc=50, r_wheel_acc=50, duration=1)
 					except:
 						robot_print_current_state('state 4 - failed to drive wheels')
 					robot_reaction_chance(cozmo.anim.Triggers.OnSpeedtapGameCozmoWinHighIntensity,1,True,False,False)
-					if use_cubes == 1:
-						robot.world.connect_to_cubes()
 					if not robot.is_freeplay_mode_active:
 						#robot.enable_all_reaction_triggers(True)
 						robot.start_freeplay_behaviors()
-		if not robot.is_freeplay_mode_active and cozmostate == 4:
+		if not robot.is_freeplay_mode_active and statecontext.state == 4:
 			robot_print_current_state('state 4 - re-enabling freeplay')
 			freeplay = 1
 			#robot.enable_all_reaction_triggers(True)
 			robot.start_freeplay_behaviors()
 			robot_set_needslevel()
-		if cozmostate == 4:
+		if statecontext.state == 4:
 			robot_check_randomreaction()
-			time.sleep(0.5)
+			robot_wait_for_state_change(0.5)
 
 #
 # state 5: battery low, looking for charger
 #
-		if cozmostate == 5 and tempfreeplay != 1:
+		if statecontext.state == 5 and tempfreeplay != 1:
 			robot_print_current_state('switching to state 5')
 			if robot.is_freeplay_mode_active:
 				freeplay = 0
@@ -334,7 +897,7 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 #
 # state 6: battery low and we know where the charger is, moving to dock and docking
 #
-		if cozmostate == 6:
+		if statecontext.state == 6:
 			robot_print_current_state('switching to state 6')
 			if robot.is_freeplay_mode_active:
 				#####robot.enable_all_reaction_triggers(False)
@@ -349,16 +912,17 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 #
 # state 9: we're on our side or are currently picked up
 #
-		if cozmostate == 9:
+		if statecontext.state == 9:
+			robot_record_transition_latency(9)
 			robot_print_current_state('switching to state 9')
 			robot_flash_backpacklights(4278190335)  # 4278190335 is red
 			robot_reaction_chance(cozmo.anim.Triggers.CodeLabUnhappy,100,False,False,False)
-			while cozmostate == 9:
+			while statecontext.state == 9:
 				robot_print_current_state('state 9 - anger loop')
 				robot_set_needslevel()
 				if not robot.is_falling and not robot.is_picked_up:
 					robot_print_current_state('state 9 reset - switching to 0')
-					cozmostate = 0
+					statecontext.compare_and_set(9, 0)
 					lightstate = 0
 					break
 				if robot.is_freeplay_mode_active:
@@ -370,34 +934,34 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 				robot.wait_for_all_actions_completed()
 				robot_reaction_chance(cozmo.anim.Triggers.AskToBeRightedLeft,100,False,False,False)
 				robot_print_current_state('picked annoyed response 1')
-				time.sleep(0.5)
+				robot_wait_for_state_change(0.5)
 				if not robot.is_falling and not robot.is_picked_up:
 					robot_print_current_state('state reset - switching to 0')
-					cozmostate = 0
+					statecontext.compare_and_set(9, 0)
 					lightstate = 0
 					break
 				robot_reaction_chance(cozmo.anim.Triggers.TurtleRoll,100,False,False,False)
 				robot_print_current_state('picked annoyed response 2')
-				time.sleep(0.5)
+				robot_wait_for_state_change(0.5)
 				if not robot.is_falling and not robot.is_picked_up:
 					robot_print_current_state('state reset - switching to 0')
-					cozmostate = 0
+					statecontext.compare_and_set(9, 0)
 					lightstate = 0
 					break
 				robot_reaction_chance(cozmo.anim.Triggers.CodeLabUnhappy,100,False,False,False)
 				robot_print_current_state('picked annoyed response 3')
-				time.sleep(0.5)
+				robot_wait_for_state_change(0.5)
 				robot_print_current_state('state 9 - loop complete')
 
 #
 # state 0: recovery state
 #		
-		if cozmostate == 0:
+		if statecontext.state == 0:
 			robot_print_current_state('state 0')
 			#robot_reaction_chance(cozmo.anim.Triggers.CodeLabSurprise,1,True,True,True)
 			#robot.set_all_backpack_lights(cozmo.lights.white_light)
 			lightstate = 0
-			time.sleep(0.5)
+			robot_wait_for_state_change(0.5)
 
 #
 # state 98: lookaround loop trying to find charger
@@ -415,7 +979,7 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 		#msg = 'state loop complete'
 		#robot_check_randomreaction()
 		#robot_print_current_state('cozmo_unleashed state program loop complete')
-		time.sleep(0.5)
+		robot_wait_for_state_change(resources['poll'])
 #
 #
 # END OF STATE LOOP
@@ -427,191 +991,343 @@ def cozmo_unleashed(robot: cozmo.robot.Robot):
 #
 # ROBOT FUNCTIONS
 #
+#
+# OUTBOUND COMMANDS
+# needs levels, backpack lights and the head light all go through robot_command_needed() first,
+# so repeats of a command the robot already has don't get sent over the (phone relayed) wifi link again
+#
+command_policies = {
+	# tolerance - a float parameter moving less than this counts as a repeat
+	# interval  - minimum seconds between two changed sends of the same command, a change coming in sooner is held
+	#             back and the latest one goes out when the interval is up
+	# refresh   - resend an unchanged command after this many seconds, in case freeplay changed it behind our back
+	'set_needs_levels'    : {'tolerance': 0.02, 'interval': 5.0, 'refresh': 60.0},
+	'set_backpack_lights' : {'tolerance': 0,    'interval': 0,   'refresh': 30.0},
+	'set_head_light'      : {'tolerance': 0,    'interval': 0.2, 'refresh': 30.0},
+}
+commandcache = {}
+commandpending = {} # name -> [params, send, timer] for a change waiting for its interval to end
+commandlock = threading.Lock() # the state loop, the event handlers and the flush timers all send commands
+commandstats = {'sent': 0, 'saved': 0, 'since': None} # set when the program starts
+
+def robot_command_needed(name, params, send):
+	# True if the caller should send the command now. A change inside the interval is kept as pending instead and
+	# send() is called with it when the interval ends, unless something newer has come in by then
+	policy = command_policies[name]
+	with commandlock:
+		now = clock.time()
+		last = commandcache.get(name)
+		if last is not None:
+			lastparams, lastsent = last
+			if robot_command_same(lastparams, params, policy['tolerance']):
+				if now - lastsent < policy['refresh']:
+					# back to what the robot already has, anything pending is out of date
+					if robot_command_drop(name):
+						commandstats['saved'] += 1
+					commandstats['saved'] += 1
+					return False
+			elif now - lastsent < policy['interval']:
+				pending = commandpending.get(name)
+				if pending is None:
+					timer = clock.timer(lastsent + policy['interval'] - now, lambda: robot_command_flush(name))
+					commandpending[name] = [params, send, timer]
+				else:
+					# replaces a change that never went out
+					pending[0], pending[1] = params, send
+					commandstats['saved'] += 1
+				return False
+		robot_command_drop(name)
+		commandcache[name] = (params, now)
+		commandstats['sent'] += 1
+		return True
+
+def robot_command_drop(name):
+	pending = commandpending.pop(name, None)
+	if pending is not None:
+		pending[2].cancel()
+	return pending is not None
+
+def robot_command_flush(name):
+	with commandlock:
+		pending = commandpending.pop(name, None)
+		if pending is None:
+			return
+		params, send, timer = pending
+		commandcache[name] = (params, clock.time())
+		commandstats['sent'] += 1
+	send()
+
+def robot_command_same(a, b, tolerance):
+	if tolerance and len(a) == len(b):
+		return all(abs(x - y) < tolerance for x, y in zip(a, b))
+	return a == b
+
+def robot_command_report():
+	minutes = max((clock.time() - commandstats['since']) / 60, 1/60)
+	return '%.1f/min saved (%d sent, %d saved)' % (commandstats['saved'] / minutes, commandstats['sent'], commandstats['saved'])
+
+def robot_cmd_set_needs_levels(level):
+	global robot
+	send = lambda: robot.set_needs_levels(repair_value=level, energy_value=level, play_value=level)
+	if robot_command_needed('set_needs_levels', (level,), send):
+		send()
+
+def robot_cmd_set_backpack_lights(light1, light2, light3, light4, light5):
+	global robot
+	# Light objects don't compare, key on what actually goes out in the message
+	key = tuple(None if l is None else (l.on_color.int_color, l.off_color.int_color, l.on_period_ms, l.off_period_ms, l.transition_on_period_ms, l.transition_off_period_ms) for l in (light1, light2, light3, light4, light5))
+	send = lambda: robot.set_backpack_lights(light1, light2, light3, light4, light5)
+	if robot_command_needed('set_backpack_lights', key, send):
+		send()
+
+def robot_cmd_set_head_light(enable):
+	global robot
+	send = lambda: robot.set_head_light(enable)
+	if robot_command_needed('set_head_light', (bool(enable),), send):
+		send()
+
 def robot_set_backpacklights(color):
 	global robot
-	robot.set_backpack_lights_off()
 	color1=cozmo.lights.Color(int_color=color, rgb=None, name=None)
 	color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
 	light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=2000, off_period_ms=1000, transition_on_period_ms=1500, transition_off_period_ms=500)
 	light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=2000)
 	light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=2000, transition_on_period_ms=500, transition_off_period_ms=1500)
-	robot.set_backpack_lights(None, light1, light2, light3, None)
+	robot_cmd_set_backpack_lights(None, light1, light2, light3, None)
 
 def robot_flash_backpacklights(color):
 	global robot
-	robot.set_backpack_lights_off()
 	color1=cozmo.lights.Color(int_color=color, rgb=None, name=None)
 	color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
 	light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=250, transition_on_period_ms=375, transition_off_period_ms=125)
 	light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=250, off_period_ms=250, transition_on_period_ms=250, transition_off_period_ms=500)
 	light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=250, off_period_ms=500, transition_on_period_ms=125, transition_off_period_ms=375)
-	robot.set_backpack_lights(None, light1, light2, light3, None)	
+	robot_cmd_set_backpack_lights(None, light1, light2, light3, None)	
 
-def robot_backbackbatteryindicator():
-	global robot,highbatvoltage,lowbatvoltage,maxbatvoltage,lightstate,batlightcounter
-	batmultiplier = ((highbatvoltage - lowbatvoltage)/3)+0.1
-	chargebatmultiplier = ((maxbatvoltage - lowbatvoltage)/3)+0.1
-	critbatmultiplier = ((lowbatvoltage - 3.5)/3)
-	robotvoltage=(robot.battery_voltage)
-	if not lightstate:
-		lightstate = 0
-	oldlightstate = lightstate
-	if robotvoltage > (highbatvoltage-batmultiplier) and cozmostate==4:
-		# bottom two lights on, third light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=1 and lightstate !=2:
-			lightstate = 1
-			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1)
-			light2=cozmo.lights.Light(on_color=color1)
-			light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage > (highbatvoltage-(batmultiplier*1.5)) and robotvoltage <= (highbatvoltage-batmultiplier) and cozmostate==4:
-		#bottom one light on, second light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=2 and lightstate !=3:
-			lightstate = 2
-			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1)
-			light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage > (highbatvoltage-(batmultiplier*2.5)) and robotvoltage <= (highbatvoltage-(batmultiplier*1.5)) and cozmostate==4:
-		# # bottom one light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=3:
-			lightstate = 3
-			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			light2=cozmo.lights.Light(on_color=color2)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage >= lowbatvoltage and cozmostate==4:
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=4:
-			lightstate = 4
-			color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
-			light2=cozmo.lights.Light(on_color=color2)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	#robot_set_backpacklights(65535)  # 65535 is blue
-	elif robotvoltage >= (maxbatvoltage-(chargebatmultiplier/2.5)) and robotvoltage <= (maxbatvoltage-(chargebatmultiplier/3.5)) and cozmostate==1:
-		# # bottom one light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=7 and lightstate !=6 and lightstate !=5:
-			lightstate = 7
-			color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			light2=cozmo.lights.Light(on_color=color2)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage >= (maxbatvoltage-(chargebatmultiplier/1.0)) and robotvoltage <= (maxbatvoltage-chargebatmultiplier/2.5) and cozmostate==1:
-		#bottom one light on, second light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=6 and lightstate !=5:
-			lightstate = 6
-			color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1)
-			light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage >= maxbatvoltage and cozmostate==1:
-		# bottom two lights on, third light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=5:
-			lightstate = 5
-			color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1)
-			light2=cozmo.lights.Light(on_color=color1)
-			light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	# elif robotvoltage >= maxbatvoltage and cozmostate==1:
-		# batlightcounter +=1
-		# if batlightcounter > 5 and lightstate !=8:
-			# lightstate = 8
-			# color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
-			# color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			# light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
-			# light2=cozmo.lights.Light(on_color=color2)
-			# light3=cozmo.lights.Light(on_color=color2)
-			# robot.set_backpack_lights(None, light3, light2, light1, None)
-			# batlightcounter = 0
-		# pass
-	#robot_set_backpacklights(4278190335)  # 4278190335 is red
+def robot_blink_head_light():
+	robot_cmd_set_head_light(False)
+	clock.sleep(0.5)
+	robot_cmd_set_head_light(True)
+	clock.sleep(0.5)
+	robot_cmd_set_head_light(False)
 
-	elif robotvoltage >= (lowbatvoltage+(critbatmultiplier*1.5)) and robotvoltage <= (lowbatvoltage+critbatmultiplier) and cozmostate==5:
-		#bottom one light on, second light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=10  and lightstate !=9:
-			lightstate = 10
-			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1)
-			light2=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage >= (lowbatvoltage+(critbatmultiplier*2.5)) and robotvoltage <= (lowbatvoltage+(critbatmultiplier*1.5)) and cozmostate==5:
-		# # bottom one light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=11  and lightstate !=10:
-			lightstate = 11
-			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			light2=cozmo.lights.Light(on_color=color2)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage >= (lowbatvoltage+critbatmultiplier) and cozmostate==5:
-		# bottom two lights on, third light blinking
-		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=9:
-			lightstate = 9
-			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1)
-			light2=cozmo.lights.Light(on_color=color1)
-			light3=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
-			batlightcounter = 0
-		pass
-	elif robotvoltage >= lowbatvoltage and cozmostate==5:
+#
+# ACTION SEQUENCES
+# a maneuver is a list of steps instead of a chain of try/except blocks. A step is either a robot action, given
+# by the name of the robot method and its arguments, or a plain function call. robot_run_sequence() gives every
+# action a timeout, tries failed steps again after a pause that doubles each time, stops the whole sequence as
+# soon as abort() says so (checked between steps and while an action runs), and starts a step marked parallel
+# together with the step(s) before it - a head or lift move while driving, say. How long every step took ends
+# up in sequencetrace and the debug log
+#
+def robot_step(name, action, *args, timeout=None, retries=0, required=False, parallel=False, **kwargs):
+	# name - what the step does, a failure is logged as 'failed to <name>'
+	# required - a step that still fails after its retries ends the sequence, otherwise the sequence carries on
+	return {'name': name, 'action': action, 'args': args, 'kwargs': kwargs, 'timeout': steptimeout if timeout is None else timeout, 'retries': retries, 'required': required, 'parallel': parallel}
+
+def robot_step_start(step, in_parallel):
+	# returns the running action, or None for a function step (which has run by the time this returns)
+	action = step['action']
+	if callable(action):
+		action(*step['args'], **step['kwargs'])
+		return None
+	kwargs = dict(step['kwargs'])
+	if in_parallel:
+		kwargs['in_parallel'] = True
+	return getattr(robot, action)(*step['args'], **kwargs)
+
+def robot_step_wait(action, timeout, abort):
+	# 'ok', 'failed', 'timeout' or 'aborted'; an action that runs out of time or gets aborted is aborted on the robot too
+	deadline = clock.time() + timeout
+	while True:
+		if abort is not None and abort():
+			action.abort()
+			return 'aborted'
+		remaining = deadline - clock.time()
+		if remaining <= 0:
+			action.abort()
+			return 'timeout'
+		try:
+			action.wait_for_completed(timeout=min(remaining, steppoll))
+		except asyncio.TimeoutError:
+			continue
+		except Exception:
+			return 'failed'
+		return 'failed' if action.has_failed else 'ok'
+
+def robot_step_trace(sequence, step, start, tries, result):
+	now = clock.time()
+	sequencetrace.append((start, sequence, step['name'], now - start, tries, result))
+	robot_print_current_state('%s: %s %s in %.2f s (%d tries)' % (sequence, step['name'], result, now - start, tries), 0)
+	if result in ('failed', 'timeout'):
+		robot_print_current_state('failed to %s' % step['name'])
+
+def robot_run_sequence(name, steps, abort=None):
+	# returns 'done' once every step has run (whether or not the ones that aren't required worked),
+	# 'failed' if a required step failed and 'aborted' if abort() stopped it
+	i = 0
+	while i < len(steps):
+		group = [steps[i]]
+		i += 1
+		while i < len(steps) and steps[i]['parallel']:
+			group.append(steps[i])
+			i += 1
+		if abort is not None and abort():
+			robot_print_current_state('%s: aborted before %s' % (name, group[0]['name']), 0)
+			return 'aborted'
+		# start the actions of the group first, then run its function steps while they're under way
+		parallel = len(group) > 1
+		started = []
+		for step in sorted(group, key=lambda step: callable(step['action'])):
+			start = clock.time()
+			try:
+				started.append((step, start, robot_step_start(step, parallel), None))
+			except Exception:
+				started.append((step, start, None, 'failed'))
+		results = []
+		for step, start, action, result in started:
+			if result is None:
+				result = 'ok' if action is None else robot_step_wait(action, step['timeout'], abort)
+			results.append((step, start, result))
+		for step, start, result in results:
+			tries = 1
+			while result in ('failed', 'timeout') and tries <= step['retries']:
+				robot_step_trace(name, step, start, tries, result)
+				clock.sleep(stepbackoff * 2 ** (tries - 1))
+				if abort is not None and abort():
+					result = 'aborted'
+					break
+				tries += 1
+				start = clock.time()
+				try:
+					action = robot_step_start(step, False)
+					result = 'ok' if action is None else robot_step_wait(action, step['timeout'], abort)
+				except Exception:
+					result = 'failed'
+			robot_step_trace(name, step, start, tries, result)
+			if result == 'aborted':
+				return 'aborted'
+			if result != 'ok' and step['required']:
+				return 'failed'
+	return 'done'
+
+#
+# BACKPACK BATTERY INDICATOR
+# the voltage bands per state are compiled into a bisect table once, and only rebuilt when the
+# calibrated voltages change; the light patterns are built once at startup
+#
+def robot_batterylight_pattern(int_color, shape):
+	color1=cozmo.lights.Color(int_color=int_color, rgb=None, name=None)
+	color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
+	on=cozmo.lights.Light(on_color=color1)
+	off=cozmo.lights.Light(on_color=color2)
+	blink=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=1000, off_period_ms=1000, transition_on_period_ms=1000, transition_off_period_ms=1000)
+	fastblink=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
+	# bottom light first, sent as (None, light3, light2, light1, None)
+	light1, light2, light3 = {
+		'full'      : (on, on, blink),        # bottom two lights on, third light blinking
+		'half'      : (on, blink, off),       # bottom one light on, second light blinking
+		'low'       : (blink, off, off),      # bottom one light blinking
+		'critical'  : (fastblink, off, off),  # bottom one light blinking fast
+	}[shape]
+	return (None, light3, light2, light1, None)
+
+# lightstate -> backpack lights, 16711935 is green, 65535 is blue, 4278190335 is red
+batterylight_patterns = {
+	1  : robot_batterylight_pattern(16711935, 'full'),
+	2  : robot_batterylight_pattern(16711935, 'half'),
+	3  : robot_batterylight_pattern(16711935, 'low'),
+	4  : robot_batterylight_pattern(16711935, 'critical'),
+	5  : robot_batterylight_pattern(65535, 'full'),
+	6  : robot_batterylight_pattern(65535, 'half'),
+	7  : robot_batterylight_pattern(65535, 'low'),
+	9  : robot_batterylight_pattern(4278190335, 'full'),
+	10 : robot_batterylight_pattern(4278190335, 'half'),
+	11 : robot_batterylight_pattern(4278190335, 'low'),
+	12 : robot_batterylight_pattern(4278190335, 'critical'),
+}
+# lightstates that keep a band from being shown, so the lights don't flap back up on a voltage bounce
+batterylight_hold = {
+	1: {1,2}, 2: {2,3}, 3: {3}, 4: {4},
+	5: {5}, 6: {6,5}, 7: {7,6,5},
+	9: {9}, 10: {10,9}, 11: {11,10}, 12: {12},
+}
+batterylight_table = None
+batterylight_key = None
+
+def robot_batterylight_rules(high, low, maxv):
+	# (state, lightstate, low bound, low inclusive, high bound, high inclusive), first match wins
+	inf = float('inf')
+	batmultiplier = ((high - low)/3)+0.1
+	chargebatmultiplier = ((maxv - low)/3)+0.1
+	critbatmultiplier = ((low - 3.5)/3)
+	return (
+		(4, 1,  high-batmultiplier, False, inf, False),
+		(4, 2,  high-(batmultiplier*1.5), False, high-batmultiplier, True),
+		(4, 3,  high-(batmultiplier*2.5), False, high-(batmultiplier*1.5), True),
+		(4, 4,  low, True, inf, False),
+		(1, 7,  maxv-(chargebatmultiplier/2.5), True, maxv-(chargebatmultiplier/3.5), True),
+		(1, 6,  maxv-(chargebatmultiplier/1.0), True, maxv-chargebatmultiplier/2.5, True),
+		(1, 5,  maxv, True, inf, False),
+		(5, 10, low+(critbatmultiplier*1.5), True, low+critbatmultiplier, True),
+		(5, 11, low+(critbatmultiplier*2.5), True, low+(critbatmultiplier*1.5), True),
+		(5, 9,  low+critbatmultiplier, True, inf, False),
+		(5, 12, low, True, inf, False),
+	)
+
+def robot_batterylight_match(rules, v):
+	for state, band, lo, loinc, hi, hiinc in rules:
+		if (v > lo or (loinc and v == lo)) and (v < hi or (hiinc and v == hi)):
+			return band
+	return None
+
+def robot_batterylight_compile(high, low, maxv):
+	# state -> (sorted breakpoints, band exactly at each breakpoint, band for each gap between breakpoints)
+	table = {}
+	rules = robot_batterylight_rules(high, low, maxv)
+	for state in set(r[0] for r in rules):
+		staterules = [r for r in rules if r[0] == state]
+		points = sorted(set(p for r in staterules for p in (r[2], r[4]) if not math.isinf(p)))
+		atpoint = [robot_batterylight_match(staterules, p) for p in points]
+		edges = [-float('inf')] + points + [float('inf')]
+		between = []
+		for lo, hi in zip(edges, edges[1:]):
+			if math.isinf(lo) and math.isinf(hi):
+				sample = 0.0
+			elif math.isinf(lo):
+				sample = hi - 1
+			elif math.isinf(hi):
+				sample = lo + 1
+			else:
+				sample = (lo + hi) / 2
+			between.append(robot_batterylight_match(staterules, sample))
+		table[state] = (points, atpoint, between)
+	return table
+
+def robot_batterylight_band(table, state, v):
+	entry = table.get(state)
+	if entry is None:
+		return None
+	points, atpoint, between = entry
+	i = bisect.bisect_left(points, v)
+	if i < len(points) and points[i] == v:
+		return atpoint[i]
+	return between[i]
+
+def robot_backbackbatteryindicator():
+	global robot,highbatvoltage,lowbatvoltage,maxbatvoltage,lightstate,batlightcounter,batterylight_table,batterylight_key
+	key = (highbatvoltage, lowbatvoltage, maxbatvoltage)
+	if key != batterylight_key:
+		# voltages recalibrated, recompile the bands
+		batterylight_table = robot_batterylight_compile(highbatvoltage, lowbatvoltage, maxbatvoltage)
+		batterylight_key = key
+	band = robot_batterylight_band(batterylight_table, statecontext.state, robot.battery_voltage)
+	if band is not None:
 		batlightcounter +=1
-		if batlightcounter > 5 and lightstate !=12:
-			lightstate = 12
-			color1=cozmo.lights.Color(int_color=4278190335, rgb=None, name=None)
-			color2=cozmo.lights.Color(int_color=0, rgb=None, name=None)
-			light1=cozmo.lights.Light(on_color=color1, off_color=color2, on_period_ms=500, off_period_ms=500, transition_on_period_ms=500, transition_off_period_ms=500)
-			light2=cozmo.lights.Light(on_color=color2)
-			light3=cozmo.lights.Light(on_color=color2)
-			robot.set_backpack_lights(None, light3, light2, light1, None)
+		if batlightcounter > 5 and lightstate not in batterylight_hold[band]:
+			lightstate = band
+			robot_cmd_set_backpack_lights(*batterylight_patterns[band])
 			batlightcounter = 0
-		pass
 	if lightstate==0 or lightstate==99:
 		lightstate=99
 		if robot.is_on_charger:
@@ -623,6 +1339,177 @@ def robot_backbackbatteryindicator():
 				robot_set_backpacklights(4278190335)  # 4278190335 is red
 		
 	
+#
+# CALIBRATION STORE
+# calibrated voltages plus a short charge/discharge history per robot serial, so a restarted
+# program doesn't have to sit through a full charge cycle before lights and needs levels are right
+#
+def robot_calibration_load(_robot):
+	global maxbatvoltage, highbatvoltage, msg, chargerrelative
+	if not calibrationfile:
+		return
+	# cozmo_supervisor.py hands every robot the same dict and lock. The file is read under the lock, so it can't
+	# be half way through another robot's write, and an entry already in memory is newer than the file's copy:
+	# only serials the dict hasn't got yet are taken from the file (kept so the next write doesn't drop them)
+	with calibrationlock:
+		try:
+			with open(calibrationfile) as f:
+				loaded = json.load(f)
+		except FileNotFoundError:
+			loaded = {}
+		except (OSError, ValueError) as e:
+			msg = 'calibration file unreadable, starting fresh: %s' % str(e)
+			loaded = {}
+		for serial, stored in loaded.items():
+			calibration.setdefault(serial, stored)
+		entry = calibration.get(_robot.serial)
+	if entry:
+		maxbatvoltage = entry.get('maxbatvoltage', maxbatvoltage)
+		highbatvoltage = entry.get('highbatvoltage', highbatvoltage)
+		if entry.get('charger_relative'):
+			chargerrelative = tuple(entry['charger_relative'])
+		animcatalogdata.update(entry.get('animations', {}))
+		msg = 'loaded battery calibration for %s' % _robot.serial
+
+def robot_calibration_event(event, voltage):
+	# called whenever a calibrated voltage changes or the robot starts/stops charging
+	if not calibrationfile:
+		return
+	with calibrationlock:
+		entry = calibration.setdefault(robot.serial, {'history': []})
+		entry['maxbatvoltage'] = maxbatvoltage
+		entry['highbatvoltage'] = highbatvoltage
+		entry['updated'] = round(clock.time())
+		entry['history'].append({'time': round(clock.time()), 'event': event, 'voltage': round(voltage, 4)})
+		del entry['history'][:-calibrationhistory]
+		robot_calibration_write()
+
+def robot_calibration_set(key, value):
+	if not calibrationfile:
+		return
+	with calibrationlock:
+		entry = calibration.setdefault(robot.serial, {'history': []})
+		entry[key] = value
+		robot_calibration_write()
+
+def robot_calibration_write():
+	# write a temp file next to the real one and swap it in, so a crash mid-write never leaves half a file
+	tmp = calibrationfile + '.tmp'
+	try:
+		with open(tmp, 'w') as f:
+			json.dump(calibration, f, indent=1, sort_keys=True)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, calibrationfile)
+	except OSError as e:
+		robot_print_current_state('failed to write calibration: %s' % str(e), 2)
+
+#
+# CHARGER MEMORY
+# where the charger sits relative to the chargermarker1 wall marker. Unlike the charger's own pose this
+# survives delocalization (and restarts, through the calibration file), so spotting the marker again is
+# enough to put the charger back on the map
+#
+def robot_charger_pose():
+	# best known charger pose that is usable from where we are now, or None
+	global robot,chargerpose,chargerlastseen
+	pose = None
+	if robot.world.charger and robot.world.charger.pose.is_comparable(robot.pose):
+		pose = robot.world.charger.pose
+	elif chargerpose and chargerpose.is_comparable(robot.pose):
+		pose = chargerpose
+	if pose:
+		# the search planner leans toward this spot if we lose the charger again
+		chargerlastseen = (pose.origin_id, pose.position.x, pose.position.y)
+	return pose
+
+def robot_charger_learn(marker):
+	# charger and marker known in the same origin - remember the charger pose in the marker's frame
+	global robot,chargerrelative
+	charger = robot.world.charger
+	if not marker or not charger or not charger.pose.is_comparable(marker.pose):
+		return
+	m = marker.pose
+	c = charger.pose
+	a = m.rotation.angle_z.radians
+	dx = c.position.x - m.position.x
+	dy = c.position.y - m.position.y
+	relative = (round(math.cos(a) * dx + math.sin(a) * dy, 1), round(-math.sin(a) * dx + math.cos(a) * dy, 1), round(c.position.z - m.position.z, 1), round((c.rotation.angle_z - m.rotation.angle_z).degrees, 1))
+	# only write the file when the charger actually moved
+	if chargerrelative is None or abs(relative[0] - chargerrelative[0]) > 20 or abs(relative[1] - chargerrelative[1]) > 20 or abs(relative[3] - chargerrelative[3]) > 10:
+		robot_calibration_set('charger_relative', relative)
+	chargerrelative = relative
+
+def robot_charger_anchor(marker):
+	# marker in view - put the remembered charger back on the map in the current origin
+	global chargerpose
+	if chargerrelative is None:
+		return False
+	x, y, z, angle = chargerrelative
+	chargerpose = marker.pose.define_pose_relative_this(Pose(x, y, z, angle_z=degrees(angle)))
+	return True
+
+def robot_is_charger_marker(obj):
+	return isinstance(obj, CustomObject) and obj.object_type == CustomObjectTypes.CustomType01
+
+#
+# BATTERY ESTIMATOR
+# raw battery_voltage sags whenever the motors work, so the state machine looks at a smoothed voltage and
+# the discharge rate instead, and heads for the charger when the predicted time to lowbatvoltage runs short
+#
+def robot_battery_reset():
+	batteryestimate.update(voltage=None, rate=0.0, time=None, charger=None)
+
+def robot_battery_update(now, voltage, oncharger):
+	e = batteryestimate
+	if e['voltage'] is None or oncharger != e['charger']:
+		# first sample, or the charger contacts changed and the voltage jumped - start over
+		e.update(voltage=voltage, rate=0.0, time=now, charger=oncharger)
+		return
+	dt = now - e['time']
+	if dt <= 0:
+		return
+	old = e['voltage']
+	# exponential moving averages with a time constant, status updates don't arrive at a fixed rate
+	e['voltage'] = old + (voltage - old) * (1 - math.exp(-dt / batteryfiltertau))
+	e['rate'] += ((e['voltage'] - old) / dt - e['rate']) * (1 - math.exp(-dt / batteryratetau))
+	e['time'] = now
+
+def robot_battery_time_to_low():
+	# seconds until the smoothed voltage reaches lowbatvoltage, None before the first sample
+	e = batteryestimate
+	if e['voltage'] is None:
+		return None
+	if e['voltage'] <= lowbatvoltage:
+		return 0.0
+	if e['rate'] >= 0:
+		return float('inf')
+	return (e['voltage'] - lowbatvoltage) / -e['rate']
+
+def robot_battery_low():
+	timetolow = robot_battery_time_to_low()
+	return timetolow is not None and timetolow <= batterydocklead
+
+def robot_battery_report():
+	e = batteryestimate
+	if e['voltage'] is None:
+		return 'no estimate'
+	timetolow = robot_battery_time_to_low()
+	return 'filtered %.3fV, %.2fmV/min, %s to low' % (e['voltage'], e['rate'] * 60000, 'never' if math.isinf(timetolow) else '%ds' % timetolow)
+
+def robot_battery_record(now, voltage, oncharger):
+	# optional csv trace for battery_replay.py
+	global batterytrace, batterytracetime
+	if not batterytracefile or now - batterytracetime < batterytraceinterval:
+		return
+	if batterytrace is None:
+		newfile = not os.path.exists(batterytracefile)
+		batterytrace = open(batterytracefile, 'a')
+		if newfile:
+			batterytrace.write('time,voltage,on_charger,state\n')
+	batterytracetime = now
+	batterytrace.write('%.3f,%.4f,%d,%s\n' % (now, voltage, oncharger, statecontext.state))
+
 def robot_set_needslevel():
 	global robot, needslevel, msg
 	needslevel = 1 - (4.05 - robot.battery_voltage)
@@ -633,111 +1520,483 @@ def robot_set_needslevel():
 	# i = random.randint(1, 1000)
 	# if i >= 990:
 	#robot_print_current_state('updating needs levels')
-	robot.set_needs_levels(repair_value=needslevel, energy_value=needslevel, play_value=needslevel)
+	robot_cmd_set_needs_levels(needslevel)
+
+def robot_wait_for_state_change(timeout):
+	# block the control loop until the SDK reports a status change (see monitor_EvtRobotStateUpdated) or the timeout runs out
+	global statechange, statechange_time, statewaiting
+	if not statechange.is_set():
+		# the last pass already saw any earlier change, don't count it against a later transition
+		statechange_time = None
+	statewaiting = True
+	try:
+		changed = clock.wait(statechange, timeout)
+	finally:
+		statewaiting = False
+	statechange.clear()
+	return changed
+
+def robot_state_wake(old, new, reason):
+	# statecontext subscriber: a transition the control loop didn't make itself (from another thread, or from a
+	# handler running while it waits on the virtual clock) ends its wait, so it acts on the new state right away
+	global statechange_time
+	if statewaiting or threading.current_thread() is not controlthread:
+		if statechange_time is None:
+			statechange_time = clock.time()
+		statechange.set()
+
+def robot_state_profile(old, new, reason):
+	# statecontext subscriber: the control loop's own transitions get their profile straight away, the ones made
+	# by other threads at the top of its next pass (robot_state_wake() sees that it doesn't wait long for it)
+	if threading.current_thread() is controlthread:
+		robot_apply_profile()
+
+def robot_apply_profile():
+	# only the control loop switches resources, so a profile goes on whole and never mixed with another state's.
+	# Connecting the cubes can take a while, if the state has moved on meanwhile the next profile follows
+	global resourcestate
+	while resourcestate != statecontext.state:
+		state = statecontext.state
+		resourcestate = state
+		changed = ['%s %s' % (name, value) for name, value in resourceprofiles.get(state, {}).items() if robot_resource(name, value)]
+		if changed:
+			robot_print_current_state('%s profile - %s' % (statecontext.name(state), ', '.join(changed)), 0)
+
+def robot_resource(name, value):
+	# switches one resource, if it isn't that way already; True if it changed
+	if name == 'cubes' and use_cubes != 1:
+		value = False
+	if resources.get(name) == value:
+		return False
+	if name == 'camera':
+		robot.camera.image_stream_enabled = value
+	elif name == 'expressions':
+		robot.enable_facial_expression_estimation(enable=value)
+	elif name == 'cubes':
+		if value:
+			robot.world.connect_to_cubes()
+		else:
+			robot.world.disconnect_from_cubes()
+	elif name == 'reactions':
+		robot.enable_all_reaction_triggers(value)
+	elif name == 'volume':
+		robot.set_robot_volume(value)
+	# poll is only read by the state loop
+	resources[name] = value
+	return True
+
+def robot_resource_start():
+	# everything on, as it was before there were profiles - the first pass of the state loop takes it from there
+	global resourcestate
+	resources.clear()
+	resourcestate = None
+	for name, value in (('camera', True), ('expressions', True), ('cubes', True), ('reactions', True), ('poll', 0.5), ('volume', robotvolume)):
+		robot_resource(name, value)
+
+def robot_record_transition_latency(state):
+	# time from the status change that woke us to actually entering the new state
+	global statechange_time, transitionlatency
+	if statechange_time is None:
+		return
+	latency = (clock.time() - statechange_time) * 1000
+	statechange_time = None
+	transitionlatency['count'] += 1
+	transitionlatency['total'] += latency
+	transitionlatency['last'] = latency
+	transitionlatency['state'] = state
+	if latency > transitionlatency['max']:
+		transitionlatency['max'] = latency
+
+def robot_dock_event(event):
+	# docking numbers for the status screen and cozmo_benchmarks.py. A search starts when the battery runs low
+	# ('low'), the charger is found when docking starts ('found'), every back-in is an 'attempt', falling back to
+	# temporary freeplay is a 'fallback' and the search ends once we're on the charger ('docked')
+	global docksearch, dockstats
+	now = clock.time()
+	if event == 'low':
+		if docksearch is None:
+			docksearch = {'start': now, 'found': None, 'attempts': 0, 'fallback': False}
+			dockstats['searches'] += 1
+		return
+	if docksearch is None:
+		return
+	if event == 'found':
+		if docksearch['found'] is None:
+			docksearch['found'] = now
+			dockstats['found'] += 1
+			dockstats['find_time'] += now - docksearch['start']
+	elif event == 'attempt':
+		docksearch['attempts'] += 1
+		dockstats['attempts'] += 1
+	elif event == 'fallback':
+		if not docksearch['fallback']:
+			docksearch['fallback'] = True
+			dockstats['fallbacks'] += 1
+	elif event == 'docked':
+		dockstats['docked'] += 1
+		dockstats['dock_time'] += now - docksearch['start']
+		if docksearch['attempts'] == 1:
+			dockstats['first_attempt'] += 1
+		docksearch = None
+
+def robot_dock_report():
+	if dockstats['docked'] == 0:
+		return '%d searches, none docked yet' % dockstats['searches']
+	return '%d/%d docked, find %.0f s, dock %.0f s, first try %d, fallbacks %d' % (dockstats['docked'], dockstats['searches'], dockstats['find_time'] / max(dockstats['found'], 1), dockstats['dock_time'] / dockstats['docked'], dockstats['first_attempt'], dockstats['fallbacks'])
 
 def robot_check_sleep_snoring():
 	global robot
+	# the chance is per pass, so it goes up with the time a pass waits (4 in 1000 at half a second)
 	i = random.randint(1, 1000)
-	if i >= 997 and cozmostate == 1 and not robot.is_animating:
+	if i > 1000 - 8 * resources['poll'] and statecontext.state == 1 and not robot.is_animating:
 		robot_print_current_state('check complete - snore')
 		#robot.play_anim_trigger(Sleeping).wait_for_completed()
 		robot_reaction_chance(cozmo.anim.Triggers.Sleeping,100,True,False,True)
 	else:
 		#robot_print_current_state('check complete - no snore')
-		time.sleep(0.5)
+		robot_wait_for_state_change(resources['poll'])
+
+#
+# SCHEDULE
+# play windows as (start, end) minutes since midnight, per day of the week, for holidays, and for single dates
+# that don't follow the usual week. A window can't run past midnight - split a late night into two windows
+#
+scheduledays = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+def robot_schedule_minutes(text):
+	# 'hh:mm' -> minutes since midnight, '24:00' is allowed as an end time
+	hours, minutes = text.split(':')
+	value = int(hours) * 60 + int(minutes)
+	if not 0 <= value <= 1440:
+		raise ValueError('time out of range: %s' % text)
+	return value
+
+def robot_schedule_windows(windows):
+	parsed = sorted((robot_schedule_minutes(start), robot_schedule_minutes(end)) for start, end in windows)
+	for start, end in parsed:
+		if start >= end:
+			raise ValueError('play window ends before it starts: %02d:%02d' % divmod(start, 60))
+	return parsed
+
+def robot_schedule_date(text):
+	return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+def robot_schedule_default():
+	weekday = [(weekdaystartplay * 60, weekdaystopplay * 60)]
+	weekend = [(weekendstartplay * 60, weekendstopplay * 60)]
+	return {'days': [weekday] * 5 + [weekend] * 2, 'holiday': weekend, 'holidays': set(), 'dates': {}}
+
+def robot_schedule_load():
+	global schedule, msg
+	schedule = robot_schedule_default()
+	if not schedulefile:
+		return
+	try:
+		with open(schedulefile) as f:
+			rules = json.load(f)
+		days = rules.get('days', {})
+		loaded = {
+			'days': [robot_schedule_windows(days[day]) if day in days else schedule['days'][i] for i, day in enumerate(scheduledays)],
+			'holiday': robot_schedule_windows(rules['holiday']) if 'holiday' in rules else schedule['holiday'],
+			'holidays': set(robot_schedule_date(d) for d in rules.get('holidays', [])),
+			'dates': dict((robot_schedule_date(d), robot_schedule_windows(w)) for d, w in rules.get('dates', {}).items()),
+		}
+	except FileNotFoundError:
+		return
+	except (OSError, ValueError, TypeError, AttributeError) as e:
+		msg = 'schedule file unreadable, using the default play hours: %s' % str(e)
+		return
+	schedule = loaded
+	msg = 'loaded play schedule from %s' % schedulefile
+
+def robot_schedule_day(date):
+	# a listed date wins over a holiday, a holiday wins over the day of the week
+	rules = schedule or robot_schedule_default()
+	if date in rules['dates']:
+		return rules['dates'][date]
+	if date in rules['holidays']:
+		return rules['holiday']
+	return rules['days'][date.weekday()]
+
+def robot_schedule_window(now):
+	# (start, end) datetimes of the play window we're in, None outside play time
+	midnight = datetime.datetime.combine(now.date(), datetime.time())
+	for start, end in robot_schedule_day(now.date()):
+		start = midnight + datetime.timedelta(minutes=start)
+		end = midnight + datetime.timedelta(minutes=end)
+		if start <= now < end:
+			return start, end
+	return None
+
+def robot_schedule_next(now):
+	# when the next play window opens, None if nothing is scheduled in the coming year
+	for days in range(367):
+		date = now.date() + datetime.timedelta(days=days)
+		midnight = datetime.datetime.combine(date, datetime.time())
+		for start, end in robot_schedule_day(date):
+			start = midnight + datetime.timedelta(minutes=start)
+			if start > now:
+				return start
+	return None
+
+def robot_schedule_remaining():
+	# seconds of allowed play time left in this window, None when the scheduler is off or we're outside play time
+	if use_scheduler == 0:
+		return None
+	window = robot_schedule_window(clock.now())
+	if window is None:
+		return None
+	# timestamp() goes through the local timezone, so a daylight saving change in between is counted right
+	return window[1].timestamp() - clock.time()
+
+def robot_schedule_sleep():
+	# out of schedule: wait for the next play window in one go instead of polling. Only a status change wakes the
+	# loop early, and unless that took him off the charger or started it charging he goes straight back to sleep.
+	# True when the window has opened and he's still sitting on the charger, charged
+	now = clock.now()
+	nextplay = robot_schedule_next(now)
+	topup = None
+	if nextplay is None:
+		robot_print_current_state('battery charged - out of schedule, no play time coming up')
+	else:
+		robot_print_current_state('battery charged - out of schedule until %s' % nextplay.strftime('%a %d %b %H:%M'))
+		if scheduletopup > 0 and nextplay - datetime.timedelta(seconds=scheduletopup) > now:
+			topup = nextplay - datetime.timedelta(seconds=scheduletopup)
+	while robot.is_on_charger == 1 and robot.is_charging == 0:
+		wake = topup or nextplay
+		if wake is None:
+			robot_wait_for_state_change(86400)
+			continue
+		remaining = wake.timestamp() - clock.time()
+		if remaining > 0:
+			robot_wait_for_state_change(remaining)
+		elif topup is not None:
+			topup = None
+			robot_schedule_topup()
+			if robot.is_on_charger == 0:
+				# didn't make it back onto the contacts, go and find the charger properly
+				statecontext.set(5)
+				return False
+		else:
+			return True
+	if robot.is_on_charger == 0:
+		robot_print_current_state('cozmo was removed from charger')
+	return False
+
+def robot_schedule_topup():
+	# the charger stops when the battery reads full and the voltage creeps down over a night on the contacts,
+	# backing off and on again starts a fresh charge so he leaves for play time with a full battery
+	robot_print_current_state('play time coming up - topping up the charge')
+	robot_run_sequence('top up', [
+		robot_step('drive off charger', 'drive_off_charger_contacts', retries=2),
+		robot_step('pause', clock.sleep, 1),
+		robot_step('back onto charger', 'drive_straight', distance_mm(-80), speed_mmps(30)),
+	])
 
 def robot_check_scheduler():
 	global robot,scheduler_playokay,use_cubes,use_scheduler, highbatvoltage
-	# from 7pm on weekdays
-	weekdaystartplay = 19
-	# to 11pm on weekdays
-	weekdaystopplay  = 23
-	# from 7am on weekends
-	weekendstartplay = 7
-	# to 11pm on weekends
-	weekendstopplay  = 23
 	# scheduler - when battery is charged this represents the chance cozmo will get off his charger to play
 	# chance is defined as a number between 1-99 with a higher number representing a lesser chance
 	playchance = 1
 	robot_print_current_state('starting schedule check')
-	# day and time check - are we okay to play at this time and day?
-	day_of_week = datetime.date.today().weekday() # 0 is Monday, 6 is Sunday
-	ctime = datetime.datetime.now().time()
-	scheduler_playokay=0
-	#it's weekend! Check for allowed times.
-	if day_of_week > 4:
-		if (ctime > datetime.time(weekendstartplay) and ctime < datetime.time(weekendstopplay)):
-			scheduler_playokay=1
-	#it's a weekday! Check for allowed times.
-	else:
-		if (ctime > datetime.time(weekdaystartplay) and ctime < datetime.time(weekdaystopplay)):
-			scheduler_playokay=1
-	# are we using the scheduler?
-	if use_scheduler==0:
-		scheduler_playokay=1
+	# day and time check - are we okay to play at this time and day? if not, sleep until we are
+	scheduler_playokay = 1
+	if use_scheduler == 1 and robot_schedule_window(clock.now()) is None:
+		scheduler_playokay = 0
+		if not robot_schedule_sleep():
+			return
+		scheduler_playokay = 1
 	# if the schedule says OK roll dice to see if we wake up
-	if scheduler_playokay==1:
-		robot_print_current_state('schedule OK - random chance to wake up')
-		i = random.randint(1, 100)
-		# wake up chance
-		if use_scheduler==0:
-			i = 100
-		if i >= playchance:
-			robot_print_current_state('waking up - leaving charger')
-			#robot.world.connect_to_cubes()
-			#robot_set_backpacklights(16711935)  # 16711935 is green
-			try:
-				robot.play_anim("anim_gotosleep_getout_02").wait_for_completed()
-			except:
-				robot_print_current_state('wake up anim failed')
-				#pass
-			for _ in range(3):
-				try:
-					robot.drive_off_charger_contacts().wait_for_completed()
-					robot_print_current_state('drive off charger OK')
-				except: 
-					robot_print_current_state('drive off charger error')
-					#pass
-			time.sleep(0.5)
-			highbatvoltage = robot.battery_voltage
-			try:
-				robot.move_lift(-3)
-			except:
-				robot_print_current_state('lift reset fail')
-				#pass
-			try:
-				robot.drive_straight(distance_mm(60), speed_mmps(50)).wait_for_completed()
-			except:
-				robot_print_current_state('drive straight fail')
-				#pass
-			try:
-				robot.drive_straight(distance_mm(100), speed_mmps(50)).wait_for_completed()
-			except:
-				robot_print_current_state('drive straight fail')
-				#pass
-	# we're out of schedule or didn't make the dice roll, back off and check again later.
-	x = 1
-	while x < 20 and (robot.is_on_charger == 1):
-		if scheduler_playokay == 1:
-			robot_print_current_state('battery charged - schedule ok - not active')
-			time.sleep(1)
+	robot_print_current_state('schedule OK - random chance to wake up')
+	i = random.randint(1, 100)
+	# wake up chance
+	if use_scheduler==0:
+		i = 100
+	if i >= playchance:
+		robot_print_current_state('waking up - leaving charger')
+		#robot.world.connect_to_cubes()
+		#robot_set_backpacklights(16711935)  # 16711935 is green
+		robot_run_sequence('wake up', [
+			robot_step('play wake up anim', 'play_anim', 'anim_gotosleep_getout_02'),
+			robot_step('drive off charger', 'drive_off_charger_contacts', retries=2),
+			robot_step('pause', clock.sleep, 0.5),
+		])
+		highbatvoltage = robot.battery_voltage
+		robot_calibration_event('off_charger', highbatvoltage)
+		robot_run_sequence('leave charger', [
+			robot_step('drive straight', 'drive_straight', distance_mm(60), speed_mmps(50)),
+			robot_step('reset lift', 'set_lift_height', 0, parallel=True),
+			robot_step('drive straight', 'drive_straight', distance_mm(100), speed_mmps(50)),
+		])
+	else:
+		# didn't make the dice roll, back off and roll again later
+		robot_print_current_state('battery charged - schedule ok - not active')
+		robot_wait_for_state_change(30)
+
+#
+# RANDOM ANIMATION INDEX
+# the triggers robot_check_randomreaction() may pick, filtered and weighted once at startup, with an alias table
+# so a weighted pick costs two random numbers however many triggers there are
+#
+animindex = None
+animcatalogdata = {} # trigger name -> {'plays', 'duration', 'voltage'}
+animcatalogsaved = 0
+animmeter = None
+
+def robot_anim_category(name):
+	match = re.match('[A-Z][a-z]*', name)
+	return match.group(0) if match else name
+
+def robot_anim_eligible(name):
+	if any(word in name for word in animblacklist):
+		return False
+	return not animwhitelist or any(word in name for word in animwhitelist)
+
+def robot_anim_alias(weights):
+	# Vose's alias method: every slot keeps its own trigger with probability prob[i], otherwise it's alias[i]
+	n = len(weights)
+	total = sum(weights)
+	prob = [w * n / total for w in weights]
+	alias = list(range(n))
+	small = [i for i, p in enumerate(prob) if p < 1]
+	large = [i for i, p in enumerate(prob) if p >= 1]
+	while small and large:
+		s = small.pop()
+		l = large.pop()
+		alias[s] = l
+		prob[l] -= 1 - prob[s]
+		if prob[l] < 1:
+			small.append(l)
 		else:
-			#print("State:  charged,  not active by schedule, sleep loop %d of 30 before next check." % (x))
-			robot_print_current_state('battery charged - out of schedule')
-			time.sleep(1)
-			robot_check_sleep_snoring()
-		if (robot.is_on_charger == 0):
-			robot_print_current_state('cozmo was removed from charger')
-			break
-		time.sleep(2)
+			large.append(l)
+	# whatever is left over is 1 give or take rounding
+	for i in small + large:
+		prob[i] = 1.0
+	return prob, alias
+
+def robot_anim_index_build(triggers):
+	global animindex
+	categories = collections.defaultdict(list)
+	for trigger in triggers:
+		if robot_anim_eligible(trigger.name):
+			categories[robot_anim_category(trigger.name)].append(trigger)
+	eligible = []
+	weights = []
+	for category, members in sorted(categories.items()):
+		weight = animcategoryweights.get(category, animdefaultweight)
+		if weight <= 0:
+			continue
+		eligible.extend(members)
+		weights.extend([weight / len(members)] * len(members))
+	if not eligible:
+		animindex = None
+		return
+	prob, alias = robot_anim_alias(weights)
+	animindex = {'triggers': eligible, 'weights': weights, 'prob': prob, 'alias': alias}
+
+def robot_anim_pick():
+	if animindex is None:
+		return cozmo.anim.Triggers.SparkSuccess
+	i = random.randrange(len(animindex['triggers']))
+	if random.random() >= animindex['prob'][i]:
+		i = animindex['alias'][i]
+	return animindex['triggers'][i]
+
+def robot_play_trigger(trigger, **kwargs):
+	# play_anim_trigger().wait_for_completed(), measured for the animation catalog: the voltage change is the
+	# mean voltage while it played (sampled by monitor_EvtRobotStateUpdated) against the voltage at the start,
+	# i.e. how hard the animation loads the battery
+	global animmeter
+	start = clock.time()
+	voltage = robot.battery_voltage
+	meter = animmeter = {'total': 0.0, 'samples': 0}
+	try:
+		action = robot.play_anim_trigger(trigger, **kwargs)
+		action.wait_for_completed()
+	finally:
+		animmeter = None
+	if animcatalog and not action.has_failed and meter['samples'] > 0:
+		robot_anim_catalog_record(trigger.name, clock.time() - start, meter['total'] / meter['samples'] - voltage)
+	return action
+
+def robot_run_parallel(actions):
+	# start independent actions (each on its own track - head, lift, ...) together and wait for all of them,
+	# instead of one after the other. actions is a list of (description, function that starts the action with
+	# in_parallel=True); returns the descriptions of the ones that failed
+	running = []
+	failed = []
+	for name, start in actions:
+		try:
+			running.append((name, start()))
+		except:
+			failed.append(name)
+	for name, action in running:
+		try:
+			action.wait_for_completed()
+		except:
+			failed.append(name)
+			continue
+		if action.has_failed:
+			failed.append(name)
+	return failed
+
+def robot_reset_pose():
+	# head back to resetheadangle and lift down, e.g. after an animation - only what isn't there already
+	actions = []
+	if abs(robot.head_angle.degrees - resetheadangle) > resetheadtolerance:
+		actions.append(('head angle', lambda: robot.set_head_angle(degrees(resetheadangle), in_parallel=True)))
+	if robot.lift_height.distance_mm - cozmo.robot.MIN_LIFT_HEIGHT_MM > resetlifttolerance:
+		actions.append(('lift', lambda: robot.set_lift_height(0, in_parallel=True)))
+	if actions:
+		robot_print_current_state('resetting %s' % ' and '.join(name for name, start in actions))
+		for name in robot_run_parallel(actions):
+			robot_print_current_state('%s reset failed' % name)
+
+def robot_anim_catalog_record(name, duration, voltage):
+	global animcatalogsaved
+	with calibrationlock:
+		entry = animcatalogdata.setdefault(name, {'plays': 0, 'duration': 0.0, 'voltage': 0.0})
+		entry['plays'] += 1
+		# a plain mean for the first plays, then it slowly follows changes (battery ageing, firmware)
+		weight = 1.0 / min(entry['plays'], animcatalogwindow)
+		entry['duration'] = round(entry['duration'] + (duration - entry['duration']) * weight, 3)
+		entry['voltage'] = round(entry['voltage'] + (voltage - entry['voltage']) * weight, 4)
+	now = clock.time()
+	if now - animcatalogsaved >= animcatalogsaveinterval:
+		animcatalogsaved = now
+		robot_calibration_set('animations', animcatalogdata)
+
+def robot_anim_budget():
+	# (seconds, volts) an animation may use right now, None where there's no limit
+	seconds = None
+	timetolow = robot_battery_time_to_low()
+	if timetolow is not None and not math.isinf(timetolow) and not robot.is_on_charger:
+		seconds = max(timetolow - batterydocklead, 0.0) * animbudgetshare
+	remaining = robot_schedule_remaining()
+	if remaining is not None:
+		seconds = remaining * animbudgetshare if seconds is None else min(seconds, remaining * animbudgetshare)
+	volts = None
+	if batteryestimate['voltage'] is not None and not robot.is_on_charger:
+		volts = max(batteryestimate['voltage'] - lowbatvoltage, 0.0) * animbudgetshare
+	return seconds, volts
+
+def robot_anim_affordable(name):
+	# animations never measured are always allowed, that's how they get into the catalog
+	entry = animcatalogdata.get(name)
+	if not animcatalog or entry is None:
+		return True
+	seconds, volts = robot_anim_budget()
+	if seconds is not None and entry['duration'] > seconds:
+		return False
+	if volts is not None and -entry['voltage'] > volts:
+		return False
+	return True
 
 def robot_check_randomreaction():
-	global robot,cozmostate,freeplay
+	global robot,freeplay
 	i = random.randint(1, 1000)
 	#if i >= 980 and not robot.is_carrying_block and not robot.is_picking_or_placing and not robot.is_pathing and not robot.is_behavior_running and cozmostate==4:
-	if i >= 970 and not robot.is_carrying_block and not robot.is_picking_or_placing and not robot.is_pathing and cozmostate==4:
-		oldcozmostate=cozmostate
-		cozmostate=99
+	if i >= 970 and not robot.is_carrying_block and not robot.is_picking_or_placing and not robot.is_pathing and statecontext.compare_and_set(4, 99, 'random animation'):
 		#random action!
 		robot_print_current_state('random animation starting')
 		if robot.is_freeplay_mode_active:
@@ -747,45 +2006,20 @@ def robot_check_randomreaction():
 		#robot.clear_idle_animation()
 		#robot.wait_for_all_actions_completed()
 		#robot.wait_for_all_actions_completed()
-		# grab a list of animation triggers
-		all_animation_triggers = robot.anim_triggers
-		# randomly shuffle the animations
-		random.shuffle(all_animation_triggers)
-		# select the first animation from the shuffled list
-		triggers = 1
-		chosen_triggers = all_animation_triggers[:triggers]
-		print('Playing {} random animations:'.format(triggers))
-		for trigger in chosen_triggers:
-			if 'Onboarding' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'MeetCozmo' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'list' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'List' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Severe' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'TakaTaka' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Test' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Loop' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Sleep' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Request' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Singing' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'Drone' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			if 'SoundOnly' in trigger:
-				trigger = 'cozmo.anim.Triggers.SparkSuccess'
-			print("trigger %s" %str(trigger)," executed")
+		# weighted pick from the triggers that passed the black and white lists (see animindex),
+		# a few more tries if it's too long or costly for the battery and play time left
+		for _ in range(5):
+			trigger = robot_anim_pick()
+			if robot_anim_affordable(trigger.name):
+				break
+		else:
+			trigger = None
+			robot_print_current_state('no random animation within budget')
+		if trigger is not None:
+			robot_print_current_state("trigger %s executed" % trigger.name, 0)
 			robot_print_current_state('playing random animation')
 			try:
-				robot.play_anim_trigger(trigger).wait_for_completed()
+				robot_play_trigger(trigger)
 			except:
 				robot_print_current_state('random animation play failed')
 				#pass
@@ -794,19 +2028,19 @@ def robot_check_randomreaction():
 		if freeplay == 1 and not robot.is_freeplay_mode_active:
 			#robot.enable_all_reaction_triggers(True)
 			robot.start_freeplay_behaviors()
-		if cozmostate==6:
-			cozmostate=6
-		else:
-			cozmostate=oldcozmostate
-		time.sleep(0.5)
+		# unless a handler moved us on meanwhile (found the charger, picked up, ...)
+		statecontext.compare_and_set(99, 4)
+		clock.sleep(0.5)
 
 def robot_reaction_chance(animation,chance,ignorebody,ignorehead,ignorelift):
-	global robot, msg, freeplay,cozmostate
+	global robot, msg, freeplay
 	i = random.randint(1, 100)
-	if i >= chance and not robot.is_carrying_block and not robot.is_picking_or_placing and not robot.is_pathing and cozmostate !=99:
+	if i >= chance and not robot_anim_affordable(animation.name):
+		clock.sleep(0.5)
+		robot_print_current_state('animation check - %s over budget' % animation.name)
+	elif i >= chance and not robot.is_carrying_block and not robot.is_picking_or_placing and not robot.is_pathing and statecontext.state !=99:
 		robot_print_current_state('starting animation')
-		oldcozmostate=cozmostate
-		cozmostate=99
+		oldcozmostate = statecontext.set(99, 'animation %s' % animation.name)
 		oldfreeplay = 0
 		if freeplay == 1:
 			if robot.is_freeplay_mode_active:
@@ -822,7 +2056,7 @@ def robot_reaction_chance(animation,chance,ignorebody,ignorehead,ignorelift):
 		robot.wait_for_all_actions_completed()
 		try:
 			robot_print_current_state('playing animation')
-			robot.play_anim_trigger(animation, ignore_body_track=ignorebody, ignore_head_track=ignorehead, ignore_lift_track=ignorelift).wait_for_completed()
+			robot_play_trigger(animation, ignore_body_track=ignorebody, ignore_head_track=ignorehead, ignore_lift_track=ignorelift)
 			#print("reaction %s" %str(animation)," executed")
 			msg = ("reaction %s" %str(animation)," executed")
 			robot_print_current_state('animation completed')
@@ -831,21 +2065,7 @@ def robot_reaction_chance(animation,chance,ignorebody,ignorehead,ignorelift):
 			#print("reaction %s" %str(animation)," aborted")
 			
 		robot.wait_for_all_actions_completed()
-		try:
-			robot_print_current_state('resetting head angle')
-			robot.set_head_angle(degrees(0)).wait_for_completed()
-		except:
-			robot_print_current_state('head angle reset failed')
-			#print("reaction %s" %str(animation)," aborted")
-		#robot.wait_for_all_actions_completed()
-		robot.wait_for_all_actions_completed()
-		try:
-			robot_print_current_state('resetting lift')
-			robot.move_lift(-3)
-		except:
-			robot_print_current_state('lift move down failed')
-			#print("reaction %s" %str(animation)," aborted")
-		robot.wait_for_all_actions_completed()
+		robot_reset_pose()
 		if oldfreeplay == 1:
 			oldfreeplay = 0
 			freeplay = 1
@@ -853,18 +2073,13 @@ def robot_reaction_chance(animation,chance,ignorebody,ignorehead,ignorelift):
 			if not robot.is_freeplay_mode_active:
 				#robot.enable_all_reaction_triggers(True)
 				robot.start_freeplay_behaviors()
-		if cozmostate == 6:
-			cozmostate =6
-		elif cozmostate == 1:
-			cozmostate = 1
-		else:
-			cozmostate=oldcozmostate
+		statecontext.compare_and_set(99, oldcozmostate)
 	else:
-		time.sleep(0.5)
+		clock.sleep(0.5)
 		robot_print_current_state('animation check - no winner')
 
 def robot_locate_dock():
-	global robot,cozmostate,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger, tempfreeplay
+	global robot,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger, tempfreeplay, chargerpose
 	#back off from whatever we were doing
 	#robot_set_backpacklights(4278190335)  # 4278190335 is red
 	if robot.is_freeplay_mode_active:
@@ -875,104 +2090,212 @@ def robot_locate_dock():
 	robot_print_current_state('starting locate dock sequence')
 	robot.clear_idle_animation()
 	#robot.wait_for_all_actions_completed()
-	if use_cubes==1:
-		robot.world.disconnect_from_cubes()
 	freeplay = 0
 	robot_reaction_chance(cozmo.anim.Triggers.NeedsMildLowEnergyRequest,1,False,False,False)
-	try:
-		robot.drive_straight(distance_mm(-30), speed_mmps(50)).wait_for_completed()
-	except:
-		robot_print_current_state('drive straight failed')
+	robot_run_sequence('back off', [robot_step('drive straight', 'drive_straight', distance_mm(-30), speed_mmps(50))])
 	robot_set_needslevel()
 	robot_print_current_state('finding charger')
 	# charger location search
-	if robot.world.charger and cozmostate != 1 and cozmostate != 2 and cozmostate !=6:
-		if robot.world.charger.pose.is_comparable(robot.pose):
+	if (robot.world.charger or chargerpose) and statecontext.state != 1 and statecontext.state != 2 and statecontext.state !=6:
+		if robot_charger_pose():
 			charger = robot.world.charger
-			#we know where the charger is
+			#we know where the charger is (or where the marker says it is)
 			robot_print_current_state('finding charger, charger position known')
 			robot_reaction_chance(cozmo.anim.Triggers.CodeLabSurprise,1,True,False,False)
-			time.sleep(0.5)
-			cozmostate = 6
+			clock.sleep(0.5)
+			statecontext.set_unless((1, 2), 6, 'charger position known')
 			foundcharger = 1
 		else:
 			robot_print_current_state('finding charger, charger not in expected location')
 			charger = None
 			robot.world.charger = None
-			if cozmostate != 1 and cozmostate != 2:
-				cozmostate = 5
+			statecontext.set_unless((1, 2), 5, 'charger not where expected')
 	charger = robot.world.charger
-	if not charger and cozmostate != 1 and cozmostate != 2 and cozmostate !=6:
+	if not robot_charger_pose() and statecontext.state != 1 and statecontext.state != 2 and statecontext.state !=6:
 		robot_print_current_state('looking for charger')
-		cozmostate = 5
+		statecontext.set_unless((1, 2, 6), 5)
 		robot_reaction_chance(cozmo.anim.Triggers.SparkIdle,30,True,False,True)
-		try:
-			robot.move_lift(-3)
-		except:
-			robot_print_current_state('failed to move lift')
-		try:
-			robot.set_head_angle(degrees(0)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to set head angle')
-		try:
-			robot.drive_straight(distance_mm(-20), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive')
+		robot_reset_pose()
+		robot_run_sequence('back off', [robot_step('drive', 'drive_straight', distance_mm(-20), speed_mmps(50))])
 		# randomly drive around for a bit and see if we can spot the charger
 		robot_drive_random_pattern()
 		robot_print_current_state('looking for charger, random drive loop complete')
-	time.sleep(0.5)
+	clock.sleep(0.5)
 
 						
+#
+# CHARGER SEARCH PLANNER
+# keeps a coarse grid of the floor the camera has already swept in the current origin; the next search
+# pose is the one that brings the most not-yet-seen cells into view, pulled toward where the charger was
+# last seen and away from cells where we found a cliff
+#
+def search_reset(origin):
+	global searchorigin
+	searchorigin = origin
+	searchseen.clear()
+	searchblocked.clear()
+
+def search_cell(x, y):
+	return (int(math.floor(x / searchcellsize)), int(math.floor(y / searchcellsize)))
+
+def search_cells_in_view(x, y, heading, fov):
+	# cells within searchviewrange and inside the camera cone, fov 360 for a look around in place
+	cells = []
+	reach = int(searchviewrange // searchcellsize) + 1
+	cx, cy = search_cell(x, y)
+	for i in range(cx - reach, cx + reach + 1):
+		for j in range(cy - reach, cy + reach + 1):
+			dx = (i + 0.5) * searchcellsize - x
+			dy = (j + 0.5) * searchcellsize - y
+			d = math.hypot(dx, dy)
+			if d > searchviewrange:
+				continue
+			if fov < 360 and d > searchcellsize:
+				off = (math.degrees(math.atan2(dy, dx)) - heading + 180) % 360 - 180
+				if abs(off) > fov / 2:
+					continue
+			cells.append((i, j))
+	return cells
+
+def search_mark_seen(x, y, heading, fov):
+	searchseen.update(search_cells_in_view(x, y, heading, fov))
+
+def search_mark_cliff(x, y, heading):
+	# the floor ends just ahead of us, block a wedge out to the view range so we don't plan poses out there
+	c = math.cos(math.radians(heading))
+	s = math.sin(math.radians(heading))
+	d = searchcellsize / 2
+	while d <= searchviewrange:
+		for side in (-1, 0, 1):
+			w = side * searchcellsize * (0.5 + d / searchviewrange)
+			searchblocked.add(search_cell(x + d * c - w * s, y + d * s + w * c))
+		d += searchcellsize / 2
+
+def search_plan(x, y, heading):
+	# returns (x, y, heading) of the next pose to look from
+	best = None
+	bestscore = None
+	bias = None
+	if chargerlastseen and chargerlastseen[0] == searchorigin:
+		bias = chargerlastseen[1:]
+	for distance in searchstepdistances:
+		for k in range(12):
+			direction = k * 30
+			tx = x + distance * math.cos(math.radians(direction))
+			ty = y + distance * math.sin(math.radians(direction))
+			if search_cell(tx, ty) in searchblocked or search_cell((x + tx) / 2, (y + ty) / 2) in searchblocked:
+				continue
+			for facing in (-60, 0, 60):
+				th = direction + facing
+				gain = 0
+				for cell in search_cells_in_view(tx, ty, th, searchfov):
+					if cell not in searchseen and cell not in searchblocked:
+						gain += 1
+				turn = abs((direction - heading + 180) % 360 - 180) + abs(facing)
+				score = gain - searchtravelcost * distance - searchturncost * turn
+				if bias:
+					score += searchchargerbias * max(0.0, 1 - math.hypot(tx - bias[0], ty - bias[1]) / searchviewrange)
+				if gain > 0 and (bestscore is None or score > bestscore):
+					best = (tx, ty, th)
+					bestscore = score
+	if best:
+		return best
+	# everything in reach has been seen, head for the closest unseen cell
+	cx, cy = search_cell(x, y)
+	for ring in range(1, 30):
+		for i in range(cx - ring, cx + ring + 1):
+			for j in (cy - ring, cy + ring) if abs(i - cx) != ring else range(cy - ring, cy + ring + 1):
+				if (i, j) not in searchseen and (i, j) not in searchblocked:
+					direction = math.degrees(math.atan2((j + 0.5) * searchcellsize - y, (i + 0.5) * searchcellsize - x))
+					distance = searchstepdistances[-1]
+					return (x + distance * math.cos(math.radians(direction)), y + distance * math.sin(math.radians(direction)), direction)
+	return (x, y, heading + 180)
+
+def robot_search_sync():
+	# start a fresh grid whenever Cozmo delocalized, the old cells mean nothing in the new origin
+	global robot
+	if robot.pose.origin_id != searchorigin:
+		search_reset(robot.pose.origin_id)
+
+def robot_search_mark_view(fov):
+	global robot
+	robot_search_sync()
+	p = robot.pose
+	search_mark_seen(p.position.x, p.position.y, p.rotation.angle_z.degrees, fov)
+
+def robot_search_next_pose():
+	# next search pose, relative to the robot as go_to_pose(relative_to_robot=True) wants it
+	global robot
+	robot_search_mark_view(searchfov)
+	p = robot.pose
+	x, y, h = p.position.x, p.position.y, p.rotation.angle_z.degrees
+	tx, ty, th = search_plan(x, y, h)
+	c = math.cos(math.radians(h))
+	s = math.sin(math.radians(h))
+	return Pose(c * (tx - x) + s * (ty - y), -s * (tx - x) + c * (ty - y), 0, angle_z=degrees((th - h + 180) % 360 - 180))
+
+def status_search_cliff(value):
+	if value and statecontext.state in (5, 98):
+		robot_search_sync()
+		p = robot.pose
+		search_mark_cliff(p.position.x, p.position.y, p.rotation.angle_z.degrees)
+
 def robot_drive_random_pattern():
-	global cozmostate,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger, chargermarker1
+	global freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger, chargermarker1
+	# a handler may already have moved us out of state 5, then the loop below never runs
 	loops=5
-	while loops>0 and cozmostate == 5:
-		if robot.world.charger and robot.world.charger.pose.is_comparable(robot.pose):
+	while loops>0 and statecontext.state == 5:
+		if robot_charger_pose():
 			loops=0
 			charger = robot.world.charger
 			robot_reaction_chance(cozmo.anim.Triggers.CodeLabSurprise,1,True,False,True)
 			robot_print_current_state('found charger, breaking loop')
-			cozmostate = 6
+			statecontext.set_unless((1, 2), 6, 'charger position known')
 			foundcharger = 1
 			break
-		if cozmostate == 6 or cozmostate ==1 or cozmostate == 2:
+		if statecontext.state == 6 or statecontext.state ==1 or statecontext.state == 2:
 			robot_print_current_state('breaking out of drive loop')
 			loops=0
 			break
 		# drive to a random point and orientation
 		counter=0
-		while counter < 1 and cozmostate ==5 and cozmostate !=6:
-			if cozmostate == 6 or cozmostate ==1 or cozmostate == 2:
+		while counter < 1 and statecontext.state ==5 and statecontext.state !=6:
+			if statecontext.state == 6 or statecontext.state ==1 or statecontext.state == 2:
 				robot_print_current_state('breaking out of drive loop')
 				loops=0
 				break
-			if random.choice((True, False)):
-				x=150
+			if search_planner == 1:
+				searchpose = robot_search_next_pose()
+				robot_print_current_state('looking for charger, going to least explored pose')
 			else:
-				x=-150
-			if random.choice((True, False)):
-				y=150
-			else:
-				y=-150
-			z= random.randrange(-40, 41, 80)
-			robot_print_current_state('looking for charger, going to random pose')
+				if random.choice((True, False)):
+					x=150
+				else:
+					x=-150
+				if random.choice((True, False)):
+					y=150
+				else:
+					y=-150
+				z= random.randrange(-40, 41, 80)
+				searchpose = Pose(x, y, 0, angle_z=degrees(z))
+				robot_print_current_state('looking for charger, going to random pose')
 			try:
-				robot.go_to_pose(Pose(x, y, 0, angle_z=degrees(z)), relative_to_robot=True).wait_for_completed()
-				robot.set_head_light(False)
-				time.sleep(0.25)
-				robot.set_head_light(True)
-				time.sleep(0.25)
-				robot.set_head_light(False)
+				robot.go_to_pose(searchpose, relative_to_robot=True).wait_for_completed()
+				robot_search_mark_view(searchfov)
+				robot_cmd_set_head_light(False)
+				clock.sleep(0.25)
+				robot_cmd_set_head_light(True)
+				clock.sleep(0.25)
+				robot_cmd_set_head_light(False)
 			except:
 				robot_print_current_state('failed to go to pose')
-			if cozmostate == 6 or cozmostate ==1 or cozmostate == 2:
+			if statecontext.state == 6 or statecontext.state ==1 or statecontext.state == 2:
 				loops=0
 				break
-			if robot.world.charger and robot.world.charger.pose.is_comparable(robot.pose):
+			if robot_charger_pose():
 				loops=0
 				charger = robot.world.charger
-				cozmostate = 6
+				statecontext.set_unless((1, 2), 6, 'charger position known')
 				foundcharger = 1
 				robot_print_current_state('found charger, breaking')
 				robot_reaction_chance(cozmo.anim.Triggers.CodeLabSurprise,1,True,False,True)
@@ -980,16 +2303,15 @@ def robot_drive_random_pattern():
 			# else:
 			robot_check_randomreaction()
 			counter+=1
-		if cozmostate == 6 or cozmostate ==1 or cozmostate == 2:
+		if statecontext.state == 6 or statecontext.state ==1 or statecontext.state == 2:
 			loops=0
 			break
 		robot_reaction_chance(cozmo.anim.Triggers.CodeLabChatty,1,True,False,True)
 		# turn around for a bit
-		time.sleep(0.5)
+		clock.sleep(0.5)
 		counter=0
 		
-		oldcozmostate = cozmostate
-		cozmostate = 98
+		oldcozmostate = statecontext.set(98)
 		robot_print_current_state('start lookaround behavior')
 		robot.set_head_angle(degrees(20)).wait_for_completed()
 		# if chargermarker1.pose.is_comparable(robot.pose):
@@ -1005,10 +2327,15 @@ def robot_drive_random_pattern():
 		finally:
 			robot_print_current_state('stop lookaround')
 			look_around.stop()
+			robot_search_mark_view(360)
 		if len(custom_objects) > 0:
 			robot_print_current_state('custom object in array')
 			found_object = custom_objects[0]
-			if str(found_object.object_type) == "CustomObjectTypes.CustomType01":
+			if robot_is_charger_marker(found_object) and robot_charger_anchor(found_object):
+				robot_print_current_state('charger marker found, charger position known')
+				foundcharger = 1
+				statecontext.compare_and_set(98, 6, 'charger marker found')
+			elif str(found_object.object_type) == "CustomObjectTypes.CustomType01":
 				robot_print_current_state('custom object found, traveling')
 				action = robot.go_to_pose(pose=found_object.pose)
 				action.wait_for_completed()
@@ -1034,7 +2361,7 @@ def robot_drive_random_pattern():
 			# #robot_print_current_state('lookaround behavior ending')
 			# look_around.stop()
 		#cozmostate = oldcozmostate
-		if cozmostate == 6 or cozmostate ==1 or cozmostate == 2:
+		if statecontext.state == 6 or statecontext.state ==1 or statecontext.state == 2:
 			break
 		robot_reaction_chance(cozmo.anim.Triggers.CodeLabChatty,1,True,False,True)
 		robot_print_current_state('ended lookaround behavior')
@@ -1048,18 +2375,18 @@ def robot_drive_random_pattern():
 			# ry=-rx
 			# robot_print_current_state('looking for charger, rotating')
 			# try:
-				# robot.set_head_light(False)
+				# robot_cmd_set_head_light(False)
 				# time.sleep(0.2)
-				# robot.set_head_light(True)
+				# robot_cmd_set_head_light(True)
 				# time.sleep(0.2)
-				# robot.set_head_light(False)
+				# robot_cmd_set_head_light(False)
 				# robot.drive_wheels(rx, ry, l_wheel_acc=a, r_wheel_acc=a, duration=t)
 				# time.sleep(0.5)
 			# except:
 				# pass
 		# if cozmostate == 6:
 			# break
-		if robot.world.charger and robot.world.charger.pose.is_comparable(robot.pose):
+		if robot_charger_pose():
 			loops=0
 			charger = robot.world.charger
 			robot_print_current_state('found charger')
@@ -1070,7 +2397,7 @@ def robot_drive_random_pattern():
 		robot_check_randomreaction()
 			# counter+=1
 		
-		# if robot.world.charger and robot.world.charger.pose.is_comparable(robot.pose):
+		# if robot_charger_pose():
 			# loops=0
 			# charger = robot.world.charger
 			# cozmostate = 6
@@ -1081,198 +2408,208 @@ def robot_drive_random_pattern():
 		#robot_set_needslevel()
 		robot_print_current_state('looking for charger, looping through random poses')
 		loops=loops-1
-		if cozmostate == 6:
-			cozmostate = 6
-		else:
-			cozmostate = oldcozmostate
-	if cozmostate == 6:
-		cozmostate = 6
-	elif cozmostate == 1:
-		cozmostate = 1
-	elif cozmostate == 2:
-		cozmostate = 2
-	else:
-		cozmostate = oldcozmostate
+		# back to looking, unless we found the charger or a handler moved us on meanwhile
+		statecontext.compare_and_set(98, oldcozmostate)
 	robot_print_current_state('looking for charger, broke out of drive loop')
 	#return charger
 
+def robot_docking_aborted():
+	# the docking maneuvers stop as soon as we're in any state but 6 - on the charger, picked up, falling
+	return statecontext.state != 6
+
+def robot_dock_offset(pose, dock):
+	# robot pose in the frame of the docked pose: mm in front of the contacts, mm to the left, degrees of heading
+	x, y, h = dock
+	c = math.cos(math.radians(h))
+	s = math.sin(math.radians(h))
+	dx = pose.position.x - x
+	dy = pose.position.y - y
+	return c * dx + s * dy, -s * dx + c * dy, (pose.rotation.angle_z.degrees - h + 180) % 360 - 180
+
+def robot_dock_closed_loop(charger):
+	# the final dock from in front of the charger, steering by robot.pose: the docked pose is worked out from the
+	# charger pose (the freshest one there is, taken while he still faces it), the turn around is corrected until the heading is within
+	# dockheadingtolerance, and backing in steers onto the line through the contacts and stops the moment
+	# is_on_charger comes up. Returns 'docked', 'missed' or 'aborted'
+	global robot
+	if not charger.is_comparable(robot.pose):
+		return 'missed'
+	a = charger.rotation.angle_z.radians
+	dock = (charger.position.x + math.cos(a) * dockdistance, charger.position.y + math.sin(a) * dockdistance, charger.rotation.angle_z.degrees + 180)
+	for _ in range(3):
+		error = -robot_dock_offset(robot.pose, dock)[2]
+		if abs(error) <= dockheadingtolerance:
+			break
+		if robot_run_sequence('turn around', [robot_step('turn', 'turn_in_place', degrees(error))], robot_docking_aborted) == 'aborted':
+			return 'aborted'
+	robot_reaction_chance(cozmo.anim.Triggers.CubePounceFake,1,True,False,False)
+	if robot_docking_aborted():
+		return 'aborted'
+	robot_dock_event('attempt')
+	start = clock.time()
+	result = 'missed'
+	try:
+		# a reverse to the contacts at dockspeed, with plenty to spare for the steering
+		while clock.time() - start < 3 * (dockdistance + dockovershoot) / dockspeed:
+			if robot.is_on_charger:
+				result = 'docked'
+				break
+			if robot_docking_aborted():
+				result = 'aborted'
+				break
+			pose = robot.pose
+			if not charger.is_comparable(pose):
+				break
+			dx, dy, dh = robot_dock_offset(pose, dock)
+			if dx < -dockovershoot:
+				break
+			# backing up with the heading turned toward the side he's off to brings him back onto the line;
+			# the turn rate chases that heading
+			want = max(-25.0, min(25.0, 0.8 * dy))
+			turnrate = max(-60.0, min(60.0, 3.0 * (want - dh)))
+			spread = math.radians(turnrate) * 24 # half the distance between the treads
+			robot.drive_wheels(-dockspeed - spread, -dockspeed + spread)
+			clock.sleep(dockinterval)
+	finally:
+		robot.stop_all_motors()
+	robot_print_current_state('backing onto the charger: %s after %.1f s' % (result, clock.time() - start), 0)
+	if result == 'missed' and robot.is_on_charger:
+		result = 'docked'
+	return result
+
 def robot_start_docking():
-	global robot,cozmostate,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger
+	global robot,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger, chargerpose
 	charger = robot.world.charger
 	#action = robot.go_to_object(charger, distance_mm(65.0))
 	#action.wait_for_completed()
 	robot_print_current_state('go to object complete')
-	if robot.world.charger and robot.world.charger.pose.is_comparable(robot.pose):
-		action = robot.go_to_pose(robot.world.charger.pose)
-		action.wait_for_completed()
-		robot_print_current_state('go to pose complete')
-		robot.drive_straight(distance_mm(-50), speed_mmps(50)).wait_for_completed()
-		robot_print_current_state('drove back a little bit')
+	if robot_charger_pose():
+		robot_dock_event('found')
+		robot_run_sequence('approach', [
+			robot_step('go to pose', 'go_to_pose', robot_charger_pose()),
+			robot_step('drive back a little bit', 'drive_straight', distance_mm(-50), speed_mmps(50)),
+		], robot_docking_aborted)
 	else: 
 		robot_print_current_state('charger pose not known')
 		robot.world.charger = None
+		chargerpose = None
 		charger = None
-		if cozmostate != 1 and cozmostate != 2:
-			cozmostate = 5
-		try:
-			robot.play_anim_trigger(cozmo.anim.Triggers.ReactToPokeReaction, ignore_body_track=True, ignore_head_track=True, ignore_lift_track=True).wait_for_completed()
-		except:
-			robot_print_current_state('failed to play anim')
+		statecontext.set_unless((1, 2), 5, 'charger pose not known')
+		robot_run_sequence('react', [robot_step('play anim', 'play_anim_trigger', cozmo.anim.Triggers.ReactToPokeReaction, ignore_body_track=True, ignore_head_track=True, ignore_lift_track=True)])
 		robot_print_current_state('charger not found, clearing map')
-		if cozmostate != 1 and cozmostate != 2:
-			cozmostate = 5
+		statecontext.set_unless((1, 2), 5)
 	dockloop = 0
-	while dockloop < 2 and cozmostate == 6 and robot.world.charger:
-		try:
-			action = robot.go_to_pose(robot.world.charger.pose)
-			action.wait_for_completed()
-		except:
-			robot_print_current_state('failed to go to pose')
+	while dockloop < 2 and statecontext.state == 6 and robot_charger_pose():
+		dockpose = robot_charger_pose()
+		if robot_run_sequence('line up', [robot_step('go to pose', 'go_to_pose', dockpose)], robot_docking_aborted) == 'aborted':
+			break
 		robot_print_current_state('I should be in front of the charger')
 		robot.world.charger = None
-		robot.set_head_light(False)
-		time.sleep(0.5)
-		robot.set_head_light(True)
-		time.sleep(0.5)
-		robot.set_head_light(False)
-		try:
-			robot.drive_straight(distance_mm(-20), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive')
-		robot.set_head_light(False)
-		time.sleep(0.5)
-		robot.set_head_light(True)
-		time.sleep(0.5)
-		robot.set_head_light(False)
-		try:
-			action = robot.go_to_pose(robot.world.charger.pose)
-			action.wait_for_completed()
-		except:
-			robot_print_current_state('failed to go to pose')
-		try:
-			robot.drive_straight(distance_mm(-20), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to back up a little bit')
+		# the head light blinks while he shuffles back and lines up again
+		if robot_run_sequence('line up again', [
+			robot_step('blink head light', robot_blink_head_light),
+			robot_step('drive', 'drive_straight', distance_mm(-20), speed_mmps(50), parallel=True),
+			robot_step('blink head light', robot_blink_head_light),
+			robot_step('go to pose', 'go_to_pose', dockpose, parallel=True),
+			robot_step('back up a little bit', 'drive_straight', distance_mm(-20), speed_mmps(50)),
+		], robot_docking_aborted) == 'aborted':
+			break
 		charger = robot.world.charger
 		robot_reaction_chance(cozmo.anim.Triggers.FeedingReactToShake_Normal,85,True,False,False)
 		robot_print_current_state('docking')
-		try:
-			robot.turn_in_place(degrees(95)).wait_for_completed()
-			robot.turn_in_place(degrees(95)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to do a 180')
-		time.sleep(0.5)
-		robot_reaction_chance(cozmo.anim.Triggers.CubePounceFake,1,True,False,False)
-		try:
-			robot.drive_straight(distance_mm(-147), speed_mmps(150)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive onto charger')
-		time.sleep(0.5)
+		if dockclosedloop:
+			if robot_dock_closed_loop(robot_charger_pose() or dockpose) == 'aborted':
+				break
+		else:
+			if robot_run_sequence('turn around', [
+				robot_step('do a 180', 'turn_in_place', degrees(95), required=True),
+				robot_step('do a 180', 'turn_in_place', degrees(95), required=True),
+				robot_step('pause', clock.sleep, 0.5),
+				robot_step('pounce', robot_reaction_chance, cozmo.anim.Triggers.CubePounceFake, 1, True, False, False),
+			], robot_docking_aborted) == 'aborted':
+				break
+			robot_dock_event('attempt')
+			# no abort here, reaching the contacts is what changes the state
+			robot_run_sequence('back in', [
+				robot_step('drive onto charger', 'drive_straight', distance_mm(-147), speed_mmps(150)),
+				robot_step('pause', clock.sleep, 0.5),
+			])
 		# check if we're now docked
 		if robot.is_on_charger:
 			robot_reaction_chance(cozmo.anim.Triggers.SparkSuccess,1,True,False,True)
 			dockloop = 3
-			cozmostate = 1
+			statecontext.set(1)
 			break
 		# No, we missed. Back off and try again
 		robot_print_current_state('failed to dock')
 		robot_reaction_chance(cozmo.anim.Triggers.AskToBeRightedRight,1,True,False,False)
-		try:
-			robot.move_lift(-3)
-		except:
-			robot_print_current_state('failed to move lift')
-		try:
-			robot.set_head_angle(degrees(0)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to set head angle')
 		#os.system('cls' if os.name == 'nt' else 'clear')
 		robot_print_current_state('failed to dock, retrying')
-		try:
-			robot.drive_straight(distance_mm(50), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive')
-		try:
-			robot.turn_in_place(degrees(-3)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to turn')
-		try:
-			robot.drive_straight(distance_mm(100), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive')
-		try:
-			robot.turn_in_place(degrees(94)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to turn')
-		try:
-			robot.turn_in_place(degrees(94)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to turn')
-		try:
-			robot.set_head_angle(degrees(0)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to set head angle')
-		time.sleep(0.5)
+		# pull forward with the lift and head going back down on the way, then come round to face the charger
+		robot_run_sequence('retry', [
+			robot_step('drive', 'drive_straight', distance_mm(50), speed_mmps(50)),
+			robot_step('move lift', 'set_lift_height', 0, parallel=True),
+			robot_step('set head angle', 'set_head_angle', degrees(0), parallel=True),
+			robot_step('turn', 'turn_in_place', degrees(-3)),
+			robot_step('drive', 'drive_straight', distance_mm(100), speed_mmps(50)),
+			robot_step('turn', 'turn_in_place', degrees(94)),
+			robot_step('turn', 'turn_in_place', degrees(94)),
+			robot_step('pause', clock.sleep, 0.5),
+		], robot_docking_aborted)
 		dockloop+=1
 	# exited loop, check current state:
-	if cozmostate != 1 and cozmostate != 2:
-		cozmostate = 5
+	if statecontext.set_unless((1, 2), 5, 'docking failed'):
 		charger= None
 		robot.world.charger=None
+		# the marker relation stays, it gets re-anchored the next time the marker is seen
+		chargerpose = None
 		# express frustration
-		try:
-			robot.drive_straight(distance_mm(50), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive')
-		try:
-			robot.turn_in_place(degrees(-3)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to turn')
-		try:
-			robot.drive_straight(distance_mm(80), speed_mmps(50)).wait_for_completed()
-		except:
-			robot_print_current_state('failed to drive')
+		robot_run_sequence('give up', [
+			robot_step('drive', 'drive_straight', distance_mm(50), speed_mmps(50)),
+			robot_step('turn', 'turn_in_place', degrees(-3)),
+			robot_step('drive', 'drive_straight', distance_mm(80), speed_mmps(50)),
+		])
 		robot_drive_random_pattern()
 		robot_reaction_chance(cozmo.anim.Triggers.MemoryMatchPlayerWinGame,1,True,False,False)
 		x=0
-		while x<11 and cozmostate == 5:
+		while x<11 and statecontext.state == 5:
 			tempfreeplay = 1
 			if freeplay==0:
 				freeplay = 1
+				robot_dock_event('fallback')
 				robot_print_current_state('charger not found, falling back to freeplay')
 				#robot_set_backpacklights(16711935) # green
-				if use_cubes==1:
-					robot.world.connect_to_cubes()
+				# not a state of its own, so not in a profile either
+				robot_resource('cubes', True)
 				if not robot.is_freeplay_mode_active:
 					robot_print_current_state('freeplay enabled')
 					#robot.enable_all_reaction_triggers(True)
 					robot.start_freeplay_behaviors()
-			if cozmostate != 5:
+			if statecontext.state != 5:
 				break
 			robot_print_current_state('charger not found, falling back to freeplay')
-			time.sleep(1)
+			clock.sleep(1)
 		
-			if robot.world.charger:
+			if robot_charger_pose():
 				robot_print_current_state('found charger while in temporary freeplay')
 				charger = robot.world.charger
-				cozmostate = 6
+				statecontext.compare_and_set(5, 6, 'charger position known')
 				break
 			
-			time.sleep(5)
+			clock.sleep(5)
 			x+=1
 		#after time expires or spotting the charger end freeplay
 		tempfreeplay = 0
 		if robot.is_freeplay_mode_active:
 			#robot.enable_all_reaction_triggers(True)
 			robot.stop_freeplay_behaviors()
-		if use_cubes==1:
-			robot.world.disconnect_from_cubes()
+		robot_resource('cubes', False)
 		#robot_set_backpacklights(4278190335) # red
 		freeplay = 0
-		if cozmostate != 1:
-			cozmostate = 5
+		statecontext.set_unless(1, 5)
 		#os.system('cls' if os.name == 'nt' else 'clear')
 		robot_print_current_state('temporary freeplay ended')
-		time.sleep(1)
+		clock.sleep(1)
 #
 # END OF ROBOT FUNCTIONS
 #
@@ -1282,7 +2619,7 @@ def robot_start_docking():
 # EVENT MONITOR FUNCTIONS
 #
 class CheckState (threading.Thread):
-	global robot,cozmostate,freeplay,msg,camera,objmsg,facemsg
+	global robot,freeplay,msg,camera,objmsg,facemsg
 	def __init__(self, thread_id, name, _q):
 		threading.Thread.__init__(self)
 		self.threadID = thread_id
@@ -1290,270 +2627,255 @@ class CheckState (threading.Thread):
 		self.q = _q
 
 # main thread
+# edges are queued by monitor_EvtRobotStateUpdated once per SDK status update; this thread just blocks on the queue
+# and hands them to the subscribers, so the robot actions in the handlers never run on the SDK event loop
 	def run(self):
-		global robot,cozmostate,freeplay,msg,camera,highbatvoltage,lowbatvoltage,lightstate
-		delay = 10
-		is_picked_up = False
-		is_falling = False
-		is_on_charger = False
-		is_cliff_detected = False
-		is_moving = False
-		is_carrying_block = False
-		is_localized = False
-		is_picking_or_placing = False
-		is_pathing = False
-		is_behavior_running = False
 		while thread_running:
-			
+			edge = self.q.get()
+			if edge is None:
+				break
+			robot_dispatch_status(edge)
+
+def robot_dispatch_status(edge):
+	name, value = edge
+	for handler in status_subscribers[name]:
+		try:
+			handler(value)
+		except Exception as e:
+			robot_print_current_state('status handler %s failed: %s' % (name, str(e)), 2)
+
+def robot_drain_status():
+	# VirtualClock ticker standing in for the CheckState thread. A handler that waits lets the clock tick on,
+	# the edges queued meanwhile wait their turn just like they would behind the thread
+	global statusdraining
+	if statusdraining:
+		return
+	statusdraining = True
+	try:
+		while True:
+			try:
+				edge = q.get_nowait()
+			except queue.Empty:
+				break
+			if edge is not None:
+				robot_dispatch_status(edge)
+	finally:
+		statusdraining = False
+
+def robot_subscribe_status(name, handler):
+	# handler(value) is called from the CheckState thread every time the named status flips
+	status_subscribers[name].append(handler)
+
+def robot_unsubscribe_status(name, handler):
+	if handler in status_subscribers[name]:
+		status_subscribers[name].remove(handler)
+
 # event monitor: robot is picked up detection
 
-			#robot_backbackbatteryindicator()
-
-			if robot.is_picked_up:
-				delay = 0
-				if not is_picked_up:
-					is_picked_up = True
-					robot_flash_backpacklights(4278190335)  # 4278190335 is red
-					cozmostate = 9
-					robot_print_current_state('switching to state 9 - picked up')
-					lightstate=0
-			elif is_picked_up and delay > 9:
-				cozmostate = 0
-				lightstate=0
-				is_picked_up = False
-				robot_print_current_state('no longer picked up - state 0')
-			elif delay <= 9:
-				delay += 1
-				
+def status_picked_up(value):
+	global lightstate,pickupreset
+	if pickupreset:
+		pickupreset.cancel()
+		pickupreset = None
+	if value:
+		robot_flash_backpacklights(4278190335)  # 4278190335 is red
+		statecontext.set(9, 'picked up')
+		statechange.set()
+		robot_print_current_state('switching to state 9 - picked up')
+		lightstate=0
+	else:
+		# give it a second to make sure we have really been put down
+		pickupreset = clock.timer(1.0, status_picked_up_reset)
+
+def status_picked_up_reset():
+	global lightstate,pickupreset
+	pickupreset = None
+	if not robot.is_picked_up:
+		statecontext.set(0, 'put down')
+		lightstate=0
+		statechange.set()
+		robot_print_current_state('no longer picked up - state 0')
+
 # event monitor: robot is carrying a block
 
-			if robot.is_carrying_block:
-				if not is_carrying_block:
-					is_carrying_block = True
-					robot_print_current_state('cozmo.robot.Robot.is_carrying_block: True')
-			elif not robot.is_carrying_block:
-				if is_carrying_block:
-					is_carrying_block = False
-					robot_print_current_state('cozmo.robot.Robot.is_carrying_block: False')
+def status_carrying_block(value):
+	robot_print_current_state('cozmo.robot.Robot.is_carrying_block: %s' % str(value))
 
 # event monitor: robot is localized (I don't think this is working right now)
 
-			# if robot.is_localized:
-				# if not is_localized:
-					# is_localized = True
-					# robot_print_current_state('cozmo.robot.Robot.is_localized: True')
-			# elif not robot.is_localized:
-				# if is_localized:
-					# is_localized = False
-					# robot_print_current_state('cozmo.robot.Robot.is_localized: False')				
-
 # event monitor: robot is falling
 
-			if robot.is_falling:
-				if not is_falling:
-					is_falling = True
-					robot.stop_all_motors()
-						
-					cozmostate = 9
-					robot_print_current_state('Switching to state 9 - Falling!')
-					lightstate=0
-			elif not robot.is_falling:
-				if is_falling:
-					is_falling = False
-					cozmostate = 0
-					lightstate=0
-					robot_print_current_state('no longer falling switching to state 0')
+def status_falling(value):
+	global lightstate
+	if value:
+		robot.stop_all_motors()
+		statecontext.set(9, 'falling')
+		statechange.set()
+		robot_print_current_state('Switching to state 9 - Falling!')
+		lightstate=0
+	else:
+		statecontext.set(0, 'stopped falling')
+		lightstate=0
+		statechange.set()
+		robot_print_current_state('no longer falling switching to state 0')
 
 # event monitor: robot moves onto charger
 
-			if robot.is_on_charger:
-				if not is_on_charger:
-					is_on_charger = True
-					#freeplay = 0
-					cozmostate = 1
-					# if robot.is_freeplay_mode_active:
-						# #robot.enable_all_reaction_triggers(True)
-						# robot.stop_freeplay_behaviors()
-					# robot.abort_all_actions(log_abort_messages=True)
-					# robot.wait_for_all_actions_completed()
-					# robot.clear_idle_animation()
-					# robot.stop_all_motors()
-					robot_print_current_state('moved onto the charger')
-					color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
-					light1=cozmo.lights.Light(on_color=color1)
-					light2=cozmo.lights.Light(on_color=color1)
-					light3=cozmo.lights.Light(on_color=color1)
-					robot.set_backpack_lights(None, light3, light2, light1, None)
-					# robot_set_backpacklights(65535)  # 65535 is blue
-					lightstate = 0
-					# #robot.play_anim_trigger(cozmo.anim.Triggers.Sleeping, loop_count=1, in_parallel=True, num_retries=0, ignore_body_track=True, ignore_head_track=False, ignore_lift_track=True).wait_for_completed()
-					# try:
-						# robot.play_anim_trigger(cozmo.anim.Triggers.GoToSleepGetIn).wait_for_completed()
-					# except:
-						# pass
-					#robot_set_backpacklights(65535) # blue
-					# if cozmostate==6:
-						# try:
-							# #robot.play_anim("anim_sparking_success_02").wait_for_completed()
-							# robot_reaction_chance(cozmo.anim.Triggers.SparkSuccess,1,True,False,False)
-						# except:
-							# pass
-						# try:
-							# robot.set_head_angle(degrees(0)).wait_for_completed()
-						# except:
-							# pass
-						# robot_print_current_state('docked')
-					# try:
-						# #robot.play_anim("anim_gotosleep_getin_01").wait_for_completed()
-						# robot_reaction_chance(cozmo.anim.Triggers.GoToSleepGetIn,1,True,False,False)
-					# except:
-						# pass
-					# try:
-						# robot_reaction_chance(cozmo.anim.Triggers.CodeLabSleep,1,True,False,False)
-						# #robot.play_anim("anim_gotosleep_sleeping_01").wait_for_completed()
-					# except:
-						# pass
-					
-					#robot.play_anim_trigger(cozmo.anim.Triggers.StartSleeping, loop_count=1, in_parallel=True, num_retries=0, ignore_body_track=True, ignore_head_track=False, ignore_lift_track=True).wait_for_completed()
-					if robot.is_charging:
-						cozmostate = 1
-						robot_print_current_state('switching to state 1')
-					else:
-						cozmostate = 2
-						maxbatvoltage = robot.battery_voltage
-						robot_print_current_state('on charger, not charging')
-					#print(msg)
-			elif not robot.is_on_charger:
-				if is_on_charger:
-					#robot_set_backpacklights(16711935)  # 16711935 is green
-					color1=cozmo.lights.Color(int_color=16711935, rgb=None, name=None)
-					light1=cozmo.lights.Light(on_color=color1)
-					light2=cozmo.lights.Light(on_color=color1)
-					light3=cozmo.lights.Light(on_color=color1)
-					is_on_charger = False
-					cozmostate = 0
-					robot_print_current_state('switching to state 0 - moved off charger')
-					#print(msg)
+def status_on_charger(value):
+	global lightstate,maxbatvoltage
+	if value:
+		#freeplay = 0
+		robot_dock_event('docked')
+		statecontext.set(1, 'on charger')
+		robot_print_current_state('moved onto the charger')
+		color1=cozmo.lights.Color(int_color=65535, rgb=None, name=None)
+		light1=cozmo.lights.Light(on_color=color1)
+		light2=cozmo.lights.Light(on_color=color1)
+		light3=cozmo.lights.Light(on_color=color1)
+		robot_cmd_set_backpack_lights(None, light3, light2, light1, None)
+		# robot_set_backpacklights(65535)  # 65535 is blue
+		lightstate = 0
+		if robot.is_charging:
+			statecontext.set(1)
+			robot_print_current_state('switching to state 1')
+		else:
+			statecontext.set(2)
+			maxbatvoltage = robot.battery_voltage
+			robot_calibration_event('charged', maxbatvoltage)
+			robot_print_current_state('on charger, not charging')
+	else:
+		#robot_set_backpacklights(16711935)  # 16711935 is green
+		statecontext.set(0, 'off charger')
+		robot_print_current_state('switching to state 0 - moved off charger')
+	statechange.set()
+
+# event monitor: perception worker, something moving in front of the camera / something covering it
+
+def status_motion(value):
+	global msg
+	msg = 'perception: motion %s' % str(value)
+	robot_print_current_state('motion in view: %s' % str(value))
+
+def status_camera_covered(value):
+	global msg
+	msg = 'perception: camera covered %s' % str(value)
+	robot_print_current_state('camera covered: %s' % str(value))
 
 # event monitor: robot has detected cliff
 
-			if robot.is_cliff_detected and not robot.is_falling and not robot.is_picked_up and cozmostate != 6:
-				if not is_cliff_detected:
-					robot.stop_all_motors()
-					is_cliff_detected = True
-					wasinfreeplay = 0
-					robot_print_current_state('cliff detected')
-					#print(msg)
-					if freeplay == 1:
-						freeplay = 0
-						wasinfreeplay = 1
-						if robot.is_freeplay_mode_active:
-							##robot.enable_all_reaction_triggers(True)
-							robot.stop_freeplay_behaviors()
-						#robot.wait_for_all_actions_completed()
-					robot.abort_all_actions(log_abort_messages=True)
-					robot.clear_idle_animation()
-					try:
-						robot.drive_wheels(-40, -40, l_wheel_acc=30, r_wheel_acc=30, duration=1.5)
-					except:
-						robot_print_current_state('failed to drive')
-					try:
-						robot.drive_wheels(-40, -40, l_wheel_acc=30, r_wheel_acc=30, duration=1.5)
-					except:
-						robot_print_current_state('failed to drive')
-					is_cliff_detected = False
-					robot_print_current_state('cliff no longer detected')
-					#print(msg)
-			elif not robot.is_cliff_detected:
-				if is_cliff_detected:
-					robot_print_current_state('switching from cliff mode')
-					is_cliff_detected = False
-					if wasinfreeplay == 1:
-						freeplay = 1
-						wasinfreeplay = 0
-						if robot.is_freeplay_mode_active:
-							##robot.enable_all_reaction_triggers(True)
-							robot_print_current_state('re-enabling freeplay')
-							robot.start_freeplay_behaviors()
+def status_cliff_detected(value):
+	global freeplay,cliffwasinfreeplay
+	if value:
+		if robot.is_falling or robot.is_picked_up or statecontext.state == 6:
+			return
+		robot.stop_all_motors()
+		cliffwasinfreeplay = 0
+		robot_print_current_state('cliff detected')
+		if freeplay == 1:
+			freeplay = 0
+			cliffwasinfreeplay = 1
+			if robot.is_freeplay_mode_active:
+				robot.stop_freeplay_behaviors()
+		robot.abort_all_actions(log_abort_messages=True)
+		robot.clear_idle_animation()
+		try:
+			robot.drive_wheels(-40, -40, l_wheel_acc=30, r_wheel_acc=30, duration=1.5)
+		except:
+			robot_print_current_state('failed to drive')
+		try:
+			robot.drive_wheels(-40, -40, l_wheel_acc=30, r_wheel_acc=30, duration=1.5)
+		except:
+			robot_print_current_state('failed to drive')
+		robot_print_current_state('cliff no longer detected')
+	else:
+		robot_print_current_state('switching from cliff mode')
+		if cliffwasinfreeplay == 1:
+			freeplay = 1
+			cliffwasinfreeplay = 0
+			if robot.is_freeplay_mode_active:
+				robot_print_current_state('re-enabling freeplay')
+				robot.start_freeplay_behaviors()
 
 # event monitor: robot is picking or placing something
-			if robot.is_picking_or_placing:
-				if not is_picking_or_placing:
-					is_picking_or_placing = True
-					msg = 'cozmo.robot.Robot.is_picking_or_placing: True'
-					#print(msg)
-					robot_print_current_state('Robot.is_picking_or_placing: True')
-			elif not robot.is_picking_or_placing:
-				if is_picking_or_placing:
-					is_picking_or_placing = False
-					msg = 'cozmo.robot.Robot.is_picking_or_placing: False'
-					robot_print_current_state('Robot.is_picking_or_placing: False')
-					#print(msg)		
-				
+
+def status_picking_or_placing(value):
+	global msg
+	msg = 'cozmo.robot.Robot.is_picking_or_placing: %s' % str(value)
+	robot_print_current_state('Robot.is_picking_or_placing: %s' % str(value))
+
 # event monitor: robot is pathing (traveling to a target)
-			if robot.is_pathing:
-				if not is_pathing:
-					is_pathing = True
-					msg = 'cozmo.robot.Robot.is_pathing: True'
-					#print(msg)
-					robot_print_current_state('Robot.is_pathing: True')
-			elif not robot.is_pathing:
-				if is_pathing:
-					is_pathing = False
-					msg = 'cozmo.robot.Robot.is_pathing: False'
-					robot_print_current_state('Robot.is_pathing: False')
-					#print(msg)	
+
+def status_pathing(value):
+	global msg
+	msg = 'cozmo.robot.Robot.is_pathing: %s' % str(value)
+	robot_print_current_state('Robot.is_pathing: %s' % str(value))
 
 # event monitor (behavior is running)
-			if robot.is_behavior_running:
-				if not is_behavior_running:
-					is_behavior_running = True
-					msg = 'cozmo.robot.Robot.is_behavior_running: True'
-					robot_print_current_state('Robot.is_behavior_running: True')
-			elif not robot.is_behavior_running:
-				if is_behavior_running:
-					is_behavior_running = False
-					msg = 'cozmo.robot.Robot.is_behavior_running: False'
-					robot_print_current_state('Robot.is_behavior_running: False')
 
-		
+def status_behavior_running(value):
+	global msg
+	msg = 'cozmo.robot.Robot.is_behavior_running: %s' % str(value)
+	robot_print_current_state('Robot.is_behavior_running: %s' % str(value))
+
 # event monitor: robot is moving
-# too spammy/unreliable
-
-			# if robot.is_moving:
-				# if not is_moving:
-					# is_moving = True
-					# robot_print_current_state('Robot.is_moving: True')
-			# elif not robot.is_moving:
-				# if is_moving:
-					# is_moving = False
-					# robot_print_current_state('Robot.is_moving: False')	
-
-# end of detection loop
-			# # camera IR control
-			# if camera.exposure_ms < 60:
-				# # robot.say_text("light").wait_for_completed()
-				# robot.set_head_light(False)
-			# elif camera.exposure_ms >= 60:
-				# # robot.say_text("dark").wait_for_completed()
-				# robot.set_head_light(True)
-			time.sleep(0.1)
+# too spammy/unreliable, not published
+
+status_subscribers = {
+	'picked_up'          : [status_picked_up],
+	'falling'            : [status_falling],
+	'on_charger'         : [status_on_charger],
+	'charging'           : [],
+	'cliff_detected'     : [status_cliff_detected, status_search_cliff],
+	'carrying_block'     : [status_carrying_block],
+	'picking_or_placing' : [status_picking_or_placing],
+	'pathing'            : [status_pathing],
+	'behavior_running'   : [status_behavior_running],
+	'low_battery'        : [],
+	'motion'             : [status_motion],
+	'camera_covered'     : [status_camera_covered],
+}
 
 def print_prefix(evt):
 	msg = evt.event_name + ' '
 	return msg
 
-def print_object(obj):
+#
+# object names: the handlers name every object they report and the charger checks go by that name, so it's
+# worked out once per object and kept under its object id and type. The SDK doesn't say when it removes an
+# object (it only does when custom objects are deleted, which this script never asks for), so instead of being
+# invalidated an entry is only used for the very object it was made for: an object that gets a removed one's id
+# gets a fresh entry. The ids start over with a new connection, monitor() empties the cache then. Cubes have no
+# id until they connect, those aren't kept
+#
+objectnames = {} # (object_id, type) -> (object, name, is the charger)
+
+def robot_object_info(obj):
+	key = (obj.object_id, type(obj))
+	info = objectnames.get(key)
+	if info is not None and info[0] is obj:
+		return info
 	if isinstance(obj,cozmo.objects.LightCube):
 		cube_id = next(k for k,v in robot.world.light_cubes.items() if v==obj)
-		msg = 'LightCube-' + str(cube_id)
+		name = 'LightCube-' + str(cube_id)
 	else:
 		r = re.search('<(\w*)', obj.__repr__())
-		msg = r.group(1)
-	return msg
+		name = r.group(1)
+	info = (obj, name, name == 'Charger')
+	if obj.object_id is not None:
+		objectnames[key] = info
+	return info
+
+def robot_object_forget():
+	objectnames.clear()
+
+def print_object(obj):
+	return robot_object_info(obj)[1]
+
+def robot_object_is_charger(obj):
+	return robot_object_info(obj)[2]
 
 def monitor_generic(evt, **kwargs):
-	global robot,cozmostate,freeplay,msg,camera,objmsg,facemsg
+	global robot,freeplay,msg,camera,objmsg,facemsg
 	msg = print_prefix(evt)
 	if 'behavior' in kwargs or 'behavior_type_name' in kwargs:
 		msg += kwargs['behavior_type_name'] + ' '
@@ -1574,11 +2896,11 @@ def monitor_generic(evt, **kwargs):
 # event monitor: robot is experiencing unexpected movement
 #
 def monitor_EvtUnexpectedMovement(evt, **kwargs):
-	global robot,cozmostate,freeplay,msg,camera
+	global robot,freeplay,msg,camera
 	msg = 'Unexpected Movement'
 	robot_print_current_state('unexpected movement')
 	#print(msg)
-	if  cozmostate != 3 and cozmostate !=9 and cozmostate !=6:
+	if  statecontext.state != 3 and statecontext.state !=9 and statecontext.state !=6:
 		robot_print_current_state('unexpected behavior during action; aborting')
 		#print("unexpected behavior during action; aborting")
 		robot.abort_all_actions(log_abort_messages=True)
@@ -1629,20 +2951,64 @@ def monitor_EvtObjectMovingStopped(evt, *, obj, move_duration, **kwargs):
 # event monitor: an object appeared in our vision
 #
 def monitor_EvtObjectAppeared(evt, **kwargs):
-	global cozmostate,robot,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger,bhvmsg,facemsg,objmsg
+	global robot,freeplay,start_time,needslevel,scheduler_playokay,use_cubes, charger, lowbatvoltage, use_scheduler,msg, camera, foundcharger,bhvmsg,facemsg,objmsg,chargermarkerseen
 	msg = print_prefix(evt)
 	msg += print_object(kwargs['obj']) + ' '
-	if print_object(kwargs['obj']) == "Charger":
+	ischarger = robot_object_is_charger(kwargs['obj'])
+	if robot_is_charger_marker(kwargs['obj']):
+		chargermarkerseen = kwargs['obj']
+		robot_charger_learn(chargermarkerseen)
+		if robot_charger_anchor(chargermarkerseen) and statecontext.compare_and_set((5, 98), 6, 'charger marker seen'):
+			robot_print_current_state('FOUND THE CHARGER MARKER')
+	if ischarger:
+		if robot.world.charger is None:
+			# we dropped it after a failed dock, the SDK won't hand it to us again by itself
+			robot.world.charger = kwargs['obj']
+		robot_charger_learn(chargermarkerseen)
 		charger = robot.world.charger
-	if print_object(kwargs['obj']) == "Charger" and (cozmostate == 5 or cozmostate == 98):
+	if ischarger and statecontext.compare_and_set((5, 98), 6, 'charger seen'):
 		robot_print_current_state('FOUND THE CHARGER')
 		#print("it's the charger and we're looking for it!")
-		cozmostate = 6
 		charger = robot.world.charger
 	robot_print_current_state('object appeared')
 
+#
+# event monitor: robot status update (runs on the SDK event loop several times per second)
+#
+def monitor_EvtRobotStateUpdated(evt, **kwargs):
+	global laststatus, statechange_time, lowbatvoltage
+	r = kwargs['robot']
+	now = clock.time()
+	robot_battery_update(now, r.battery_voltage, r.is_on_charger)
+	robot_battery_record(now, r.battery_voltage, r.is_on_charger)
+	meter = animmeter
+	if meter is not None:
+		meter['total'] += r.battery_voltage
+		meter['samples'] += 1
+	status = (r.is_picked_up, r.is_falling, r.is_on_charger, r.is_charging, r.is_cliff_detected, r.is_carrying_block, r.is_picking_or_placing, r.is_pathing, r.is_behavior_running, robot_battery_low())
+	if status == laststatus:
+		return
+	previous = laststatus or (False,) * len(status)
+	laststatus = status
+	wake = False
+	for name, old, new in zip(status_edges, previous, status):
+		if old != new:
+			q.put((name, new))
+			# only the inputs the state loop guards on - anything else changing is not worth waking for
+			if name in status_wake_edges:
+				wake = True
+	if wake:
+		if statechange_time is None:
+			statechange_time = now
+		statechange.set()
+
+# order matches the status tuple built in monitor_EvtRobotStateUpdated
+status_edges = ('picked_up', 'falling', 'on_charger', 'charging', 'cliff_detected', 'carrying_block', 'picking_or_placing', 'pathing', 'behavior_running', 'low_battery')
+status_wake_edges = {'picked_up', 'falling', 'on_charger', 'charging', 'cliff_detected', 'low_battery'}
+
 dispatch_table = {
   
+  cozmo.robot.EvtRobotStateUpdated     : monitor_EvtRobotStateUpdated,
   cozmo.objects.EvtObjectTapped        : monitor_EvtObjectTapped,
   cozmo.objects.EvtObjectMovingStarted : monitor_EvtObjectMovingStarted,
   cozmo.objects.EvtObjectMovingStopped : monitor_EvtObjectMovingStopped,
@@ -1650,6 +3016,7 @@ dispatch_table = {
   cozmo.faces.EvtFaceAppeared          : monitor_face,
   cozmo.faces.EvtFaceDisappeared       : monitor_face,
   cozmo.robot.EvtUnexpectedMovement    : monitor_EvtUnexpectedMovement,
+  cozmo.world.EvtNewCameraImage        : monitor_EvtNewCameraImage,
 
 }
 
@@ -1675,6 +3042,7 @@ def monitor(_robot, _q, evt_class=None):
 	robot = _robot
 	q = _q
 	thread_running = True
+	robot_object_forget()
 	if evt_class in dispatch_table:
 		robot.world.add_event_handler(evt_class,dispatch_table[evt_class])
 	elif evt_class is not None:
@@ -1683,8 +3051,11 @@ def monitor(_robot, _q, evt_class=None):
 		for k,v in dispatch_table.items():
 			if k not in excluded_events:
 				robot.world.add_event_handler(k,v)
-	thread_is_state_changed = CheckState(1, 'ThreadCheckState', q)
-	thread_is_state_changed.start()
+	if clock.threaded:
+		thread_is_state_changed = CheckState(1, 'ThreadCheckState', q)
+		thread_is_state_changed.start()
+	else:
+		clock.add_ticker(robot_drain_status)
 
 def unmonitor(_robot, evt_class=None):
 	if not isinstance(_robot, cozmo.robot.Robot):
@@ -1692,9 +3063,16 @@ def unmonitor(_robot, evt_class=None):
 	if evt_class is not None and not issubclass(evt_class, cozmo.event.Event):
 		raise TypeError('Second argument must be an Event subclass')
 	global robot
+	global q
 	global thread_running
 	robot = _robot
 	thread_running = False
+	robot_perception_stop()
+	robot_recorder_stop()
+	if q is not None:
+		q.put(None)
+	if not clock.threaded:
+		clock.remove_ticker(robot_drain_status)
 
 	try:
 		if evt_class in dispatch_table:
@@ -1707,8 +3085,8 @@ def unmonitor(_robot, evt_class=None):
 	except Exception:
 		pass
 		
-def robot_print_current_state(currentstate):
-	global robot,needslevel,start_time,cozmostate,msg,highbatvoltage,maxbatvoltage,objmsg,facemsg,bhvmsg,lightstate,batlightcounter,debugging, batcounter
+def robot_print_current_state(currentstate, level=1):
+	global robot,needslevel,start_time,msg,lightstate,batcounter,transitionlatency
 	if not batcounter:
 		batcounter = 0
 	if batcounter > 5:
@@ -1717,40 +3095,118 @@ def robot_print_current_state(currentstate):
 	batcounter += 1
 	robot_set_needslevel()
 	currentbehavior = robot.current_behavior
-	if currentbehavior == None and cozmostate == 4:
+	if currentbehavior == None and statecontext.state == 4:
 		currentbehavior = 'freeplay'
-	runtime = round(((time.time() - start_time)/60),2)
-	"{:.2f}".format(runtime)
-	if debugging==1:
-		#logging.warn('istate %s' % cozmostate,'| battery %s' % str(round(robot.battery_voltage, 2)),'| energy %s' % round(needslevel, 2),'| anim %s' % str(robot.is_animating),'| behav %s' % str(robot.is_behavior_running),'| bkpk %s' % lightstate,'| state: %s' % str(currentstate),'| msg: %s' % str(msg))
-		#print("state %s" % cozmostate,"| battery %s" % str(round(robot.battery_voltage, 2)),"| energy %s" % round(needslevel, 2),"| anim %s" % str(robot.is_animating),"| behav %s" % str(robot.is_behavior_running),"| bkpk %s" % lightstate,"| action: %s" % str(currentstate),"| msg: %s" % str(msg),"accel: %s" % str(robot.accelerometer))
-		print("state %s" % cozmostate,"| battery %s" % str(round(robot.battery_voltage, 2)),"| energy %s" % round(needslevel, 2),"| anim %s" % str(robot.is_animating),"| behav %s" % str(robot.is_behavior_running),"| bkpk %s" % lightstate,"| action: %s" % str(currentstate),"| msg: %s" % str(msg),"curbehav: %s" % str(currentbehavior))
-		
-	else:
-		os.system('cls' if os.name == 'nt' else 'clear')
-		#
-		# commented out thingies either didn't do what I expected or didn't work
-		#
-		#print("cozmo sees     : %s"  % str(robot.world.connected_light_cubes))
-		#print("wheelie        : %s" % str(robot.PopAWheelie))
-		#print("Cubes connected: %s" % robot.world.World.active_behavior.connected_light_cubes)
-		#print("Behavior       : %s" % str(cozmo.behavior.Behavior))
-		#print("Max Battery    : %s" % str(round(maxbatvoltage, 2)))
-		#print("Max off charger: %s" % str(round(highbatvoltage, 2))) 
-		#print("idle anim      : %s" % str(robot.is_animating_idle))
-		#print("actions        : %s" % str(robot.has_in_progress_actions))
-		# print("Object log     : %s" %objmsg)
-		# print("Face log       : %s" %facemsg)
-		# print("Behavior log   : %s" %bhvmsg)
-		print("State          : %s" % str(currentstate))
-		print("Internal state : %s" % str(cozmostate))
-		print("Battery        : %s" % (str(round(robot.battery_voltage, 2))))
-		print("Energy         : %s" % (round(needslevel, 2)))
-		print("Runtime        : %s" % str(runtime))
-		print("running behav  : %s" % (str(robot.is_behavior_running)))
-		print("animating      : %s" % (str(robot.is_animating)))
-		print("Event log      : %s" % str(msg))
-		print("Lightstate     : %s" % str(lightstate))
+	robot_log((clock.time(), level, currentstate, statecontext.state, robot.battery_voltage, needslevel, robot.is_animating, robot.is_behavior_running, lightstate, msg, currentbehavior, transitionlatency['last']))
+
+def robot_log(record):
+	# called from the control loop, CheckState and SDK event handlers - never blocks, never touches stdout
+	global logtokens,logtokentime,logdropped,loglevel,logratelimit
+	if record[1] < loglevel:
+		return
+	# token bucket, drop instead of queueing up behind a slow terminal. Threads race for the tokens, so the update
+	# is locked, and a record stamped before the last one (made in another thread) refills nothing
+	now = record[0]
+	with loglock:
+		logtokens = min(logratelimit, logtokens + max(0, now - logtokentime) * logratelimit)
+		logtokentime = max(logtokentime, now)
+		if logtokens < 1:
+			logdropped += 1
+			return
+		logtokens -= 1
+	# deque.append is atomic, the writer thread pops from the other end
+	logbuffer.append(record)
+
+def log_format_line(record):
+	t, level, currentstate, state, battery, energy, animating, behaving, lights, message, currentbehavior, latency = record
+	#logging.warn('istate %s' % cozmostate,'| battery %s' % str(round(robot.battery_voltage, 2)),'| energy %s' % round(needslevel, 2),'| anim %s' % str(robot.is_animating),'| behav %s' % str(robot.is_behavior_running),'| bkpk %s' % lightstate,'| state: %s' % str(currentstate),'| msg: %s' % str(msg))
+	return "%s %s state %s | battery %s | energy %s | anim %s | behav %s | bkpk %s | action: %s | msg: %s curbehav: %s | wake %sms" % (time.strftime('%H:%M:%S', time.localtime(t)), loglevelnames[level], state, str(round(battery, 2)), round(energy, 2), str(animating), str(behaving), lights, str(currentstate), str(message), str(currentbehavior), round(latency, 1))
+
+def log_format_screen(record):
+	t, level, currentstate, state, battery, energy, animating, behaving, lights, message, currentbehavior, latency = record
+	runtime = round(((t - start_time)/60),2)
+	#
+	# commented out thingies either didn't do what I expected or didn't work
+	#
+	#print("cozmo sees     : %s"  % str(robot.world.connected_light_cubes))
+	#print("wheelie        : %s" % str(robot.PopAWheelie))
+	#print("Cubes connected: %s" % robot.world.World.active_behavior.connected_light_cubes)
+	#print("Behavior       : %s" % str(cozmo.behavior.Behavior))
+	#print("idle anim      : %s" % str(robot.is_animating_idle))
+	#print("actions        : %s" % str(robot.has_in_progress_actions))
+	# print("Object log     : %s" %objmsg)
+	# print("Face log       : %s" %facemsg)
+	# print("Behavior log   : %s" %bhvmsg)
+	lines = []
+	lines.append("State          : %s" % str(currentstate))
+	lines.append("Internal state : %s" % str(state))
+	lines.append("Battery        : %s" % (str(round(battery, 2))))
+	lines.append("Battery est.   : %s" % robot_battery_report())
+	lines.append("Max Battery    : %s" % str(round(maxbatvoltage, 2)))
+	lines.append("Max off charger: %s" % str(round(highbatvoltage, 2)))
+	lines.append("Energy         : %s" % (round(energy, 2)))
+	lines.append("Runtime        : %s" % str(runtime))
+	lines.append("running behav  : %s" % (str(behaving)))
+	lines.append("animating      : %s" % (str(animating)))
+	lines.append("Event log      : %s" % str(message))
+	lines.append("Lightstate     : %s" % str(lights))
+	if transitionlatency['count'] > 0:
+		lines.append("State latency  : last %.1f ms, mean %.1f ms, max %.1f ms" % (transitionlatency['last'], transitionlatency['total'] / transitionlatency['count'], transitionlatency['max']))
+	if logdropped > 0:
+		lines.append("Log dropped    : %s" % str(logdropped))
+	lines.append("Commands       : %s" % robot_command_report())
+	if dockstats['searches'] > 0:
+		lines.append("Docking        : %s" % robot_dock_report())
+	return '\n'.join(lines)
+
+class LogWriter (threading.Thread):
+	# drains logbuffer in batches so printing (or clearing the screen) never happens on the caller's thread
+	def __init__(self, thread_id, name):
+		threading.Thread.__init__(self, daemon=True)
+		self.threadID = thread_id
+		self.name = name
+		self.reported = 0
+		self.out = open(logfile, 'a') if logfile else None
+
+	def run(self):
+		while True:
+			time.sleep(logflushinterval)
+			self.flush()
+
+	def flush(self):
+		batch = []
+		while logbuffer:
+			batch.append(logbuffer.popleft())
+		if not batch:
+			return
+		lines = [log_format_line(record) for record in batch]
+		if logdropped > self.reported:
+			lines.append('%d log records dropped by rate limit' % (logdropped - self.reported))
+			self.reported = logdropped
+		if self.out:
+			self.out.write('\n'.join(lines) + '\n')
+			self.out.flush()
+		if debugging == 1:
+			if not self.out:
+				sys.stdout.write('\n'.join(lines) + '\n')
+		else:
+			# status screen only needs the newest record, redraw it once per batch
+			if os.name == 'nt':
+				os.system('cls')
+				sys.stdout.write(log_format_screen(batch[-1]) + '\n')
+			else:
+				sys.stdout.write('\033[2J\033[H' + log_format_screen(batch[-1]) + '\n')
+		sys.stdout.flush()
+
+def robot_start_logwriter():
+	global logwriter
+	if logwriter is None:
+		logwriter = LogWriter(2, 'ThreadLogWriter')
+		if clock.threaded:
+			logwriter.start()
+		else:
+			# virtual time outruns a writer on a real timer, flush every tick instead so nothing falls off logbuffer
+			clock.add_ticker(logwriter.flush)
 
 	
 #
@@ -1764,7 +3220,9 @@ cozmo.robot.Robot.drive_off_charger_on_connect = False
 #cozmo.run_program(cozmo_unleashed, use_viewer=True)
 #
 # you may need to install a freeglut library, the cozmo SDK has documentation for this. If you don't have it comment the below line and uncomment the one above.
-cozmo.run_program(cozmo_unleashed, use_viewer=True, use_3d_viewer=True)
+# (only when run as a script, so the benchmarks can import the functions)
+if __name__ == '__main__':
+	cozmo.run_program(cozmo_unleashed, use_viewer=True, use_3d_viewer=True)
 # which will give you remote control over Cozmo via WASD+QERF while the 3d window has focus
 #
 # below is just the program running without any camera view or 3d maps
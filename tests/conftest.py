@@ -0,0 +1,4 @@
+# the tests import the scripts in the directory above as modules, the way cozmo_benchmarks.py does
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,85 @@
+#
+# the random animation index: the alias table has to give every trigger exactly its weight, and the pick has to
+# follow the table
+#
+import collections
+import random
+import pytest
+import cozmo_unleashed as cu
+
+
+Trigger = collections.namedtuple('Trigger', 'name')
+
+
+def table_odds(prob, alias):
+	# the odds of every slot straight from the table: its own share plus what the slots aliased to it give up
+	n = len(prob)
+	odds = [p / n for p in prob]
+	for j, a in enumerate(alias):
+		odds[a] += (1 - prob[j]) / n
+	return odds
+
+
+@pytest.mark.parametrize('weights', [
+	[1.0],
+	[1.0, 1.0, 1.0, 1.0],
+	[3.0, 0.5, 0.5, 1.0],
+	[100.0, 1.0, 1.0],
+	[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7],
+	[random.Random(seed).uniform(0.01, 5.0) for seed in range(50)],
+])
+def test_alias_table_reproduces_weights(weights):
+	prob, alias = cu.robot_anim_alias(weights)
+	assert len(prob) == len(alias) == len(weights)
+	assert all(0.0 <= p <= 1.0 for p in prob)
+	assert all(0 <= a < len(weights) for a in alias)
+	total = sum(weights)
+	assert table_odds(prob, alias) == pytest.approx([w / total for w in weights], abs=1e-12)
+
+
+def test_index_filters_and_weighs_categories(monkeypatch):
+	monkeypatch.setattr(cu, 'animblacklist', ('Sleep', 'Test'))
+	monkeypatch.setattr(cu, 'animwhitelist', ())
+	monkeypatch.setattr(cu, 'animcategoryweights', {'Code': 3.0, 'Repair': 0.0})
+	monkeypatch.setattr(cu, 'animdefaultweight', 1.0)
+	monkeypatch.setattr(cu, 'animindex', None)
+	triggers = [Trigger(name) for name in ('CodeLabHappy', 'CodeLabSad', 'FistBump', 'GoToSleepGetIn', 'TestAnim', 'RepairFixHead', 'Hiccup')]
+	cu.robot_anim_index_build(triggers)
+	names = [trigger.name for trigger in cu.animindex['triggers']]
+	# blacklisted and zero weight categories are out, a category's weight is shared by its members
+	assert sorted(names) == ['CodeLabHappy', 'CodeLabSad', 'FistBump', 'Hiccup']
+	weights = dict(zip(names, cu.animindex['weights']))
+	assert weights == {'CodeLabHappy': 1.5, 'CodeLabSad': 1.5, 'FistBump': 1.0, 'Hiccup': 1.0}
+
+
+def test_index_whitelist(monkeypatch):
+	monkeypatch.setattr(cu, 'animblacklist', ())
+	monkeypatch.setattr(cu, 'animwhitelist', ('Happy',))
+	monkeypatch.setattr(cu, 'animindex', None)
+	cu.robot_anim_index_build([Trigger('CodeLabHappy'), Trigger('CodeLabSad')])
+	assert [trigger.name for trigger in cu.animindex['triggers']] == ['CodeLabHappy']
+
+
+def test_pick_without_index(monkeypatch):
+	monkeypatch.setattr(cu, 'animblacklist', ('Anim',))
+	monkeypatch.setattr(cu, 'animwhitelist', ())
+	monkeypatch.setattr(cu, 'animindex', None)
+	cu.robot_anim_index_build([Trigger('TestAnim')])
+	assert cu.animindex is None
+	assert cu.robot_anim_pick() == cu.cozmo.anim.Triggers.SparkSuccess
+
+
+def test_pick_follows_weights(monkeypatch):
+	monkeypatch.setattr(cu, 'animblacklist', ())
+	monkeypatch.setattr(cu, 'animwhitelist', ())
+	monkeypatch.setattr(cu, 'animcategoryweights', {'Code': 6.0, 'Feeding': 1.0})
+	monkeypatch.setattr(cu, 'animdefaultweight', 3.0)
+	monkeypatch.setattr(cu, 'animindex', None)
+	cu.robot_anim_index_build([Trigger('CodeLabHappy'), Trigger('FeedingReact'), Trigger('Hiccup')])
+	monkeypatch.setattr(cu.random, 'random', random.Random(5).random)
+	monkeypatch.setattr(cu.random, 'randrange', random.Random(6).randrange)
+	picks = 60000
+	counts = collections.Counter(cu.robot_anim_pick().name for _ in range(picks))
+	assert counts['CodeLabHappy'] / picks == pytest.approx(0.6, abs=0.01)
+	assert counts['FeedingReact'] / picks == pytest.approx(0.1, abs=0.01)
+	assert counts['Hiccup'] / picks == pytest.approx(0.3, abs=0.01)
@@ -0,0 +1,67 @@
+#
+# the battery estimator against a voltage trace: data/battery_trace.csv is 40 minutes off the charger sampled every
+# 2 s, synthetic - a slow decline with the knee at the end of a Li-ion discharge, a 40 mV sag for 10 s of every
+# minute while driving, 8 mV of noise, and one reading 350 mV low at 400 s
+#
+import csv, os
+import pytest
+import battery_replay
+import cozmo_unleashed as cu
+
+trace = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'battery_trace.csv')
+spike = 400
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+	monkeypatch.setattr(cu, 'lowbatvoltage', 3.7)
+	monkeypatch.setattr(cu, 'batteryfiltertau', 20)
+	monkeypatch.setattr(cu, 'batteryratetau', 600)
+	monkeypatch.setattr(cu, 'batterydocklead', 180)
+	yield
+	cu.robot_battery_reset()
+
+
+def rows():
+	with open(trace) as f:
+		for row in csv.DictReader(f):
+			yield float(row['time']), float(row['voltage']), row['on_charger'] == '1'
+
+
+def test_single_spike_does_not_trigger():
+	cu.robot_battery_reset()
+	start = None
+	for t, v, oncharger in rows():
+		start = t if start is None else start
+		if t - start == spike:
+			assert v <= cu.lowbatvoltage
+		cu.robot_battery_update(t, v, oncharger)
+		if t - start >= spike + 300:
+			break
+		assert not cu.robot_battery_low(), 'estimator triggered at %ss' % (t - start)
+
+
+def test_sustained_sag_triggers_no_later_than_raw_guard():
+	cycles = battery_replay.replay(trace)
+	assert len(cycles) == 1
+	cycle = cycles[0]
+	assert cycle['raw_trigger'] is not None
+	assert cycle['estimator_trigger'] is not None
+	assert cycle['estimator_trigger'] > spike + 300
+	assert cycle['estimator_trigger'] <= cycle['raw_trigger']
+
+
+def test_flat_voltage_never_triggers():
+	cu.robot_battery_reset()
+	for i in range(600):
+		cu.robot_battery_update(i * 2.0, 3.9, False)
+	assert cu.robot_battery_time_to_low() == float('inf')
+	assert not cu.robot_battery_low()
+
+
+def test_charger_restarts_estimate():
+	cu.robot_battery_reset()
+	for i in range(100):
+		cu.robot_battery_update(i * 2.0, 3.9 - i * 0.002, False)
+	cu.robot_battery_update(200.0, 4.6, True)
+	assert cu.batteryestimate == {'voltage': 4.6, 'rate': 0.0, 'time': 200.0, 'charger': True}
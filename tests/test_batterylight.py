@@ -0,0 +1,73 @@
+#
+# the compiled battery light table: a bisect into the breakpoints gives the same band as going through the rules
+# in order, at the breakpoints themselves, just either side of them and everywhere in between
+#
+import math
+import pytest
+import cozmo_unleashed as cu
+
+calibrations = [(4.14, 3.7, 4.8), (4.05, 3.65, 4.6), (4.2, 3.75, 4.95)]
+
+
+def voltages(table):
+	points = sorted(set(p for entry in table.values() for p in entry[0]))
+	for p in points:
+		yield p
+		yield math.nextafter(p, -math.inf)
+		yield math.nextafter(p, math.inf)
+	for i in range(3000, 5200):
+		yield i / 1000
+
+
+@pytest.mark.parametrize('high, low, maxv', calibrations)
+def test_table_matches_rules(high, low, maxv):
+	rules = cu.robot_batterylight_rules(high, low, maxv)
+	table = cu.robot_batterylight_compile(high, low, maxv)
+	assert set(table) == {1, 4, 5}
+	for state in (0, 1, 2, 4, 5, 6, 9):
+		staterules = [r for r in rules if r[0] == state]
+		for v in voltages(table):
+			assert cu.robot_batterylight_band(table, state, v) == cu.robot_batterylight_match(staterules, v), (state, v)
+
+
+def test_breakpoint_bounds():
+	table = cu.robot_batterylight_compile(4.14, 3.7, 4.8)
+	# at maxbatvoltage on the charger it's the full band, just under it isn't
+	assert cu.robot_batterylight_band(table, 1, 4.8) == 5
+	assert cu.robot_batterylight_band(table, 1, math.nextafter(4.8, 0)) != 5
+	# in freeplay the first band is open ended upwards, and a state without rules has no band at all
+	assert cu.robot_batterylight_band(table, 4, 5.0) == 1
+	assert cu.robot_batterylight_band(table, 0, 4.0) is None
+
+
+class LightRobot:
+	battery_voltage = 4.0
+	is_on_charger = False
+
+	def __init__(self):
+		self.sent = []
+
+	def set_backpack_lights(self, *lights):
+		self.sent.append(lights)
+
+
+def test_recompiles_on_recalibration(monkeypatch):
+	monkeypatch.setattr(cu, 'robot', LightRobot())
+	monkeypatch.setattr(cu, 'clock', cu.VirtualClock())
+	monkeypatch.setattr(cu, 'commandcache', {})
+	monkeypatch.setattr(cu, 'commandpending', {})
+	monkeypatch.setattr(cu, 'statecontext', cu.StateContext(4))
+	monkeypatch.setattr(cu, 'batterylight_key', None)
+	monkeypatch.setattr(cu, 'batterylight_table', None, raising=False)
+	monkeypatch.setattr(cu, 'batlightcounter', 0, raising=False)
+	monkeypatch.setattr(cu, 'lightstate', 0, raising=False)
+	monkeypatch.setattr(cu, 'highbatvoltage', 4.14)
+	cu.robot_backbackbatteryindicator()
+	first = cu.batterylight_table
+	assert cu.batterylight_key == (4.14, cu.lowbatvoltage, cu.maxbatvoltage)
+	cu.robot_backbackbatteryindicator()
+	assert cu.batterylight_table is first
+	monkeypatch.setattr(cu, 'highbatvoltage', 4.05)
+	cu.robot_backbackbatteryindicator()
+	assert cu.batterylight_table is not first
+	assert cu.batterylight_table == cu.robot_batterylight_compile(4.05, cu.lowbatvoltage, cu.maxbatvoltage)
@@ -0,0 +1,60 @@
+#
+# the calibration store, shared by every robot the supervisor runs: loading one robot's calibration must never
+# put an older copy from the file over what another robot has in memory
+#
+import json
+import pytest
+import cozmo_unleashed as cu
+
+
+class FakeRobot:
+	def __init__(self, serial):
+		self.serial = serial
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+	path = str(tmp_path / 'cozmo_calibration.json')
+	monkeypatch.setattr(cu, 'calibrationfile', path)
+	monkeypatch.setattr(cu, 'calibration', {})
+	monkeypatch.setattr(cu, 'clock', cu.VirtualClock(0.0, 0.05))
+	monkeypatch.setattr(cu, 'maxbatvoltage', 4.5)
+	monkeypatch.setattr(cu, 'highbatvoltage', 4.1)
+	monkeypatch.setattr(cu, 'chargerrelative', None, raising=False)
+	monkeypatch.setattr(cu, 'msg', '', raising=False)
+	monkeypatch.setattr(cu, 'animcatalogdata', {})
+	return path
+
+
+def history(path, serial):
+	with open(path) as f:
+		return [item['event'] for item in json.load(f)[serial]['history']]
+
+
+def test_load_keeps_entries_in_memory(store, monkeypatch):
+	monkeypatch.setattr(cu, 'robot', FakeRobot('a'))
+	cu.robot_calibration_load(cu.robot)
+	cu.robot_calibration_event('charging', 4.2)
+	with open(store) as f:
+		stale = f.read()
+	cu.robot_calibration_event('charged', 4.6)
+	# robot b starts up with the file as it was before a's last event
+	with open(store, 'w') as f:
+		f.write(stale)
+	cu.robot_calibration_load(FakeRobot('b'))
+	cu.robot_calibration_event('low', 3.6)
+	assert history(store, 'a') == ['charging', 'charged', 'low']
+
+
+def test_load_takes_own_entry_and_keeps_the_others(store, monkeypatch):
+	with open(store, 'w') as f:
+		json.dump({'a': {'maxbatvoltage': 4.7, 'history': []}, 'c': {'maxbatvoltage': 4.4, 'history': []}}, f)
+	monkeypatch.setattr(cu, 'robot', FakeRobot('a'))
+	cu.robot_calibration_load(cu.robot)
+	assert cu.maxbatvoltage == 4.7
+	cu.robot_calibration_event('charging', 4.2)
+	with open(store) as f:
+		stored = json.load(f)
+	# a robot that isn't running keeps its entry in the file
+	assert stored['c']['maxbatvoltage'] == 4.4
+	assert [item['event'] for item in stored['a']['history']] == ['charging']
@@ -0,0 +1,80 @@
+#
+# robot_command_needed(): repeats are dropped, changes inside the interval are held back and the latest one goes
+# out when the interval ends
+#
+import pytest
+import cozmo_unleashed as cu
+
+
+class FakeRobot:
+	def __init__(self):
+		self.sent = []
+
+	def set_head_light(self, enable):
+		self.sent.append(('head_light', enable))
+
+	def set_needs_levels(self, repair_value, energy_value, play_value):
+		self.sent.append(('needs', repair_value))
+
+
+@pytest.fixture
+def robot(monkeypatch):
+	monkeypatch.setattr(cu, 'clock', cu.VirtualClock(0.0, 0.05))
+	monkeypatch.setattr(cu, 'robot', FakeRobot())
+	monkeypatch.setattr(cu, 'commandcache', {})
+	monkeypatch.setattr(cu, 'commandpending', {})
+	monkeypatch.setattr(cu, 'commandstats', {'sent': 0, 'saved': 0, 'since': 0.0})
+	return cu.robot
+
+
+def test_repeat_inside_refresh_is_dropped(robot):
+	cu.robot_cmd_set_head_light(True)
+	cu.clock.sleep(1)
+	cu.robot_cmd_set_head_light(True)
+	assert robot.sent == [('head_light', True)]
+	assert cu.commandstats == {'sent': 1, 'saved': 1, 'since': 0.0}
+
+
+def test_repeat_after_refresh_is_sent(robot):
+	cu.robot_cmd_set_head_light(True)
+	cu.clock.sleep(cu.command_policies['set_head_light']['refresh'] + 1)
+	cu.robot_cmd_set_head_light(True)
+	assert robot.sent == [('head_light', True)] * 2
+
+
+def test_change_inside_interval_goes_out_when_it_ends(robot):
+	cu.robot_cmd_set_head_light(True)
+	cu.clock.sleep(0.1)
+	cu.robot_cmd_set_head_light(False)
+	assert robot.sent == [('head_light', True)]
+	cu.clock.sleep(0.2)
+	assert robot.sent == [('head_light', True), ('head_light', False)]
+	assert cu.commandcache['set_head_light'][0] == (False,)
+
+
+def test_latest_change_wins(robot):
+	cu.robot_cmd_set_needs_levels(1)
+	cu.clock.sleep(1)
+	cu.robot_cmd_set_needs_levels(0.5)
+	cu.clock.sleep(1)
+	cu.robot_cmd_set_needs_levels(0.2)
+	cu.clock.sleep(cu.command_policies['set_needs_levels']['interval'])
+	assert robot.sent == [('needs', 1), ('needs', 0.2)]
+	assert cu.commandstats['saved'] == 1
+
+
+def test_change_back_cancels_pending(robot):
+	cu.robot_cmd_set_head_light(True)
+	cu.clock.sleep(0.05)
+	cu.robot_cmd_set_head_light(False)
+	cu.robot_cmd_set_head_light(True)
+	cu.clock.sleep(1)
+	assert robot.sent == [('head_light', True)]
+	assert cu.commandpending == {}
+
+
+def test_change_after_interval_is_sent_at_once(robot):
+	cu.robot_cmd_set_head_light(True)
+	cu.clock.sleep(0.5)
+	cu.robot_cmd_set_head_light(False)
+	assert robot.sent == [('head_light', True), ('head_light', False)]
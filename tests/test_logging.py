@@ -0,0 +1,58 @@
+#
+# robot_log()'s token bucket: at most logratelimit records a second get through, whichever threads they come from
+#
+import collections, threading
+import pytest
+import cozmo_unleashed as cu
+
+
+def record(t):
+	return (t, 1, 'test', 0, 4.0, 1.0, False, False, 0, '', None, 0.0)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+	monkeypatch.setattr(cu, 'logbuffer', collections.deque())
+	monkeypatch.setattr(cu, 'loglevel', 0)
+	monkeypatch.setattr(cu, 'logratelimit', 50)
+	monkeypatch.setattr(cu, 'logtokens', 50)
+	monkeypatch.setattr(cu, 'logtokentime', 100.0)
+	monkeypatch.setattr(cu, 'logdropped', 0)
+
+
+def test_threads_share_the_limit(bucket):
+	threads = 8
+	per = 2000
+	start = threading.Barrier(threads)
+	def run():
+		start.wait()
+		for _ in range(per):
+			cu.robot_log(record(100.0))
+	workers = [threading.Thread(target=run) for _ in range(threads)]
+	for w in workers:
+		w.start()
+	for w in workers:
+		w.join()
+	assert len(cu.logbuffer) == 50
+	assert cu.logdropped == threads * per - 50
+
+
+def test_older_record_refills_nothing(bucket):
+	for _ in range(50):
+		cu.robot_log(record(100.0))
+	# made in another thread just before the ones above, it mustn't turn into a negative refill or a free token
+	cu.robot_log(record(99.0))
+	assert cu.logtokentime == 100.0
+	assert cu.logtokens >= 0
+	assert len(cu.logbuffer) == 50
+	assert cu.logdropped == 1
+	# and time going on refills at the rate again
+	cu.robot_log(record(100.1))
+	assert len(cu.logbuffer) == 51
+
+
+def test_below_loglevel_is_not_counted(bucket, monkeypatch):
+	monkeypatch.setattr(cu, 'loglevel', 2)
+	cu.robot_log(record(100.0))
+	assert len(cu.logbuffer) == 0
+	assert cu.logdropped == 0
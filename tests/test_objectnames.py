@@ -0,0 +1,41 @@
+#
+# object names kept per object: only ever used for the object they were made for
+#
+import pytest
+import cozmo
+import cozmo_sim as sim
+import cozmo_unleashed as cu
+
+
+@pytest.fixture
+def world(monkeypatch):
+	world = sim.SimWorld(1, 'cycle', cu.VirtualClock(0.0, sim.simtick))
+	monkeypatch.setattr(cu, 'robot', world.robot)
+	monkeypatch.setattr(cu, 'objectnames', {})
+	return world
+
+
+def test_names_are_kept(world):
+	assert cu.print_object(world.chargerobj) == 'Charger'
+	assert cu.robot_object_is_charger(world.chargerobj)
+	assert cu.print_object(world.markerobj) == 'CustomObject'
+	assert not cu.robot_object_is_charger(world.markerobj)
+	assert set(cu.objectnames) == {(1, cozmo.objects.Charger), (2, type(world.markerobj))}
+	assert cu.robot_object_info(world.chargerobj) is cu.robot_object_info(world.chargerobj)
+
+
+def test_reused_id_gets_a_fresh_entry(world):
+	old = cu.robot_object_info(world.chargerobj)
+	# the SDK dropped the charger and made a new one under the same id
+	charger = cozmo.objects.Charger(None, world, object_id=1, loop=world.loop)
+	new = cu.robot_object_info(charger)
+	assert new is not old and new[0] is charger
+	assert cu.objectnames[(1, cozmo.objects.Charger)] is new
+	assert len(cu.objectnames) == 1
+
+
+def test_forget(world):
+	cu.robot_object_info(world.chargerobj)
+	cu.robot_object_info(world.markerobj)
+	cu.robot_object_forget()
+	assert cu.objectnames == {}
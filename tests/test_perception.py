@@ -0,0 +1,126 @@
+#
+# the perception worker's shared frame ring and its per frame scores
+#
+import multiprocessing
+import queue
+import threading
+import numpy as np
+import pytest
+import cozmo_perception
+import cozmo_unleashed as cu
+from PIL import Image
+
+
+@pytest.fixture(scope='module')
+def context():
+	# the context cozmo_unleashed.py starts the worker with
+	return multiprocessing.get_context('spawn')
+
+
+def test_fits(context):
+	ring = cozmo_perception.FrameRing(context, 2, 320, 240)
+	assert ring.fits(320, 240)
+	assert ring.fits(160, 120)
+	assert not ring.fits(640, 480)
+	assert not ring.fits(321, 240)
+
+
+def test_view_shares_memory(context):
+	ring = cozmo_perception.FrameRing(context, 3, 8, 6)
+	first = ring.view(1, 8, 6)
+	assert first.shape == (6, 8)
+	first[:] = 7
+	# written through one view, seen through another and in the raw array, and the other slots are untouched
+	assert (ring.view(1, 8, 6) == 7).all()
+	assert np.shares_memory(first, ring.view(1, 8, 6))
+	raw = np.frombuffer(ring.frames, dtype=np.uint8)
+	assert (raw[48:96] == 7).all()
+	assert not raw[:48].any() and not raw[96:].any()
+	# a smaller frame sits at the start of its slot
+	ring.view(2, 4, 3)[:] = 9
+	assert (raw[96:108] == 9).all() and not raw[108:].any()
+
+
+def test_analyse_histogram_and_brightness():
+	frame = np.zeros((240, 320), dtype=np.uint8)
+	frame[:, 160:] = 200
+	histogram, brightness, motion, occlusion, grid = cozmo_perception.analyse(frame)
+	assert histogram.sum() == frame.size
+	assert histogram[0] == histogram[200 >> 4] == frame.size // 2
+	assert brightness == pytest.approx(100.0)
+	assert motion == 0.0
+	assert grid.shape == (60, 80)
+
+
+def test_analyse_motion():
+	rng = np.random.default_rng(3)
+	still = rng.integers(60, 200, size=(240, 320), dtype=np.uint8)
+	_, _, _, _, grid = cozmo_perception.analyse(still)
+	# sensor noise doesn't count
+	noisy = np.clip(still.astype(np.int16) + rng.integers(-5, 6, size=still.shape), 0, 255).astype(np.uint8)
+	_, _, motion, _, grid = cozmo_perception.analyse(noisy, grid)
+	assert motion == 0.0
+	# a quarter of the picture changes
+	moved = noisy.copy()
+	moved[:120, :160] += 100
+	_, _, motion, _, grid = cozmo_perception.analyse(moved, grid)
+	assert motion == pytest.approx(0.25, abs=0.02)
+	# a frame of another size starts over
+	_, _, motion, _, _ = cozmo_perception.analyse(moved[:120, :160], grid)
+	assert motion == 0.0
+
+
+def test_analyse_occlusion():
+	rng = np.random.default_rng(4)
+	frame = rng.integers(60, 200, size=(240, 320), dtype=np.uint8)
+	assert cozmo_perception.analyse(frame)[3] < 0.05
+	# a finger over the lens: dark and flat
+	frame[:] = 10
+	assert cozmo_perception.analyse(frame)[3] > 0.95
+	# dark but textured isn't covered
+	frame[:] = rng.integers(0, 39, size=frame.shape, dtype=np.uint8)
+	assert cozmo_perception.analyse(frame)[3] < 0.2
+
+
+def test_worker_reads_the_ring(context):
+	ring = cozmo_perception.FrameRing(context, 2, 32, 24)
+	todo = context.Queue()
+	done = context.Queue()
+	process = context.Process(target=cozmo_perception.worker, args=(ring, todo, done), daemon=True)
+	process.start()
+	try:
+		ring.view(0, 32, 24)[:] = 10
+		ring.view(1, 32, 24)[:] = 250
+		todo.put((0, 1, 32, 24, 0.0))
+		todo.put((1, 2, 32, 24, 0.5))
+		first = done.get(timeout=60)
+		second = done.get(timeout=60)
+	finally:
+		todo.put(None)
+		process.join(60)
+	# a flat frame is flat everywhere but the left column of the grid, which has no neighbour to compare with
+	assert first[:3] == (0, 1, 0.0) and first[4] == 10.0 and first[6] == 0.875
+	assert second[:3] == (1, 2, 0.5) and second[4] == 250.0 and second[6] == 0.0
+	# the slots are shared, the worker saw the second frame change completely
+	assert second[5] == 1.0
+	assert sum(second[3]) == 32 * 24
+	assert process.exitcode == 0
+
+
+def test_handler_counts_frames_and_drops(context, monkeypatch):
+	# one slot: the first frame goes to the worker, the second finds no free slot
+	ring = cozmo_perception.FrameRing(context, 1, 32, 24)
+	worker = {'ring': ring, 'todo': queue.Queue(), 'free': [0], 'lock': threading.Lock(), 'frameid': 0}
+	monkeypatch.setattr(cu, 'perception', worker)
+	monkeypatch.setattr(cu, 'recorder', None)
+	monkeypatch.setattr(cu, 'perceptionstats', dict(cu.perceptionstats, frames=0, dropped=0, results=0))
+	image = Image.new('RGB', (32, 24), (90, 90, 90))
+	for _ in range(2):
+		cu.monitor_EvtNewCameraImage(None, image=type('CameraImage', (), {'raw_image': image})())
+	assert worker['todo'].get_nowait()[:4] == (0, 1, 32, 24)
+	assert (ring.view(0, 32, 24) == 90).all()
+	stats = cu.robot_perception_stats()
+	assert (stats['frames'], stats['dropped']) == (2, 1)
+	# a copy, later frames don't change it
+	cu.monitor_EvtNewCameraImage(None, image=type('CameraImage', (), {'raw_image': image})())
+	assert stats['frames'] == 2 and cu.robot_perception_stats()['frames'] == 3
@@ -0,0 +1,125 @@
+#
+# resource profiles: docked (states 1 and 2) the camera stream, expression estimation, the cubes and the reaction
+# triggers go off and the state loop polls slowly, leaving the charger puts them back on
+#
+import threading
+import pytest
+import cozmo_unleashed as cu
+
+
+class FakeWorld:
+	def __init__(self, sent):
+		self.sent = sent
+
+	def connect_to_cubes(self):
+		self.sent.append(('cubes', True))
+
+	def disconnect_from_cubes(self):
+		self.sent.append(('cubes', False))
+
+
+class FakeCamera:
+	def __init__(self, sent):
+		self.sent = sent
+		self._enabled = None
+
+	@property
+	def image_stream_enabled(self):
+		return self._enabled
+
+	@image_stream_enabled.setter
+	def image_stream_enabled(self, value):
+		self._enabled = value
+		self.sent.append(('camera', value))
+
+
+class FakeRobot:
+	def __init__(self):
+		self.sent = []
+		self.camera = FakeCamera(self.sent)
+		self.world = FakeWorld(self.sent)
+
+	def enable_facial_expression_estimation(self, enable=True):
+		self.sent.append(('expressions', enable))
+
+	def enable_all_reaction_triggers(self, should_be_enabled):
+		self.sent.append(('reactions', should_be_enabled))
+
+	def set_robot_volume(self, robot_volume):
+		self.sent.append(('volume', robot_volume))
+
+
+@pytest.fixture
+def robot(monkeypatch):
+	monkeypatch.setattr(cu, 'clock', cu.VirtualClock(0.0, 0.05))
+	monkeypatch.setattr(cu, 'robot', FakeRobot())
+	monkeypatch.setattr(cu, 'use_cubes', 1)
+	monkeypatch.setattr(cu, 'resources', {})
+	monkeypatch.setattr(cu, 'resourcestate', None)
+	monkeypatch.setattr(cu, 'controlthread', threading.current_thread())
+	monkeypatch.setattr(cu, 'robot_print_current_state', lambda currentstate, level=1: None)
+	statecontext = cu.StateContext(4)
+	statecontext.subscribe(cu.robot_state_profile)
+	monkeypatch.setattr(cu, 'statecontext', statecontext)
+	cu.robot_resource_start()
+	cu.robot_apply_profile()
+	cu.robot.sent.clear()
+	return cu.robot
+
+
+def switched_on():
+	return {name: cu.resources[name] for name in ('camera', 'expressions', 'cubes', 'reactions')}
+
+
+@pytest.mark.parametrize('docked', [1, 2])
+def test_docked_switches_off_and_back_on(robot, docked):
+	assert switched_on() == {'camera': True, 'expressions': True, 'cubes': True, 'reactions': True}
+	cu.statecontext.set(docked)
+	assert switched_on() == {'camera': False, 'expressions': False, 'cubes': False, 'reactions': False}
+	assert robot.camera.image_stream_enabled is False
+	assert {'camera': False, 'expressions': False, 'cubes': False, 'reactions': False}.items() <= dict(robot.sent).items()
+	assert cu.resources['poll'] == 2.0
+	robot.sent.clear()
+	cu.statecontext.set(4)
+	assert switched_on() == {'camera': True, 'expressions': True, 'cubes': True, 'reactions': True}
+	assert sorted(robot.sent) == sorted([('camera', True), ('expressions', True), ('cubes', True), ('reactions', True)] + ([('volume', cu.robotvolume)] if docked == 1 else []))
+	assert cu.resources['poll'] == 0.5
+
+
+def test_only_changes_are_sent(robot):
+	cu.statecontext.set(1)
+	robot.sent.clear()
+	# charging after the top up: the same profile, apart from the volume
+	cu.statecontext.set(2)
+	assert robot.sent == [('volume', cu.robotvolume)]
+	robot.sent.clear()
+	cu.robot_apply_profile()
+	assert robot.sent == []
+
+
+def test_unlisted_state_keeps_the_profile(robot):
+	cu.statecontext.set(1)
+	robot.sent.clear()
+	cu.statecontext.set(9)
+	assert robot.sent == []
+	assert switched_on() == {'camera': False, 'expressions': False, 'cubes': False, 'reactions': False}
+
+
+def test_cubes_stay_off_without_use_cubes(robot, monkeypatch):
+	monkeypatch.setattr(cu, 'use_cubes', 0)
+	cu.statecontext.set(1)
+	cu.statecontext.set(4)
+	assert cu.resources['cubes'] is False
+	assert ('cubes', True) not in robot.sent
+
+
+def test_other_threads_leave_it_to_the_control_loop(robot):
+	# a transition made by an event handler thread switches nothing until the state loop's next pass
+	thread = threading.Thread(target=cu.statecontext.set, args=(1,))
+	thread.start()
+	thread.join()
+	assert robot.sent == []
+	assert cu.resources['camera'] is True
+	cu.robot_apply_profile()
+	assert switched_on() == {'camera': False, 'expressions': False, 'cubes': False, 'reactions': False}
+	assert cu.resourcestate == 1
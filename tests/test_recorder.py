@@ -0,0 +1,122 @@
+#
+# camera frame recordings: written by FrameRecorder, read back by FrameReplay
+#
+import numpy as np
+import pytest
+import cozmo_recorder
+
+
+def camera_frame(value):
+	# a 320x240 grey frame, each pixel value + its row + its column so the decimation can be checked
+	rows, columns = np.indices((240, 320))
+	return ((value + rows + columns) % 256).astype(np.uint8)
+
+
+@pytest.fixture
+def path(tmp_path):
+	return str(tmp_path / 'frames.ring')
+
+
+def test_round_trip(path):
+	recorder = cozmo_recorder.FrameRecorder(path, 4, 160, 120, 2)
+	assert recorder.fits(320, 240)
+	assert not recorder.fits(160, 120)
+	recorder.write(camera_frame(0), 10.5, 5, 1.0, 2.0, 3.0, 45.0)
+	recorder.write(camera_frame(1), 11.0, 6, 4.0, 5.0, 6.0, -90.0)
+	recorder.close()
+	replay = cozmo_recorder.FrameReplay(path)
+	assert (replay.slots, replay.width, replay.height, replay.scale) == (4, 160, 120, 2)
+	assert len(replay) == 2
+	first, second = list(replay)
+	assert (first.seq, first.time, first.state, first.x, first.y, first.z, first.angle) == (1, 10.5, 5, 1.0, 2.0, 3.0, 45.0)
+	assert (second.seq, second.time, second.state, second.x, second.y, second.z, second.angle) == (2, 11.0, 6, 4.0, 5.0, 6.0, -90.0)
+	# every other pixel of every other row
+	assert first.pixels.shape == (120, 160)
+	assert (first.pixels == camera_frame(0)[::2, ::2]).all()
+	assert (second.pixels == camera_frame(1)[::2, ::2]).all()
+	# the frames are views of the map, it can't close while they're about
+	with pytest.raises(BufferError):
+		replay.map.close()
+	del first, second
+	replay.close()
+
+
+def test_wraparound_keeps_the_newest_oldest_first(path):
+	recorder = cozmo_recorder.FrameRecorder(path, 3, 16, 12, 2)
+	for i in range(8):
+		recorder.write(camera_frame(i), float(i), 5)
+	recorder.close()
+	replay = cozmo_recorder.FrameReplay(path)
+	assert [frame.seq for frame in replay] == [6, 7, 8]
+	assert [frame.time for frame in replay] == [5.0, 6.0, 7.0]
+	assert all((frame.pixels == camera_frame(int(frame.time))[:24:2, :32:2]).all() for frame in replay)
+	replay.close()
+
+
+def test_reopening_carries_on(path):
+	recorder = cozmo_recorder.FrameRecorder(path, 3, 16, 12, 2)
+	for i in range(4):
+		recorder.write(camera_frame(i), float(i), 5)
+	recorder.close()
+	recorder = cozmo_recorder.FrameRecorder(path, 3, 16, 12, 2)
+	assert recorder.seq == 4
+	recorder.write(camera_frame(9), 9.0, 6)
+	recorder.close()
+	replay = cozmo_recorder.FrameReplay(path)
+	assert [(frame.seq, frame.time) for frame in replay] == [(3, 2.0), (4, 3.0), (5, 9.0)]
+	replay.close()
+
+
+def test_other_geometry_starts_afresh(path):
+	recorder = cozmo_recorder.FrameRecorder(path, 3, 16, 12, 2)
+	recorder.write(camera_frame(0), 0.0, 5)
+	recorder.close()
+	# same size on disk, different shape
+	recorder = cozmo_recorder.FrameRecorder(path, 3, 12, 16, 2)
+	assert recorder.seq == 0
+	recorder.close()
+	replay = cozmo_recorder.FrameReplay(path)
+	assert (replay.width, replay.height) == (12, 16)
+	assert len(replay) == 0
+	replay.close()
+
+
+def test_half_written_slot_is_skipped(path):
+	recorder = cozmo_recorder.FrameRecorder(path, 3, 16, 12, 2)
+	recorder.write(camera_frame(0), 0.0, 5)
+	recorder.write(camera_frame(1), 1.0, 5)
+	# killed in the middle of a frame: the slot still has sequence number 0
+	cozmo_recorder.record.pack_into(recorder.map, cozmo_recorder.headersize + 2 * recorder.slotsize, 0, 2.0, 5, 0.0, 0.0, 0.0, 0.0)
+	recorder.close()
+	replay = cozmo_recorder.FrameReplay(path)
+	assert [frame.seq for frame in replay] == [1, 2]
+	replay.close()
+
+
+def test_not_a_recording(path):
+	with open(path, 'wb') as f:
+		f.write(b'\0' * 256)
+	assert cozmo_recorder.FrameReplay.geometry(path) is None
+	with pytest.raises(ValueError):
+		cozmo_recorder.FrameReplay(path)
+
+
+def test_feed(path):
+	recorder = cozmo_recorder.FrameRecorder(path, 4, 16, 12, 2)
+	recorder.write(camera_frame(0), 0.0, 5)
+	recorder.write(camera_frame(1), 1.0, 4)
+	recorder.write(camera_frame(2), 2.0, 6)
+	recorder.close()
+	replay = cozmo_recorder.FrameReplay(path)
+	images = []
+	replay.feed(lambda evt, image: images.append(image), states=(5, 6))
+	assert [image.image_number for image in images] == [1, 3]
+	assert [image.image_recv_time for image in images] == [0.0, 2.0]
+	# back at the camera's size and in RGB like an SDK camera image
+	assert images[0].raw_image.mode == 'RGB'
+	assert images[0].raw_image.size == (32, 24)
+	pixels = np.asarray(images[1].raw_image).astype(np.int16)
+	assert (pixels[:, :, 0] == pixels[:, :, 1]).all() and (pixels[:, :, 0] == pixels[:, :, 2]).all()
+	assert np.abs(pixels[::2, ::2, 0] - images[1].frame.pixels).mean() < 4
+	images.clear()
+	replay.close()
@@ -0,0 +1,160 @@
+#
+# robot_run_sequence() on a virtual clock: actions take virtual time, abort() is checked between steps and while an
+# action runs, failed steps are tried again and a required step that keeps failing ends the sequence
+#
+import asyncio
+import pytest
+import cozmo_unleashed as cu
+
+
+class FakeAction:
+	def __init__(self, seconds, fails):
+		self.end = cu.clock.time() + seconds
+		self.has_failed = fails
+		self.aborted = False
+
+	def wait_for_completed(self, timeout=None):
+		remaining = self.end - cu.clock.time()
+		if remaining > timeout:
+			cu.clock.sleep(timeout)
+			raise asyncio.TimeoutError()
+		if remaining > 0:
+			cu.clock.sleep(remaining)
+
+	def abort(self):
+		self.aborted = True
+
+
+class FakeRobot:
+	# every action takes the time set in seconds and the first failures[name] attempts fail
+	def __init__(self):
+		self.started = []
+		self.actions = []
+		self.seconds = {}
+		self.failures = {}
+
+	def __getattr__(self, name):
+		def start(*args, **kwargs):
+			self.started.append((name, kwargs.get('in_parallel', False)))
+			fails = self.failures.get(name, 0) > 0
+			if fails:
+				self.failures[name] -= 1
+			action = FakeAction(self.seconds.get(name, 1.0), fails)
+			self.actions.append(action)
+			return action
+		return start
+
+
+@pytest.fixture
+def robot(monkeypatch):
+	monkeypatch.setattr(cu, 'clock', cu.VirtualClock(0.0, 0.05))
+	monkeypatch.setattr(cu, 'robot', FakeRobot())
+	monkeypatch.setattr(cu, 'sequencetrace', cu.collections.deque(maxlen=200))
+	monkeypatch.setattr(cu, 'robot_print_current_state', lambda currentstate, level=1: None)
+	return cu.robot
+
+
+def trace():
+	return [(step, tries, result) for start, sequence, step, seconds, tries, result in cu.sequencetrace]
+
+
+def test_all_steps_run(robot):
+	called = []
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('turn', 'turn_in_place', 90),
+		cu.robot_step('note', called.append, 'noted'),
+		cu.robot_step('drive', 'drive_straight', 100),
+	])
+	assert result == 'done'
+	assert [name for name, _ in robot.started] == ['turn_in_place', 'drive_straight']
+	assert called == ['noted']
+	assert trace() == [('turn', 1, 'ok'), ('note', 1, 'ok'), ('drive', 1, 'ok')]
+	assert cu.clock.time() == pytest.approx(2.0)
+
+
+def test_abort_between_steps(robot):
+	stop = []
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('turn', 'turn_in_place', 90),
+		cu.robot_step('stop', stop.append, True),
+		cu.robot_step('drive', 'drive_straight', 100),
+	], lambda: bool(stop))
+	assert result == 'aborted'
+	assert [name for name, _ in robot.started] == ['turn_in_place']
+	assert trace() == [('turn', 1, 'ok'), ('stop', 1, 'ok')]
+
+
+def test_abort_while_action_runs(robot):
+	robot.seconds['drive_straight'] = 10.0
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('drive', 'drive_straight', 100),
+		cu.robot_step('lift', 'set_lift_height', 1.0),
+	], lambda: cu.clock.time() >= 2.0)
+	assert result == 'aborted'
+	assert [name for name, _ in robot.started] == ['drive_straight']
+	assert robot.actions[0].aborted
+	assert trace() == [('drive', 1, 'aborted')]
+	# stopped within a poll of the abort, not when the drive would have finished
+	assert cu.clock.time() < 2.0 + cu.steppoll + 0.1
+
+
+def test_abort_during_retry_backoff(robot):
+	robot.failures['drive_straight'] = 1
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('drive', 'drive_straight', 100, retries=3),
+		cu.robot_step('lift', 'set_lift_height', 1.0),
+	], lambda: cu.clock.time() > 1.2)
+	assert result == 'aborted'
+	assert [name for name, _ in robot.started] == ['drive_straight']
+	assert trace() == [('drive', 1, 'failed'), ('drive', 1, 'aborted')]
+
+
+def test_retries_back_off(robot):
+	robot.failures['turn_in_place'] = 2
+	result = cu.robot_run_sequence('test', [cu.robot_step('turn', 'turn_in_place', 90, retries=2, required=True)])
+	assert result == 'done'
+	assert trace() == [('turn', 1, 'failed'), ('turn', 2, 'failed'), ('turn', 3, 'ok')]
+	# three one second tries and pauses of stepbackoff, then twice that
+	assert cu.clock.time() == pytest.approx(3.0 + cu.stepbackoff * 3)
+
+
+def test_required_step_fails_the_sequence(robot):
+	robot.failures['turn_in_place'] = 5
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('turn', 'turn_in_place', 90, retries=1, required=True),
+		cu.robot_step('drive', 'drive_straight', 100),
+	])
+	assert result == 'failed'
+	assert [name for name, _ in robot.started] == ['turn_in_place', 'turn_in_place']
+	assert trace() == [('turn', 1, 'failed'), ('turn', 2, 'failed')]
+
+
+def test_optional_step_failure_carries_on(robot):
+	robot.failures['turn_in_place'] = 1
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('turn', 'turn_in_place', 90),
+		cu.robot_step('drive', 'drive_straight', 100),
+	])
+	assert result == 'done'
+	assert trace() == [('turn', 1, 'failed'), ('drive', 1, 'ok')]
+
+
+def test_timeout_aborts_the_action(robot):
+	robot.seconds['go_to_pose'] = 60.0
+	result = cu.robot_run_sequence('test', [cu.robot_step('go to pose', 'go_to_pose', None, timeout=2, required=True)])
+	assert result == 'failed'
+	assert robot.actions[0].aborted
+	assert trace() == [('go to pose', 1, 'timeout')]
+	assert cu.clock.time() == pytest.approx(2.0, abs=cu.steppoll)
+
+
+def test_parallel_steps_start_together(robot):
+	result = cu.robot_run_sequence('test', [
+		cu.robot_step('drive', 'drive_straight', 100),
+		cu.robot_step('head', 'set_head_angle', 0, parallel=True),
+		cu.robot_step('lift', 'set_lift_height', 0),
+	])
+	assert result == 'done'
+	assert robot.started == [('drive_straight', True), ('set_head_angle', True), ('set_lift_height', False)]
+	# the drive and the head move overlap
+	assert cu.clock.time() == pytest.approx(2.0)
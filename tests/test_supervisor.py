@@ -0,0 +1,75 @@
+#
+# cozmo_supervisor.py: every robot gets a module copy of its own, only the calibration store is shared
+#
+import threading
+import pytest
+import cozmo
+import cozmo_sim as sim
+import cozmo_supervisor
+
+
+@pytest.fixture
+def instances(tmp_path, monkeypatch):
+	monkeypatch.setattr(cozmo_supervisor, 'calibration', {})
+	monkeypatch.setattr(cozmo_supervisor, 'calibrationlock', threading.Lock())
+	return [cozmo_supervisor.RobotInstance(name, str(tmp_path), None) for name in ('one', 'two')]
+
+
+def test_module_copies_are_separate(instances):
+	one, two = instances
+	assert one.cu is not two.cu
+	assert one.cu.__name__ == 'cozmo_unleashed_one' and two.cu.__name__ == 'cozmo_unleashed_two'
+	assert one.cu.logfile != two.cu.logfile
+	one.cu.statecontext.set(4)
+	one.cu.commandcache['set_head_light'] = (True, 0.0)
+	assert two.cu.statecontext.state == 0
+	assert two.cu.commandcache == {}
+	assert one.cu.robot_resource_start is not two.cu.robot_resource_start
+	# the calibration store is the one thing they share
+	assert one.cu.calibration is two.cu.calibration is cozmo_supervisor.calibration
+	assert one.cu.calibrationlock is two.cu.calibrationlock is cozmo_supervisor.calibrationlock
+
+
+def test_simulated_robots_run_side_by_side(instances):
+	worlds = []
+	for seed, instance in enumerate(instances):
+		clock = instance.cu.VirtualClock(0.0, sim.simtick)
+		instance.cu.clock = clock
+		worlds.append(sim.SimWorld(seed, 'cycle', clock))
+	for instance, world in zip(instances, worlds):
+		cozmo_supervisor.start_sim_robot(instance, world, 300, None)
+	for instance in instances:
+		instance.thread.join(120)
+		assert not instance.thread.is_alive()
+	for instance, world in zip(instances, worlds):
+		instance.cu.unmonitor(world.robot)
+		assert instance.error is None
+		assert instance.cu.robot is world.robot
+		assert instance.cu.statecontext.transitions > 0
+		assert 'connecting' not in instance.status() and 'stopped' not in instance.status()
+	one, two = instances
+	# each state machine ran on its own robot and its own clock
+	assert one.cu.robot is not two.cu.robot
+	assert one.cu.statecontext is not two.cu.statecontext
+	assert one.cu.clock.time() == pytest.approx(two.cu.clock.time(), abs=1)
+
+
+def test_android_forward(monkeypatch):
+	connector = cozmo_supervisor.AndroidConnector('phone', cozmo.run.COZMO_PORT + 100)
+	calls = []
+	monkeypatch.setattr(connector, '_exec', lambda *args: calls.append(args))
+	connector._add_forward('phone')
+	connector._remove_forward('phone')
+	assert connector.cozmo_port == cozmo.run.COZMO_PORT + 100
+	assert calls == [
+		('-s', 'phone', 'forward', 'tcp:%d' % (cozmo.run.COZMO_PORT + 100), 'tcp:%d' % cozmo.run.COZMO_PORT),
+		('-s', 'phone', 'forward', '--remove', 'tcp:%d' % (cozmo.run.COZMO_PORT + 100)),
+	]
+
+
+def test_sdk_version():
+	# the internals the supervisor uses are still where it expects them
+	assert cozmo.__version__ == cozmo_supervisor.sdkversion
+	assert 'base' in dir(cozmo) and hasattr(cozmo.base, '_SyncProxy')
+	assert hasattr(cozmo.run.AndroidConnector, '_add_forward') and hasattr(cozmo.run.AndroidConnector, '_exec')
+	assert '_sync_abort_future' in cozmo.base.Base.__init__.__code__.co_varnames